@@ -4,28 +4,49 @@ aws_iot_publisher.py
 Publishes smart plug readings to AWS IoT Core via MQTT over TLS (port 8883).
 
 Design:
-  - One connect → publish → disconnect per call.
-    Simple and reliable for a 10-second poll loop. No persistent connection
-    state to manage across threads.
+  - One long-lived IoTPublisher holds a single MQTT client, so the mutual-TLS
+    handshake happens once, not once per reading. paho's network thread
+    keeps the session alive and reconnects with exponential backoff
+    (1s → 60s) after a drop.
+  - publish() only builds the payload and appends it to a bounded in-memory
+    queue; it never touches the network or disk and returns immediately.
+  - Store-and-forward: while IoT Core is unreachable (or older messages are
+    still waiting) the sender thread moves readings into a SQLite spool
+    (spool.py, IOT_SPOOL_PATH) instead of dropping them. After reconnecting
+    it replays the spool oldest-first at IOT_REPLAY_RATE msg/s and deletes
+    each row on PUBACK, so readings survive restarts too. The spool is
+    capped at IOT_SPOOL_MAX_MB; the oldest readings are evicted past that.
+  - metrics() reports queue depth, oldest spooled age and replay throughput.
+  - Batch mode (IOT_BATCH=1): instead of one message per reading, readings
+    from all devices are accumulated and sent as one columnar message to
+    plug/readings/batch once IOT_BATCH_MAX readings are waiting or the
+    oldest has waited IOT_BATCH_LATENCY seconds. IOT_BATCH_GZIP=1 gzips
+    the JSON. See _encode_batch() for the layout.
   - If IOT_ENDPOINT is not set in .env the function is a silent no-op,
     so the dashboard still starts during local dev/testing.
   - Uses paho-mqtt 2.x CallbackAPIVersion.VERSION2 API.
 
-Topic: plug/readings
+Topic: plug/readings (plug/readings/batch in batch mode)
 AWS IoT policy allows:
   iot:Connect  → client ID: orange-pi-smart-plug
-  iot:Publish  → topic:     plug/readings
+  iot:Publish  → topic:     plug/readings, plug/readings/batch
 """
 
+import atexit
+import gzip
 import json
 import os
 import ssl
 import threading
+import time
+from collections import deque
 from datetime import datetime, timezone
 
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 
+from spool import Spool
+
 load_dotenv("/mnt/nvme/Projects/dashboard/.env")
 
 # ── AWS IoT config (set these in .env) ────────────────────────────────────────
@@ -33,6 +54,7 @@ IOT_ENDPOINT  = os.getenv("IOT_ENDPOINT")   # e.g. a2mwi46ureof9h-ats.iot.ap-sou
 IOT_CLIENT_ID = os.getenv("IOT_CLIENT_ID", "orange-pi-smart-plug")
 IOT_PORT      = 8883
 IOT_TOPIC     = "plug/readings"
+IOT_BATCH_TOPIC = "plug/readings/batch"
 
 # ── Cert paths (copied via scp in setup) ──────────────────────────────────────
 _CERT_DIR   = "/mnt/nvme/Projects/dashboard/certs"
@@ -40,34 +62,31 @@ CA_CERT     = os.path.join(_CERT_DIR, "amazon-root-ca.pem")
 DEVICE_CERT = os.path.join(_CERT_DIR, "device-cert.pem")
 PRIVATE_KEY = os.path.join(_CERT_DIR, "device-private-key.pem")
 
-_CONNECT_TIMEOUT_S = 5   # seconds to wait for CONNACK before giving up
-_PUBLISH_TIMEOUT_S = 5   # seconds to wait for PUBACK (QoS 1)
+IOT_MAX_QUEUE    = int(os.getenv("IOT_MAX_QUEUE", 1000))       # in-memory, before spooling
+IOT_SPOOL_PATH   = os.getenv("IOT_SPOOL_PATH", "/mnt/nvme/Projects/dashboard/iot_spool.db")
+IOT_SPOOL_MAX_MB = float(os.getenv("IOT_SPOOL_MAX_MB", 50))
+IOT_REPLAY_RATE  = float(os.getenv("IOT_REPLAY_RATE", 20))     # spooled messages / second
 
+IOT_BATCH         = os.getenv("IOT_BATCH", "0") == "1"
+IOT_BATCH_MAX     = int(os.getenv("IOT_BATCH_MAX", 100))         # readings per message
+IOT_BATCH_LATENCY = float(os.getenv("IOT_BATCH_LATENCY", 60))    # max seconds a reading waits
+IOT_BATCH_GZIP    = os.getenv("IOT_BATCH_GZIP", "0") == "1"
 
-def publish(device_key: str, status: dict, wh_delta: float) -> bool:
-    """
-    Publish one energy reading to AWS IoT Core.
+_KEEPALIVE_S       = 60  # MQTT keepalive on the persistent session
+_CONNECT_TIMEOUT_S = 5   # worker re-checks the queue at least this often while offline
+_RECONNECT_MIN_S   = 1
+_RECONNECT_MAX_S   = 60
 
-    Args:
-        device_key:  'plug' or 'server'  (matches DEVICES keys in tuya_local.py)
-        status:      dict returned by tuya_local.get_status()
-        wh_delta:    Wh consumed since the previous poll (calculated in plug_polling_loop)
 
-    Returns:
-        True on successful delivery, False on any error.
+_BATCH_FIELDS = ("device_key", "device_name", "switch", "watts",
+                 "voltage", "current_ma", "add_ele_kwh", "wh_delta")
 
-    Call this immediately after a successful tuya poll + DB insert.
-    Any exception is caught and printed — never raises, so it cannot crash
-    the polling thread.
-    """
-    if not IOT_ENDPOINT:
-        # Silent no-op if env var is missing (e.g. local dev without certs)
-        return False
 
-    payload = {
+def _payload(device_key: str, status: dict, wh_delta: float, ts: float) -> dict:
+    return {
         "device_key":  device_key,
         "device_name": status.get("device_name"),
-        "timestamp":   datetime.now(timezone.utc).isoformat(),
+        "timestamp":   datetime.fromtimestamp(ts, timezone.utc).isoformat(),
         "switch":      status.get("switch"),
         "watts":       status.get("watts"),
         "voltage":     status.get("voltage"),
@@ -76,46 +95,358 @@ def publish(device_key: str, status: dict, wh_delta: float) -> bool:
         "wh_delta":    round(wh_delta, 6),
     }
 
-    connected_event = threading.Event()
-    connect_error: list[str] = []
 
-    def _on_connect(client, userdata, connect_flags, reason_code, properties):
-        if reason_code.is_failure:
-            connect_error.append(str(reason_code))
-        else:
-            connected_event.set()
+def _encode_batch(readings: list, compress: bool = False):
+    """
+    Pack [(ts, payload)] into one columnar message:
+
+        {"schema": "plug.readings.batch.v1", "count": 3,
+         "t0": 1718000000.0,            # epoch seconds of the first reading
+         "dt": [0, 0.02, 10.01],        # seconds after t0, per reading
+         "device_key": [...], "watts": [...], ...}   # one array per field
+
+    Returns compact JSON text, or gzip bytes when `compress` is set.
+    """
+    t0 = readings[0][0]
+    doc = {
+        "schema": "plug.readings.batch.v1",
+        "count":  len(readings),
+        "t0":     round(t0, 3),
+        "dt":     [round(ts - t0, 3) for ts, _ in readings],
+    }
+    for field in _BATCH_FIELDS:
+        doc[field] = [p[field] for _, p in readings]
+    text = json.dumps(doc, separators=(",", ":"))
+    return gzip.compress(text.encode()) if compress else text
+
+
+class IoTPublisher:
+    """Persistent MQTT session to AWS IoT Core with a non-blocking publish()."""
+
+    def __init__(self, endpoint: str = IOT_ENDPOINT, topic: str = IOT_TOPIC,
+                 max_queue: int = IOT_MAX_QUEUE,
+                 spool_path: str = IOT_SPOOL_PATH,
+                 spool_max_mb: float = IOT_SPOOL_MAX_MB,
+                 replay_rate: float = IOT_REPLAY_RATE,
+                 batch: bool = IOT_BATCH,
+                 batch_max: int = IOT_BATCH_MAX,
+                 batch_latency: float = IOT_BATCH_LATENCY,
+                 batch_gzip: bool = IOT_BATCH_GZIP):
+        self.endpoint     = endpoint
+        self.topic        = IOT_BATCH_TOPIC if batch and topic == IOT_TOPIC else topic
+        self.batch         = batch
+        self.batch_max     = max(1, batch_max)
+        self.batch_latency = batch_latency
+        self.batch_gzip    = batch_gzip
+        self.max_queue    = max_queue
+        self.spool_path   = spool_path
+        self.spool_max_mb = spool_max_mb
+        self.replay_rate  = replay_rate
+
+        self._buf: deque  = deque()
+        self._cond        = threading.Condition()
+        self._connected   = threading.Event()
+        self._client      = None
+        self._spool       = None
+        self._thread      = None
+        self._closed      = False
+
+        # Messages handed to paho and waiting for PUBACK: mid -> spool id
+        # (None for messages sent straight from memory)
+        self._inflight       = {}
+        self._early_acks     = set()          # PUBACKs that beat the _inflight entry
+        self._inflight_lock  = threading.Lock()
+        self._replay_cursor  = 0              # highest spool id handed out
+        self._replay_acks    = deque()        # ack times, for throughput
+
+        self.readings   = 0     # readings encoded into messages
+        self.messages   = 0     # messages produced (== readings unless batching)
+        self.sent       = 0     # handed to the MQTT client
+        self.acked      = 0     # PUBACK received
+        self.replayed   = 0     # spooled messages acked
+        self.dropped    = 0     # evicted from a full in-memory queue
+        self.connects   = 0
+        self.last_error = None
+
+    # ── Public API ──────────────────────────────────────────────────────────
+
+    def publish(self, device_key: str, status: dict, wh_delta: float) -> bool:
+        """
+        Queue one reading. Returns True if queued, False if publishing is
+        disabled (no IOT_ENDPOINT) or the publisher is closed. Never blocks
+        on the network and never raises.
+        """
+        if not self.endpoint or self._closed:
+            return False
+        ts = time.time()
+        try:
+            reading = (ts, _payload(device_key, status, wh_delta, ts))
+        except Exception as e:
+            print(f"[aws_iot] payload error ({device_key}): {e}")
+            return False
+
+        self.start()
+        with self._cond:
+            if len(self._buf) >= self.max_queue:
+                self._buf.popleft()
+                self.dropped += 1
+            self._buf.append(reading)
+            self._cond.notify()
+        return True
+
+    def pending(self) -> int:
+        """Readings not yet handed to MQTT: in memory plus spooled."""
+        with self._cond:
+            n = len(self._buf)
+        return n + (self._spool.depth() if self._spool else 0)
+
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def metrics(self) -> dict:
+        now = time.time()
+        with self._inflight_lock:
+            while self._replay_acks and now - self._replay_acks[0] > 60:
+                self._replay_acks.popleft()
+            replay_rate = len(self._replay_acks) / 60.0
+        spool = self._spool
+        return {
+            "connected":         self.connected(),
+            "memory_depth":      len(self._buf),
+            "spool_depth":       spool.depth() if spool else 0,
+            "spool_bytes":       spool.size_bytes() if spool else 0,
+            "oldest_age_s":      round(spool.oldest_age(), 1) if spool else 0.0,
+            "replay_msgs_per_s": round(replay_rate, 2),
+            "batch_mode":        self.batch,
+            "readings_per_msg":  round(self.readings / self.messages, 1) if self.messages else 0.0,
+            "sent":              self.sent,
+            "acked":             self.acked,
+            "replayed":          self.replayed,
+            "dropped":           self.dropped + (spool.evicted if spool else 0),
+            "connects":          self.connects,
+            "last_error":        self.last_error,
+        }
 
-    try:
+    def start(self) -> None:
+        """Open the spool and MQTT session and start the sender thread (idempotent)."""
+        with self._cond:
+            if self._thread is not None or self._closed or not self.endpoint:
+                return
+            self._spool = self._open_spool()
+            try:
+                self._client = self._make_client()
+                self._client.connect_async(self.endpoint, IOT_PORT, keepalive=_KEEPALIVE_S)
+                self._client.loop_start()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[aws_iot] client setup error: {e}")
+                self._client = None
+            self._thread = threading.Thread(
+                target=self._run, name="aws-iot-publisher", daemon=True)
+            self._thread.start()
+
+    def close(self, drain_timeout: float = 5) -> None:
+        """Spool whatever is still in memory, then disconnect."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=drain_timeout)
+        if self._client is not None:
+            try:
+                self._client.disconnect()
+                self._client.loop_stop()
+            except Exception:
+                pass
+        if self._spool is not None:
+            if thread is not None and thread.is_alive():
+                # Sender is still mid-write; closing under it would raise there
+                print(f"[aws_iot] sender still running after {drain_timeout}s, leaving spool open")
+            else:
+                self._spool.close()
+
+    # ── Internals ───────────────────────────────────────────────────────────
+
+    def _open_spool(self) -> Spool:
+        max_bytes = int(self.spool_max_mb * 1024 * 1024)
+        try:
+            return Spool(self.spool_path, max_bytes)
+        except Exception as e:
+            # Still buffer through an outage, just not across restarts
+            print(f"[aws_iot] spool {self.spool_path} unavailable ({e}), using memory")
+            return Spool(":memory:", max_bytes)
+
+    def _make_client(self):
         client = mqtt.Client(
             callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
             client_id=IOT_CLIENT_ID,
         )
-        client.on_connect = _on_connect
         client.tls_set(
             ca_certs=CA_CERT,
             certfile=DEVICE_CERT,
             keyfile=PRIVATE_KEY,
             tls_version=ssl.PROTOCOL_TLS_CLIENT,
         )
+        client.reconnect_delay_set(min_delay=_RECONNECT_MIN_S, max_delay=_RECONNECT_MAX_S)
+        client.on_connect    = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish    = self._on_publish
+        return client
 
-        client.connect(IOT_ENDPOINT, IOT_PORT, keepalive=10)
-        client.loop_start()
+    def _on_connect(self, client, userdata, connect_flags, reason_code, properties):
+        if reason_code.is_failure:
+            self.last_error = str(reason_code)
+            print(f"[aws_iot] connect failed: {reason_code}")
+            return
+        self.connects += 1
+        self._connected.set()
+        print(f"[aws_iot] connected to {self.endpoint}")
+        with self._cond:
+            self._cond.notify()
 
-        if not connected_event.wait(timeout=_CONNECT_TIMEOUT_S):
-            client.loop_stop()
-            client.disconnect()
-            reason = connect_error[0] if connect_error else "timeout"
-            print(f"[aws_iot] connect failed ({device_key}): {reason}")
-            return False
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        self._connected.clear()
+        if not self._closed:
+            self.last_error = str(reason_code)
+            print(f"[aws_iot] disconnected ({reason_code}), reconnecting")
 
-        msg_info = client.publish(IOT_TOPIC, json.dumps(payload), qos=1)
-        msg_info.wait_for_publish(timeout=_PUBLISH_TIMEOUT_S)
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        self.acked += 1
+        with self._inflight_lock:
+            if mid not in self._inflight:
+                self._early_acks.add(mid)
+                return
+            spool_id = self._inflight.pop(mid)
+        if spool_id is not None:
+            self._replay_acked(spool_id)
 
-        client.loop_stop()
-        client.disconnect()
-        print(f"[aws_iot] published {device_key} → {IOT_TOPIC} ({status['watts']}W)")
-        return True
+    def _track(self, mid: int, spool_id) -> None:
+        """Record a message handed to paho, unless its PUBACK already arrived."""
+        with self._inflight_lock:
+            if mid in self._early_acks:
+                self._early_acks.discard(mid)
+            else:
+                self._inflight[mid] = spool_id
+                return
+        if spool_id is not None:
+            self._replay_acked(spool_id)
+
+    def _replay_acked(self, spool_id: int) -> None:
+        with self._inflight_lock:
+            self.replayed += 1
+            self._replay_acks.append(time.time())
+        self._spool.delete([spool_id])
+
+    def _run(self) -> None:
+        held = []           # batch mode: readings waiting for the next message
+        while True:
+            timeout = _CONNECT_TIMEOUT_S
+            if held:
+                timeout = min(timeout, max(0.0, held[0][0] + self.batch_latency - time.time()))
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._buf or (
+                        self._connected.is_set() and self._spool.depth() > 0),
+                    timeout=timeout)
+                readings = list(self._buf)
+                self._buf.clear()
+                closed = self._closed
+
+            try:
+                if self.batch:
+                    held += readings
+                    batch, held = self._take_batches(held, flush_all=closed)
+                else:
+                    batch = [json.dumps(p) for _, p in readings]
+                    self.readings += len(batch)
+                    self.messages += len(batch)
+                if batch:
+                    # Straight to MQTT only if nothing older is waiting in the spool
+                    if self._connected.is_set() and self._spool.depth() == 0 and not closed:
+                        batch = self._send_direct(batch)
+                    self._spool.append(batch)
+                if closed:
+                    return
+                if self._connected.is_set() and self._spool.depth() > 0:
+                    self._replay_slice()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[aws_iot] sender error: {e}")
+                time.sleep(1)
+
+    def _take_batches(self, held: list, flush_all: bool = False):
+        """Encode full batches, plus a partial one once its oldest reading is due."""
+        out = []
+        while len(held) >= self.batch_max:
+            chunk, held = held[:self.batch_max], held[self.batch_max:]
+            out.append(self._encode(chunk))
+        if held and (flush_all or time.time() - held[0][0] >= self.batch_latency):
+            out.append(self._encode(held))
+            held = []
+        return out, held
+
+    def _encode(self, chunk: list):
+        self.readings += len(chunk)
+        self.messages += 1
+        return _encode_batch(chunk, self.batch_gzip)
+
+    def _send_direct(self, batch: list) -> list:
+        """Publish in order; return whatever could not be handed to paho."""
+        for i, message in enumerate(batch):
+            info = self._client.publish(self.topic, message, qos=1)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.last_error = mqtt.error_string(info.rc)
+                return batch[i:]
+            self._track(info.mid, None)
+            self.sent += 1
+        return []
+
+    def _replay_slice(self, seconds: float = 1.0) -> None:
+        """Replay up to replay_rate × seconds spooled messages, paced evenly."""
+        with self._inflight_lock:
+            if not any(v is not None for v in self._inflight.values()):
+                # Nothing awaiting PUBACK, so anything still spooled was never
+                # acknowledged (lost in a disconnect or a restart) — go again
+                self._replay_cursor = 0
+        limit = max(1, int(self.replay_rate * seconds))
+        rows = self._spool.peek(self._replay_cursor, limit)
+        if not rows:
+            time.sleep(0.2)     # everything spooled is in flight — wait for PUBACKs
+            return
+        gap = 1.0 / self.replay_rate if self.replay_rate > 0 else 0.0
 
-    except Exception as e:
-        print(f"[aws_iot] publish error ({device_key}): {e}")
-        return False
+        for spool_id, message in rows:
+            if not self._connected.is_set() or self._closed:
+                return
+            # Not under _inflight_lock: paho runs on_publish under its own lock
+            info = self._client.publish(self.topic, message, qos=1)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.last_error = mqtt.error_string(info.rc)
+                return
+            self._track(info.mid, spool_id)
+            self._replay_cursor = spool_id
+            self.sent += 1
+            time.sleep(gap)
+
+
+publisher = IoTPublisher()
+atexit.register(publisher.close)
+
+
+def publish(device_key: str, status: dict, wh_delta: float) -> bool:
+    """
+    Queue one energy reading for AWS IoT Core.
+
+    Args:
+        device_key:  registry key, e.g. 'plug'  (matches DEVICES keys in tuya_local.py)
+        status:      dict returned by tuya_local.get_status()
+        wh_delta:    Wh consumed since the previous poll (calculated in plug_polling_loop)
+
+    Returns:
+        True if the reading was queued, False if publishing is disabled.
+
+    Delivery happens on the publisher's own thread over the persistent
+    session, so this is safe to call from the polling loop; it never raises.
+    """
+    return publisher.publish(device_key, status, wh_delta)
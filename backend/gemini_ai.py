@@ -3,11 +3,12 @@ import os
 import time
 import json
 import requests
-import subprocess
 import google.generativeai as genai
 
 from dotenv import load_dotenv
 
+import sys_sampler      # repo root, on PYTHONPATH (see ecosystem.config.js)
+
 
 # --- CONFIGURATION ---
 
@@ -24,6 +25,11 @@ CACHE_FILE = "/mnt/nvme/Projects/dashboard/gemini_cache.txt"
 
 CACHE_DURATION = 1800 
 
+TOP_APP_WINDOW = 0.5     # seconds between the two /proc snapshots behind top_app
+
+# Private to this process's reports, so no other caller moves its baseline
+_sampler = sys_sampler.SystemSampler()
+
 
 
 genai.configure(api_key=API_KEY)
@@ -69,9 +75,11 @@ def get_live_data():
             stats['cpu_percent'] = round(float(cpu_res['data']['result'][0]['value'][1]), 1)
 
 
-        cmd = "ps -eo comm,%cpu --sort=-%cpu | awk 'NR>1 && $1!=\"ps\" && $1!=\"awk\" {printf \"%-15s %s\\n\", $1, $2}' | head -6"
-
-        stats['top_app'] = subprocess.check_output(cmd, shell=True).decode('utf-8').strip()
+        # Two /proc snapshots TOP_APP_WINDOW apart instead of forking ps | awk | head:
+        # CPU over the last half second, not a lifetime or since-last-request average
+        _sampler.top_processes()
+        time.sleep(TOP_APP_WINDOW)
+        stats['top_app'] = "\n".join("%-15s %s" % (comm, cpu) for comm, cpu in _sampler.top_processes(6))
 
     except Exception: pass
 
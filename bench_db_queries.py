@@ -0,0 +1,226 @@
+"""
+bench_db_queries.py
+===================
+Benchmark the energy-page queries against a synthetic year of readings.
+
+Creates (or reuses) a scratch database, fills plug_energy with one reading
+per device every `--interval` seconds for `--days` days, then times the old
+non-sargable predicates (DATE(polled_at) = ..., DATE_FORMAT(date, ...) = ...)
+and raw-row hourly GROUP BY against the half-open range queries and
+plug_hourly_summary rollup db.py now uses.
+
+    python bench_db_queries.py --devices 10 --days 365 > bench_output.txt
+    python bench_db_queries.py --skip-load          # re-run timings only
+
+Uses the DB_HOST/DB_USER/DB_PASSWORD settings from .env but never touches
+DB_NAME — data goes into --database (default: homelab_bench).
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--database", default="homelab_bench")
+    p.add_argument("--devices",  type=int, default=10)
+    p.add_argument("--days",     type=int, default=365)
+    p.add_argument("--interval", type=int, default=10, help="seconds between readings")
+    p.add_argument("--repeat",   type=int, default=5,  help="timed runs per query")
+    p.add_argument("--skip-load", action="store_true", help="reuse existing data")
+    return p.parse_args()
+
+
+args = parse_args()
+
+# db.py reads DB_NAME at import time — point it at the scratch database first
+os.environ["DB_NAME"] = args.database
+_conn = mysql.connector.connect(
+    host=os.getenv("DB_HOST", "db"),
+    port=int(os.getenv("DB_PORT", 3306)),
+    user=os.getenv("DB_USER", "nextcloud"),
+    password=os.getenv("DB_PASSWORD", "your_strong_password"),
+)
+_conn.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+_conn.close()
+
+import db       # noqa: E402
+import schema   # noqa: E402
+
+
+# ── Data load ──────────────────────────────────────────────────────────────
+
+def load_data(devices: int, days: int, interval: int, chunk: int = 20000) -> int:
+    """Insert synthetic readings (and hourly/daily summaries) ending now."""
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        for table in ("plug_energy", "plug_hourly_summary",
+                      "plug_daily_summary", "plug_monthly_summary"):
+            cursor.execute(f"TRUNCATE TABLE {table}")
+        cursor.close()
+
+    end   = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=days)
+    steps = int((end - start).total_seconds()) // interval
+    total = 0
+    t0 = time.perf_counter()
+
+    for d in range(devices):
+        device_id, name = f"bench-{d:03d}", f"Bench Plug {d}"
+        base_w = random.uniform(5, 400)
+        batch = []
+        for i in range(steps):
+            ts = start + timedelta(seconds=i * interval)
+            w  = max(0.0, random.gauss(base_w, base_w * 0.1))
+            batch.append((device_id, name, round(w, 1), w * interval / 3600,
+                          round(random.gauss(240, 2), 1), int(w / 240 * 1000), ts))
+            if len(batch) >= chunk:
+                _insert(batch)
+                total += len(batch)
+                batch.clear()
+        if batch:
+            _insert(batch)
+            total += len(batch)
+        print(f"  loaded {device_id}: {total:,} rows ({time.perf_counter() - t0:.0f}s)", flush=True)
+
+    for d in range(devices):
+        device_id = f"bench-{d:03d}"
+        for offset in range(days + 1):
+            day = (end.date() - timedelta(days=offset)).isoformat()
+            db.aggregate_daily(device_id, day)
+            db.aggregate_hourly(device_id, day)
+    return total
+
+
+def _insert(rows: list) -> None:
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO plug_energy
+                (device_id, device_name, watts, wh_delta, voltage, current_ma, polled_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, rows)
+        cursor.close()
+
+
+# ── Queries ────────────────────────────────────────────────────────────────
+# Legacy forms are copied verbatim from db.py before the range rewrite.
+
+def legacy_today_summary(device_id: str) -> None:
+    _query("""
+        SELECT COALESCE(SUM(wh_delta), 0) AS total_wh
+        FROM plug_energy
+        WHERE DATE(polled_at) = %s AND device_id = %s
+    """, (date.today().isoformat(), device_id))
+
+
+def legacy_aggregate_daily_scan(device_id: str) -> None:
+    _query("""
+        SELECT device_id, device_name, SUM(wh_delta), AVG(watts), MAX(watts), COUNT(*)
+        FROM plug_energy
+        WHERE DATE(polled_at) = %s AND device_id = %s
+        GROUP BY device_id, device_name
+    """, (date.today().isoformat(), device_id))
+
+
+def range_aggregate_daily_scan(device_id: str) -> None:
+    start, end = db._day_bounds(date.today().isoformat())
+    _query("""
+        SELECT device_id, device_name, SUM(wh_delta), AVG(watts), MAX(watts), COUNT(*)
+        FROM plug_energy
+        WHERE device_id = %s AND polled_at >= %s AND polled_at < %s
+        GROUP BY device_id, device_name
+    """, (device_id, start, end))
+
+
+def legacy_monthly_scan(device_id: str) -> None:
+    _query("""
+        SELECT device_id, device_name, SUM(total_kwh)
+        FROM plug_daily_summary
+        WHERE DATE_FORMAT(date, '%%Y-%%m') = %s AND device_id = %s
+        GROUP BY device_id, device_name
+    """, (date.today().strftime("%Y-%m"), device_id))
+
+
+def range_monthly_scan(device_id: str) -> None:
+    start, end = db._month_bounds(date.today().strftime("%Y-%m"))
+    _query("""
+        SELECT device_id, device_name, SUM(total_kwh)
+        FROM plug_daily_summary
+        WHERE device_id = %s AND date >= %s AND date < %s
+        GROUP BY device_id, device_name
+    """, (device_id, start, end))
+
+
+def legacy_hourly_history(device_id: str) -> None:
+    _query("""
+        SELECT
+            DATE_FORMAT(polled_at, '%Y-%m-%d %H:00:00') as hour_str,
+            SUM(wh_delta) / 1000.0 as kwh
+        FROM plug_energy
+        WHERE device_id = %s AND polled_at >= NOW() - INTERVAL %s HOUR
+        GROUP BY hour_str
+        ORDER BY hour_str DESC
+        LIMIT %s
+    """, (device_id, 24, 24))
+
+
+def _query(sql: str, params: tuple) -> None:
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        cursor.close()
+
+
+CASES = [
+    ("today summary",      legacy_today_summary,        db.get_today_summary),
+    ("daily aggregate",    legacy_aggregate_daily_scan, range_aggregate_daily_scan),
+    ("monthly aggregate",  legacy_monthly_scan,         range_monthly_scan),
+    ("hourly history 24h", legacy_hourly_history,       lambda d: db.get_hourly_history(d, 24)),
+    ("daily history 30d",  None,                        lambda d: db.get_daily_history(d, 30)),
+]
+
+
+def time_ms(fn, device_ids: list, repeat: int) -> float:
+    """Median wall time in ms of running `fn` once per device."""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for device_id in device_ids:
+            fn(device_id)
+        samples.append((time.perf_counter() - t0) * 1000 / len(device_ids))
+    return statistics.median(samples)
+
+
+def main():
+    schema.migrate(verbose=True)
+
+    if not args.skip_load:
+        print(f"Loading {args.devices} devices × {args.days} days @ {args.interval}s ...")
+        rows = load_data(args.devices, args.days, args.interval)
+        print(f"Loaded {rows:,} rows\n")
+
+    device_ids = [f"bench-{d:03d}" for d in range(args.devices)]
+    print(f"{'query':<22}{'legacy ms':>12}{'range ms':>12}{'speedup':>10}")
+    print("-" * 56)
+    for label, legacy, current in CASES:
+        new_ms = time_ms(current, device_ids, args.repeat)
+        if legacy:
+            old_ms = time_ms(legacy, device_ids, args.repeat)
+            print(f"{label:<22}{old_ms:>12.2f}{new_ms:>12.2f}{old_ms / max(new_ms, 1e-6):>9.1f}x")
+        else:
+            print(f"{label:<22}{'—':>12}{new_ms:>12.2f}{'':>10}")
+
+
+if __name__ == "__main__":
+    main()
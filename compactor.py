@@ -0,0 +1,252 @@
+"""
+compactor.py
+============
+Retention and downsampling for raw plug_energy readings.
+
+plug_energy gets one row per device every poll and nothing else prunes it.
+This job keeps full-resolution rows for RAW_RETENTION_DAYS, then for each
+older (device, day):
+
+  1. rolls the raw rows into plug_energy_1m (1-minute buckets) and rebuilds
+     that day's plug_hourly_summary rows (1-hour buckets) — sum wh_delta,
+     avg/max watts, min/max voltage — and records the day in
+     plug_compaction_log, all in one transaction;
+  2. deletes the day's raw rows in DELETE ... LIMIT batches, each its own
+     short transaction, so the poll loop's inserts never wait on a long lock.
+
+A day is only rolled up once (the log row guards it), so a run interrupted
+half-way through the deletes resumes deleting without re-deriving rollups
+from a partial day.
+
+    python compactor.py             # run forever, every COMPACT_INTERVAL
+    python compactor.py --once      # single pass, then exit
+"""
+
+import argparse
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+
+import db
+
+load_dotenv()
+
+# Raw rows newer than this are never touched. Kept at least as long as the
+# daily reconcile window, which rebuilds summaries from raw rows.
+RAW_RETENTION_DAYS    = max(int(os.getenv("RAW_RETENTION_DAYS", 7)), db.RECONCILE_DAYS)
+MINUTE_RETENTION_DAYS = int(os.getenv("MINUTE_RETENTION_DAYS", 90))   # 0 = keep forever
+DELETE_BATCH          = int(os.getenv("COMPACT_DELETE_BATCH", 5000))  # rows per DELETE
+COMPACT_INTERVAL      = float(os.getenv("COMPACT_INTERVAL", 3600))    # seconds
+
+# Running totals since process start — read by the dashboard / printed per run
+metrics = {
+    "runs":                0,
+    "days_compacted":      0,
+    "rows_compacted":      0,
+    "raw_rows_deleted":    0,
+    "minute_rows_deleted": 0,
+    "last_run_at":         None,
+    "last_run_s":          0.0,
+    "total_s":             0.0,
+    "last_error":          None,
+}
+
+
+# ── Single pass ────────────────────────────────────────────────────────────
+
+def run_once() -> dict:
+    """Compact everything older than the raw retention window. Returns this run's counts."""
+    t0 = time.perf_counter()
+    run = {"days": 0, "rows": 0, "deleted": 0, "minute_deleted": 0}
+    cutoff = datetime.combine(date.today() - timedelta(days=RAW_RETENTION_DAYS),
+                              datetime.min.time())
+
+    try:
+        for device_id in _devices_with_raw_before(cutoff):
+            for day in _raw_days_before(device_id, cutoff):
+                if not _is_compacted(device_id, day):
+                    db.aggregate_daily(device_id, day.isoformat())
+                    run["rows"] += _rollup_day(device_id, day)
+                    run["days"] += 1
+                start, end = db._day_bounds(day.isoformat())
+                run["deleted"] += _delete_in_batches("""
+                    DELETE FROM plug_energy
+                    WHERE device_id = %s AND polled_at >= %s AND polled_at < %s
+                    ORDER BY polled_at
+                    LIMIT %s
+                """, (device_id, start, end))
+
+        if MINUTE_RETENTION_DAYS > 0:
+            minute_cutoff = datetime.combine(
+                date.today() - timedelta(days=MINUTE_RETENTION_DAYS), datetime.min.time())
+            for device_id in _minute_devices():
+                run["minute_deleted"] += _delete_in_batches("""
+                    DELETE FROM plug_energy_1m
+                    WHERE device_id = %s AND minute_start < %s
+                    ORDER BY minute_start
+                    LIMIT %s
+                """, (device_id, minute_cutoff))
+        metrics["last_error"] = None
+    except Exception as e:
+        metrics["last_error"] = str(e)
+        print(f"[compactor] error: {e}")
+
+    elapsed = time.perf_counter() - t0
+    metrics["runs"]                += 1
+    metrics["days_compacted"]      += run["days"]
+    metrics["rows_compacted"]      += run["rows"]
+    metrics["raw_rows_deleted"]    += run["deleted"]
+    metrics["minute_rows_deleted"] += run["minute_deleted"]
+    metrics["last_run_at"]          = datetime.now().isoformat(timespec="seconds")
+    metrics["last_run_s"]           = round(elapsed, 3)
+    metrics["total_s"]             += elapsed
+
+    print(f"[compactor] {run['days']} days / {run['rows']} rows rolled up, "
+          f"{run['deleted']} raw + {run['minute_deleted']} 1m rows deleted "
+          f"in {elapsed:.1f}s")
+    return run
+
+
+def compactor_loop(interval: float = COMPACT_INTERVAL) -> None:
+    """Background thread target: run_once() every `interval` seconds."""
+    while True:
+        run_once()
+        time.sleep(interval)
+
+
+# ── Steps ──────────────────────────────────────────────────────────────────
+
+def _devices_with_raw_before(cutoff: datetime) -> list:
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT device_id FROM plug_energy")
+        device_ids = [r[0] for r in cursor.fetchall()]
+        old = []
+        for device_id in device_ids:
+            cursor.execute("""
+                SELECT 1 FROM plug_energy
+                WHERE device_id = %s AND polled_at < %s
+                LIMIT 1
+            """, (device_id, cutoff))
+            if cursor.fetchone():
+                old.append(device_id)
+        cursor.close()
+    return old
+
+
+def _raw_days_before(device_id: str, cutoff: datetime) -> list:
+    """Days (oldest first) between the device's first raw row and the cutoff."""
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT MIN(polled_at) FROM plug_energy
+            WHERE device_id = %s AND polled_at < %s
+        """, (device_id, cutoff))
+        first = cursor.fetchone()[0]
+        cursor.close()
+    if first is None:
+        return []
+    day, last = first.date(), cutoff.date()
+    days = []
+    while day < last:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def _is_compacted(device_id: str, day: date) -> bool:
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT 1 FROM plug_compaction_log WHERE device_id = %s AND date = %s
+        """, (device_id, day))
+        found = cursor.fetchone() is not None
+        cursor.close()
+    return found
+
+
+def _rollup_day(device_id: str, day: date) -> int:
+    """Write 1m + 1h rollups for one day and log it. Returns raw rows rolled up."""
+    start, end = db._day_bounds(day.isoformat())
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO plug_energy_1m
+                (device_id, device_name, minute_start, total_wh, avg_watts,
+                 max_watts, min_voltage, max_voltage, reading_count)
+            SELECT device_id,
+                   MAX(device_name),
+                   polled_at - INTERVAL SECOND(polled_at) SECOND AS minute_start,
+                   SUM(wh_delta), AVG(watts), MAX(watts),
+                   MIN(voltage), MAX(voltage), COUNT(*)
+            FROM plug_energy
+            WHERE device_id = %s AND polled_at >= %s AND polled_at < %s
+            GROUP BY device_id, minute_start
+            ON DUPLICATE KEY UPDATE
+                total_wh      = VALUES(total_wh),
+                avg_watts     = VALUES(avg_watts),
+                max_watts     = VALUES(max_watts),
+                min_voltage   = VALUES(min_voltage),
+                max_voltage   = VALUES(max_voltage),
+                reading_count = VALUES(reading_count)
+        """, (device_id, start, end))
+
+        cursor.execute("""
+            SELECT COUNT(*) FROM plug_energy
+            WHERE device_id = %s AND polled_at >= %s AND polled_at < %s
+        """, (device_id, start, end))
+        raw_rows = int(cursor.fetchone()[0])
+
+        db.rebuild_hourly(conn, device_id, start, end)
+
+        cursor.execute("""
+            INSERT INTO plug_compaction_log (device_id, date, raw_rows)
+            VALUES (%s, %s, %s)
+        """, (device_id, day, raw_rows))
+        cursor.close()
+    return raw_rows
+
+
+def _delete_in_batches(sql: str, params: tuple) -> int:
+    """Repeat a DELETE ... LIMIT %s (one short transaction each) until nothing is left."""
+    deleted = 0
+    while True:
+        with db.get_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params + (DELETE_BATCH,))
+            n = cursor.rowcount
+            cursor.close()
+        deleted += n
+        if n < DELETE_BATCH:
+            return deleted
+
+
+def _minute_devices() -> list:
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT device_id FROM plug_energy_1m")
+        device_ids = [r[0] for r in cursor.fetchall()]
+        cursor.close()
+    return device_ids
+
+
+# ── CLI ────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact and prune raw plug_energy rows.")
+    parser.add_argument("--once", action="store_true", help="single pass, then exit")
+    parser.add_argument("--interval", type=float, default=COMPACT_INTERVAL,
+                        help="seconds between passes (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.once:
+        run_once()
+        print(f"[compactor] totals: {metrics}")
+    else:
+        compactor_loop(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,30 @@ db.py
 =====
 MariaDB helper for plug energy monitoring.
 Handles inserts, daily aggregation, and monthly summaries.
+
+Tables and indexes are defined in schema.py; run `schema.migrate()` (or
+`python schema.py`) before first use.
+
+Daily summaries are maintained incrementally: each writer flush folds its
+readings into plug_daily_summary (running sum / mean / max) in the same
+transaction, and `reconcile_daily()` periodically rebuilds recent days from
+raw rows to correct any drift.
+
+All functions borrow connections from a small pool via `get_conn()`, so a
+poll cycle or UI refresh reuses warm sockets instead of paying a TCP + auth
+handshake per query.
+
+Poll loops should hand readings to `energy_writer.submit()` rather than
+calling `insert_energy()` directly — the writer batches rows into a single
+executemany + commit instead of one connection and fsync per reading.
 """
 
+import atexit
 import os
-from datetime import date, datetime
+import threading
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
 from contextlib import contextmanager
 
 import mysql.connector
@@ -22,19 +42,132 @@ DB_CONFIG = {
     "database": os.getenv("DB_NAME", "homelab"),
 }
 
+# Connection pool
+DB_POOL_SIZE     = int(os.getenv("DB_POOL_SIZE", 4))          # max open connections
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 300))  # seconds before an idle conn is recycled
+DB_POOL_TIMEOUT  = float(os.getenv("DB_POOL_TIMEOUT", 10))    # seconds to wait for a free conn
+
+# Buffered writer thresholds — flush when either is reached
+WRITER_BATCH_SIZE     = int(os.getenv("DB_WRITER_BATCH_SIZE", 50))       # rows
+WRITER_FLUSH_INTERVAL = float(os.getenv("DB_WRITER_FLUSH_INTERVAL", 30)) # seconds
+WRITER_MAX_QUEUE      = int(os.getenv("DB_WRITER_MAX_QUEUE", 5000))      # rows held while DB is down
+
+# "incremental" folds each flush into plug_daily_summary in O(1) per device;
+# "full" re-aggregates the whole day from plug_energy after every flush.
+DAILY_AGGREGATION  = os.getenv("DB_DAILY_AGGREGATION", "incremental")
+RECONCILE_INTERVAL = float(os.getenv("DB_RECONCILE_INTERVAL", 900))  # seconds between full rebuilds
+RECONCILE_DAYS     = int(os.getenv("DB_RECONCILE_DAYS", 2))          # today + yesterday
+
+
+# ── Connection pool ────────────────────────────────────────────────────────
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MariaDB connections.
+
+    At most `size` connections are checked out at once; callers beyond that
+    block for up to `timeout` seconds. Idle connections are kept on a LIFO
+    stack so the warmest one is reused first. On checkout a connection is
+    discarded if it sat idle longer than `max_idle` (the server's
+    wait_timeout may already have dropped it), otherwise it is pinged with
+    reconnect=True so a stale socket is transparently re-established.
+    """
+
+    def __init__(self, config: dict,
+                 size: int = DB_POOL_SIZE,
+                 max_idle: float = DB_POOL_MAX_IDLE,
+                 timeout: float = DB_POOL_TIMEOUT):
+        self.config   = config
+        self.size     = size
+        self.max_idle = max_idle
+        self.timeout  = timeout
+
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: list = []          # [(conn, last_used_monotonic)]
+        self._lock  = threading.Lock()
+
+        self.created  = 0
+        self.recycled = 0
+
+    def acquire(self):
+        """Borrow a healthy connection. Raises PoolError if none frees up in time."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise mysql.connector.errors.PoolError(
+                f"no free DB connection after {self.timeout}s (pool size {self.size})")
+        try:
+            return self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False) -> None:
+        """Return a connection; broken ones are closed instead of reused."""
+        try:
+            if broken:
+                _close_quietly(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close_all(self) -> None:
+        """Close every idle connection (checked-out ones close on release)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+
+            if item is None:
+                conn = mysql.connector.connect(**self.config)
+                self.created += 1
+                return conn
+
+            conn, last_used = item
+            if time.monotonic() - last_used > self.max_idle:
+                _close_quietly(conn)
+                self.recycled += 1
+                continue
+            try:
+                conn.ping(reconnect=True, attempts=2, delay=0)
+                return conn
+            except Exception:
+                _close_quietly(conn)
+                self.recycled += 1
+
+
+def _close_quietly(conn) -> None:
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+pool = ConnectionPool(DB_CONFIG)
+atexit.register(pool.close_all)
+
 
 @contextmanager
 def get_conn():
-    """Context manager for DB connection — auto-closes on exit."""
-    conn = mysql.connector.connect(**DB_CONFIG)
+    """Context manager for a pooled DB connection — commits and returns it on exit."""
+    conn = pool.acquire()
+    broken = False
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
         raise
     finally:
-        conn.close()
+        pool.release(conn, broken)
 
 
 # ── Inserts ────────────────────────────────────────────────────────────────
@@ -65,8 +198,287 @@ def insert_state_change(device_id: str, device_name: str,
         cursor.close()
 
 
+# ── Buffered writer ────────────────────────────────────────────────────────
+
+class EnergyWriter:
+    """
+    Queues plug_energy readings and writes them in batches.
+
+    submit() only appends to an in-memory buffer, so the poll loop never
+    waits on MariaDB. A background thread flushes the buffer with a single
+    executemany + commit once it holds `batch_size` rows or `flush_interval`
+    seconds have passed, folding the batch into the daily summary in the
+    same transaction (see `_apply_daily_increments`).
+
+    The buffer is bounded: if the DB is unreachable for long enough to fill
+    it, the oldest readings are dropped (counted in `dropped`). Rows from a
+    failed flush are put back at the front and retried on the next flush.
+    """
+
+    def __init__(self,
+                 batch_size: int = WRITER_BATCH_SIZE,
+                 flush_interval: float = WRITER_FLUSH_INTERVAL,
+                 max_queue: int = WRITER_MAX_QUEUE):
+        self.batch_size     = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue      = max_queue
+
+        self._buf: deque     = deque()
+        self._cond           = threading.Condition()
+        self._flush_lock     = threading.Lock()   # keeps flushes in order
+        self._thread         = None
+        self._closed         = False
+        self._failing        = False   # last flush failed — wait out the interval
+
+        self.written = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        """Start the background flush thread (idempotent)."""
+        with self._cond:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="energy-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, device_id: str, device_name: str,
+               watts: float, wh_delta: float,
+               voltage: float, current_ma: int,
+               polled_at: datetime = None) -> None:
+        """Queue one reading. Timestamped now unless `polled_at` is given."""
+        row = (device_id, device_name, watts, wh_delta, voltage, current_ma,
+               polled_at or datetime.now())
+        self.start()
+        with self._cond:
+            if len(self._buf) >= self.max_queue:
+                self._buf.popleft()
+                self.dropped += 1
+            self._buf.append(row)
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._buf)
+
+    def flush(self) -> int:
+        """Write everything queued so far. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._cond:
+                rows = list(self._buf)
+                self._buf.clear()
+            if not rows:
+                return 0
+
+            try:
+                _write_energy_batch(rows)
+            except Exception as e:
+                print(f"[db] flush error ({len(rows)} rows): {e}")
+                with self._cond:
+                    # Re-queue ahead of anything submitted meanwhile, keeping the newest
+                    self._buf.extendleft(reversed(rows))
+                    while len(self._buf) > self.max_queue:
+                        self._buf.popleft()
+                        self.dropped += 1
+                    self._failing = True
+                return 0
+
+            self._failing = False
+            self.written += len(rows)
+            return len(rows)
+
+    def close(self) -> None:
+        """Stop the flush thread and write whatever is still queued."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or (
+                        not self._failing and len(self._buf) >= self.batch_size),
+                    timeout=self.flush_interval,
+                )
+                if self._closed:
+                    return
+            self.flush()
+
+
+def _write_energy_batch(rows: list) -> None:
+    """Insert many readings and update their hourly/daily summaries in one transaction."""
+    incremental = DAILY_AGGREGATION == "incremental"
+
+    with get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO plug_energy
+                (device_id, device_name, watts, wh_delta, voltage, current_ma, polled_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, rows)
+        cursor.close()
+        _apply_hourly_increments(conn, rows)
+        if incremental:
+            _apply_daily_increments(conn, rows)
+
+    if incremental:
+        return
+
+    # Rows are committed at this point — a failed aggregate must not re-queue them
+    for device_id, date_str in sorted({(r[0], r[6].date().isoformat()) for r in rows}):
+        try:
+            aggregate_daily(device_id, date_str)
+        except Exception as e:
+            print(f"[db] aggregate error ({device_id}, {date_str}): {e}")
+
+
+energy_writer = EnergyWriter()
+atexit.register(energy_writer.close)
+
+
+# ── Time ranges ────────────────────────────────────────────────────────────
+# Every time filter is a half-open [start, end) range on the raw column so
+# MariaDB can seek the (device_id, polled_at) / (device_id, date) indexes —
+# wrapping the column in DATE() or DATE_FORMAT() forces a full scan.
+
+def _day_bounds(date_str: str) -> tuple:
+    """'YYYY-MM-DD' -> (midnight, next midnight)."""
+    start = datetime.strptime(date_str, "%Y-%m-%d")
+    return start, start + timedelta(days=1)
+
+
+def _month_bounds(year_month: str) -> tuple:
+    """'YYYY-MM' -> (first day, first day of next month)."""
+    start = datetime.strptime(year_month, "%Y-%m").date()
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
 # ── Aggregation ────────────────────────────────────────────────────────────
 
+def _hour_start(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _apply_hourly_increments(conn, rows: list) -> None:
+    """
+    Fold a batch of plug_energy rows into plug_hourly_summary.
+
+    No cost column here, so the running sum / mean / max is done entirely in
+    the upsert — one executemany per flush. MariaDB evaluates the UPDATE
+    assignments left to right, so avg_watts must come before reading_count.
+    """
+    groups: dict = {}
+    for device_id, device_name, watts, wh_delta, voltage, _ma, polled_at in rows:
+        _fold_hour(groups, (device_id, _hour_start(polled_at)),
+                   device_name, watts, wh_delta, voltage)
+
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT INTO plug_hourly_summary
+            (device_id, device_name, hour_start, total_wh, avg_watts,
+             peak_watts, min_voltage, max_voltage, reading_count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            avg_watts     = (avg_watts * reading_count
+                             + VALUES(avg_watts) * VALUES(reading_count))
+                            / (reading_count + VALUES(reading_count)),
+            total_wh      = total_wh + VALUES(total_wh),
+            peak_watts    = GREATEST(peak_watts, VALUES(peak_watts)),
+            min_voltage   = LEAST(COALESCE(min_voltage, VALUES(min_voltage)), VALUES(min_voltage)),
+            max_voltage   = GREATEST(COALESCE(max_voltage, VALUES(max_voltage)), VALUES(max_voltage)),
+            reading_count = reading_count + VALUES(reading_count),
+            device_name   = VALUES(device_name)
+    """, _hourly_params(groups))
+    cursor.close()
+
+
+def _fold_hour(groups: dict, key, device_name, watts, wh_delta, voltage) -> None:
+    """Accumulate one reading into its hour bucket: [name, wh, sum_w, max_w, min_v, max_v, n]."""
+    w, v = float(watts or 0), float(voltage or 0)
+    g = groups.get(key)
+    if g is None:
+        groups[key] = [device_name, float(wh_delta or 0), w, w, v, v, 1]
+        return
+    g[1] += float(wh_delta or 0)
+    g[2] += w
+    g[3]  = max(g[3], w)
+    g[4]  = min(g[4], v)
+    g[5]  = max(g[5], v)
+    g[6] += 1
+
+
+def _hourly_params(groups: dict) -> list:
+    return [
+        (device_id, name, hour, wh, sum_w / n, max_w, min_v, max_v, n)
+        for (device_id, hour), (name, wh, sum_w, max_w, min_v, max_v, n)
+        in sorted(groups.items())
+    ]
+
+
+def _apply_daily_increments(conn, rows: list) -> None:
+    """
+    Fold a batch of plug_energy rows into plug_daily_summary.
+
+    Rows are grouped per (device, day) first, so the cost is one primary-key
+    read + one upsert per device per flush regardless of how many readings
+    the day already holds. The summary row is locked (FOR UPDATE) so a
+    concurrent reconcile can't interleave with the merge.
+    """
+    groups: dict = {}
+    for device_id, device_name, watts, wh_delta, _v, _ma, polled_at in rows:
+        key = (device_id, polled_at.date().isoformat())
+        g = groups.setdefault(key, {"name": device_name, "wh": 0.0, "n": 0,
+                                    "sum_w": 0.0, "max_w": 0.0})
+        g["wh"]    += float(wh_delta or 0)
+        g["n"]     += 1
+        g["sum_w"] += float(watts or 0)
+        g["max_w"]  = max(g["max_w"], float(watts or 0))
+
+    cursor = conn.cursor(dictionary=True)
+    for (device_id, date_str), g in sorted(groups.items()):
+        cursor.execute("""
+            SELECT total_wh, avg_watts, peak_watts, reading_count
+            FROM plug_daily_summary
+            WHERE device_id = %s AND date = %s
+            FOR UPDATE
+        """, (device_id, date_str))
+        cur = cursor.fetchone() or {}
+
+        n_old    = int(cur.get("reading_count") or 0)
+        n_new    = n_old + g["n"]
+        total_wh = float(cur.get("total_wh") or 0) + g["wh"]
+        avg_w    = (float(cur.get("avg_watts") or 0) * n_old + g["sum_w"]) / n_new
+        peak_w   = max(float(cur.get("peak_watts") or 0), g["max_w"])
+
+        cursor.execute("""
+            INSERT INTO plug_daily_summary
+                (device_id, device_name, date, total_wh, cost_rm,
+                 avg_watts, peak_watts, reading_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                total_wh      = VALUES(total_wh),
+                cost_rm       = VALUES(cost_rm),
+                avg_watts     = VALUES(avg_watts),
+                peak_watts    = VALUES(peak_watts),
+                reading_count = VALUES(reading_count)
+        """, (
+            device_id, g["name"], date_str,
+            total_wh,
+            calculate_tnb_cost(total_wh / 1000.0),
+            round(avg_w, 2),
+            round(peak_w, 2),
+            n_new,
+        ))
+    cursor.close()
+
+
 def calculate_tnb_cost(kwh: float) -> float:
     """
     TNB Tariff A residential tiered cost in RM.
@@ -94,12 +506,25 @@ def aggregate_daily(device_id: str, date_str: str = None) -> None:
     Aggregate plug_energy rows for a given date into plug_daily_summary.
     Defaults to today if date_str not provided.
     date_str format: 'YYYY-MM-DD'
+
+    This is a full rescan of the day — the writer keeps the summary current
+    incrementally, so this only needs to run from `reconcile_daily()`.
     """
     if not date_str:
         date_str = date.today().isoformat()
+    start, end = _day_bounds(date_str)
 
     with get_conn() as conn:
         cursor = conn.cursor(dictionary=True)
+        # Lock the summary row first so a writer flush can't fold in readings
+        # between our scan and our upsert (they'd be overwritten).
+        cursor.execute("""
+            SELECT reading_count FROM plug_daily_summary
+            WHERE device_id = %s AND date = %s
+            FOR UPDATE
+        """, (device_id, date_str))
+        cursor.fetchall()
+
         cursor.execute("""
             SELECT
                 device_id,
@@ -109,9 +534,9 @@ def aggregate_daily(device_id: str, date_str: str = None) -> None:
                 MAX(watts)     AS peak_watts,
                 COUNT(*)       AS reading_count
             FROM plug_energy
-            WHERE DATE(polled_at) = %s AND device_id = %s
+            WHERE device_id = %s AND polled_at >= %s AND polled_at < %s
             GROUP BY device_id, device_name
-        """, (date_str, device_id))
+        """, (device_id, start, end))
 
         row = cursor.fetchone()
         if not row:
@@ -124,13 +549,15 @@ def aggregate_daily(device_id: str, date_str: str = None) -> None:
 
         cursor.execute("""
             INSERT INTO plug_daily_summary
-                (device_id, device_name, date, total_wh, cost_rm, avg_watts, peak_watts)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+                (device_id, device_name, date, total_wh, cost_rm,
+                 avg_watts, peak_watts, reading_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             ON DUPLICATE KEY UPDATE
-                total_wh   = VALUES(total_wh),
-                cost_rm    = VALUES(cost_rm),
-                avg_watts  = VALUES(avg_watts),
-                peak_watts = VALUES(peak_watts)
+                total_wh      = VALUES(total_wh),
+                cost_rm       = VALUES(cost_rm),
+                avg_watts     = VALUES(avg_watts),
+                peak_watts    = VALUES(peak_watts),
+                reading_count = VALUES(reading_count)
         """, (
             row["device_id"],
             row["device_name"],
@@ -139,10 +566,86 @@ def aggregate_daily(device_id: str, date_str: str = None) -> None:
             cost_rm,
             round(float(row["avg_watts"] or 0), 2),
             round(float(row["peak_watts"] or 0), 2),
+            int(row["reading_count"] or 0),
         ))
         cursor.close()
 
 
+def aggregate_hourly(device_id: str, date_str: str = None) -> None:
+    """
+    Rebuild plug_hourly_summary rows for one day from plug_energy.
+    date_str format: 'YYYY-MM-DD' (defaults to today).
+    """
+    if not date_str:
+        date_str = date.today().isoformat()
+    with get_conn() as conn:
+        rebuild_hourly(conn, device_id, *_day_bounds(date_str))
+
+
+def rebuild_hourly(conn, device_id: str, start: datetime, end: datetime) -> None:
+    """Replace plug_hourly_summary rows in [start, end) using conn's transaction."""
+    cursor = conn.cursor()
+    # Lock the rollup range (gap locks included) against writer flushes
+    cursor.execute("""
+        SELECT hour_start FROM plug_hourly_summary
+        WHERE device_id = %s AND hour_start >= %s AND hour_start < %s
+        FOR UPDATE
+    """, (device_id, start, end))
+    cursor.fetchall()
+
+    cursor.execute("""
+        SELECT device_name, polled_at, watts, wh_delta, voltage
+        FROM plug_energy
+        WHERE device_id = %s AND polled_at >= %s AND polled_at < %s
+    """, (device_id, start, end))
+    hours: dict = {}
+    for device_name, polled_at, watts, wh_delta, voltage in cursor.fetchall():
+        _fold_hour(hours, (device_id, _hour_start(polled_at)),
+                   device_name, watts, wh_delta, voltage)
+
+    cursor.execute("""
+        DELETE FROM plug_hourly_summary
+        WHERE device_id = %s AND hour_start >= %s AND hour_start < %s
+    """, (device_id, start, end))
+    if hours:
+        cursor.executemany("""
+            INSERT INTO plug_hourly_summary
+                (device_id, device_name, hour_start, total_wh, avg_watts,
+                 peak_watts, min_voltage, max_voltage, reading_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, _hourly_params(hours))
+    cursor.close()
+
+
+def reconcile_daily(device_ids: list, days: int = RECONCILE_DAYS) -> None:
+    """
+    Rebuild the last `days` daily and hourly summaries from raw rows.
+    Corrects drift from rounding in the running mean and from readings
+    that were dropped or retried by the writer.
+    """
+    today = date.today()
+    for device_id in device_ids:
+        for offset in range(days):
+            day = (today - timedelta(days=offset)).isoformat()
+            try:
+                aggregate_daily(device_id, day)
+                aggregate_hourly(device_id, day)
+            except Exception as e:
+                print(f"[db] reconcile error ({device_id}, {day}): {e}")
+
+
+def reconcile_loop(device_ids, interval: float = RECONCILE_INTERVAL) -> None:
+    """
+    Background thread target: periodic reconcile_daily().
+    device_ids is a list, or a callable returning one (re-read every pass,
+    e.g. tuya_local.device_ids to follow the device registry).
+    """
+    while True:
+        time.sleep(interval)
+        energy_writer.flush()
+        reconcile_daily(device_ids() if callable(device_ids) else device_ids)
+
+
 def aggregate_monthly(device_id: str, year_month: str = None) -> None:
     """
     Aggregate plug_daily_summary for a month into plug_monthly_summary.
@@ -150,6 +653,7 @@ def aggregate_monthly(device_id: str, year_month: str = None) -> None:
     """
     if not year_month:
         year_month = date.today().strftime("%Y-%m")
+    start, end = _month_bounds(year_month)
 
     with get_conn() as conn:
         cursor = conn.cursor(dictionary=True)
@@ -159,9 +663,9 @@ def aggregate_monthly(device_id: str, year_month: str = None) -> None:
                 device_name,
                 SUM(total_kwh) AS total_kwh
             FROM plug_daily_summary
-            WHERE DATE_FORMAT(date, '%%Y-%%m') = %s AND device_id = %s
+            WHERE device_id = %s AND date >= %s AND date < %s
             GROUP BY device_id, device_name
-        """, (year_month, device_id))
+        """, (device_id, start, end))
 
         row = cursor.fetchone()
         if not row:
@@ -186,14 +690,14 @@ def aggregate_monthly(device_id: str, year_month: str = None) -> None:
 
 def get_today_summary(device_id: str) -> dict:
     """Return today's total kWh and estimated cost for a device."""
-    today = date.today().isoformat()
+    start, end = _day_bounds(date.today().isoformat())
     with get_conn() as conn:
         cursor = conn.cursor(dictionary=True)
         cursor.execute("""
             SELECT COALESCE(SUM(wh_delta), 0) AS total_wh
             FROM plug_energy
-            WHERE DATE(polled_at) = %s AND device_id = %s
-        """, (today, device_id))
+            WHERE device_id = %s AND polled_at >= %s AND polled_at < %s
+        """, (device_id, start, end))
         row = cursor.fetchone()
         cursor.close()
 
@@ -239,35 +743,204 @@ def get_monthly_history(device_id: str, months: int = 6) -> list:
 
 
 def get_hourly_history(device_id: str, hours: int = 24) -> list:
-    """Return hourly kWh summaries for the last N hours."""
+    """
+    Return hourly kWh summaries for the last N hours (current hour included).
+    Completed hours come from the plug_hourly_summary rollup; only the
+    current partial hour is summed from raw plug_energy rows.
+    """
+    current = _hour_start(datetime.now())
+    start   = current - timedelta(hours=hours - 1)
     with get_conn() as conn:
         cursor = conn.cursor(dictionary=True)
         cursor.execute("""
-            SELECT 
-                DATE_FORMAT(polled_at, '%Y-%m-%d %H:00:00') as hour_str,
-                SUM(wh_delta) / 1000.0 as kwh
-            FROM plug_energy
-            WHERE device_id = %s AND polled_at >= NOW() - INTERVAL %s HOUR
-            GROUP BY hour_str
-            ORDER BY hour_str DESC
-            LIMIT %s
-        """, (device_id, hours, hours))
+            SELECT hour_start, total_wh / 1000.0 AS kwh
+            FROM plug_hourly_summary
+            WHERE device_id = %s AND hour_start >= %s AND hour_start < %s
+            ORDER BY hour_start
+        """, (device_id, start, current))
         rows = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT SUM(wh_delta) / 1000.0 AS kwh, COUNT(*) AS n
+            FROM plug_energy
+            WHERE device_id = %s AND polled_at >= %s
+        """, (device_id, current))
+        partial = cursor.fetchone()
         cursor.close()
-    return list(reversed(rows))
+
+    result = [{"hour_str": r["hour_start"].strftime("%Y-%m-%d %H:00:00"),
+               "kwh": float(r["kwh"] or 0)} for r in rows]
+    if partial and partial["n"]:
+        result.append({"hour_str": current.strftime("%Y-%m-%d %H:00:00"),
+                       "kwh": float(partial["kwh"] or 0)})
+    return result
 
 
 def get_daily_history(device_id: str, days: int = 30) -> list:
-    """Return daily kWh summaries for the last N days."""
+    """Return daily kWh summaries for the last N days (today included)."""
+    end   = date.today() + timedelta(days=1)
+    start = end - timedelta(days=days)
     with get_conn() as conn:
         cursor = conn.cursor(dictionary=True)
         cursor.execute("""
             SELECT date as date_str, total_wh / 1000.0 as kwh
             FROM plug_daily_summary
-            WHERE device_id = %s AND date >= CURDATE() - INTERVAL %s DAY
+            WHERE device_id = %s AND date >= %s AND date < %s
             ORDER BY date DESC
             LIMIT %s
-        """, (device_id, days, days))
+        """, (device_id, start, end, days))
         rows = cursor.fetchall()
         cursor.close()
     return list(reversed(rows))
+
+
+# ── Multi-device queries ───────────────────────────────────────────────────
+# One round trip for any number of plugs. Per-device results are aligned to
+# the same label list (missing buckets filled with 0) so callers can zip
+# them straight into chart series; combine=True sums across devices in SQL.
+
+def _in_clause(device_ids: list) -> str:
+    return ", ".join(["%s"] * len(device_ids))
+
+
+def _align(rows: list, device_ids: list, label_key: str) -> dict:
+    """[{device_id, <label_key>, kwh}] -> {device_id: [{<label_key>, kwh}, ...]} on a shared axis."""
+    labels = sorted({r[label_key] for r in rows})
+    values = {(r["device_id"], r[label_key]): r["kwh"] for r in rows}
+    return {
+        device_id: [{label_key: label, "kwh": values.get((device_id, label), 0.0)}
+                    for label in labels]
+        for device_id in device_ids
+    }
+
+
+def get_today_summary_many(device_ids: list, combine: bool = False) -> dict:
+    """
+    Today's kWh + cost for several devices in one query.
+    Returns {device_id: summary}, or a single summary for all devices
+    together when combine=True (tariff applied to the combined kWh).
+    """
+    if not device_ids:
+        return {} if not combine else _summary_from_wh(0.0)
+    start, end = _day_bounds(date.today().isoformat())
+    with get_conn() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""
+            SELECT device_id, COALESCE(SUM(wh_delta), 0) AS total_wh
+            FROM plug_energy
+            WHERE device_id IN ({_in_clause(device_ids)})
+              AND polled_at >= %s AND polled_at < %s
+            GROUP BY device_id
+        """, (*device_ids, start, end))
+        rows = {r["device_id"]: float(r["total_wh"] or 0) for r in cursor.fetchall()}
+        cursor.close()
+
+    if combine:
+        return _summary_from_wh(sum(rows.values()))
+    return {device_id: _summary_from_wh(rows.get(device_id, 0.0)) for device_id in device_ids}
+
+
+def _summary_from_wh(total_wh: float) -> dict:
+    total_kwh = total_wh / 1000.0
+    return {
+        "total_wh":  round(total_wh, 4),
+        "total_kwh": round(total_kwh, 6),
+        "cost_rm":   calculate_tnb_cost(total_kwh),
+    }
+
+
+def get_hourly_history_many(device_ids: list, hours: int = 24,
+                            combine: bool = False):
+    """
+    Hourly kWh for several devices: rollup for completed hours, raw rows for
+    the current partial hour — two queries total regardless of device count.
+    Returns {device_id: [{hour_str, kwh}]} aligned on the same hours, or one
+    summed [{hour_str, kwh}] list when combine=True.
+    """
+    if not device_ids:
+        return [] if combine else {}
+    current = _hour_start(datetime.now())
+    start   = current - timedelta(hours=hours - 1)
+    ids     = _in_clause(device_ids)
+
+    with get_conn() as conn:
+        cursor = conn.cursor(dictionary=True)
+        if combine:
+            cursor.execute(f"""
+                SELECT hour_start, SUM(total_wh) / 1000.0 AS kwh
+                FROM plug_hourly_summary
+                WHERE device_id IN ({ids}) AND hour_start >= %s AND hour_start < %s
+                GROUP BY hour_start
+                ORDER BY hour_start
+            """, (*device_ids, start, current))
+            rows = cursor.fetchall()
+            cursor.execute(f"""
+                SELECT SUM(wh_delta) / 1000.0 AS kwh, COUNT(*) AS n
+                FROM plug_energy
+                WHERE device_id IN ({ids}) AND polled_at >= %s
+            """, (*device_ids, current))
+            partial = [cursor.fetchone()]
+        else:
+            cursor.execute(f"""
+                SELECT device_id, hour_start, total_wh / 1000.0 AS kwh
+                FROM plug_hourly_summary
+                WHERE device_id IN ({ids}) AND hour_start >= %s AND hour_start < %s
+            """, (*device_ids, start, current))
+            rows = cursor.fetchall()
+            cursor.execute(f"""
+                SELECT device_id, SUM(wh_delta) / 1000.0 AS kwh, COUNT(*) AS n
+                FROM plug_energy
+                WHERE device_id IN ({ids}) AND polled_at >= %s
+                GROUP BY device_id
+            """, (*device_ids, current))
+            partial = cursor.fetchall()
+        cursor.close()
+
+    pts = [{"device_id": r.get("device_id"),
+            "hour_str":  r["hour_start"].strftime("%Y-%m-%d %H:00:00"),
+            "kwh":       float(r["kwh"] or 0)} for r in rows]
+    pts += [{"device_id": p.get("device_id"),
+             "hour_str":  current.strftime("%Y-%m-%d %H:00:00"),
+             "kwh":       float(p["kwh"] or 0)} for p in partial if p and p["n"]]
+
+    if combine:
+        return [{"hour_str": p["hour_str"], "kwh": p["kwh"]} for p in pts]
+    return _align(pts, device_ids, "hour_str")
+
+
+def get_daily_history_many(device_ids: list, days: int = 30,
+                           combine: bool = False):
+    """
+    Daily kWh for several devices in one query.
+    Returns {device_id: [{date_str, kwh}]} aligned on the same days, or one
+    summed [{date_str, kwh}] list when combine=True.
+    """
+    if not device_ids:
+        return [] if combine else {}
+    end   = date.today() + timedelta(days=1)
+    start = end - timedelta(days=days)
+    ids   = _in_clause(device_ids)
+
+    with get_conn() as conn:
+        cursor = conn.cursor(dictionary=True)
+        if combine:
+            cursor.execute(f"""
+                SELECT date AS date_str, SUM(total_wh) / 1000.0 AS kwh
+                FROM plug_daily_summary
+                WHERE device_id IN ({ids}) AND date >= %s AND date < %s
+                GROUP BY date
+                ORDER BY date
+            """, (*device_ids, start, end))
+        else:
+            cursor.execute(f"""
+                SELECT device_id, date AS date_str, total_wh / 1000.0 AS kwh
+                FROM plug_daily_summary
+                WHERE device_id IN ({ids}) AND date >= %s AND date < %s
+            """, (*device_ids, start, end))
+        rows = [{**r, "date_str": str(r["date_str"]), "kwh": float(r["kwh"] or 0)}
+                for r in cursor.fetchall()]
+        cursor.close()
+
+    if combine:
+        return rows
+    return _align(rows, device_ids, "date_str")
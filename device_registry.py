@@ -0,0 +1,158 @@
+"""
+device_registry.py
+==================
+Loads the smart plug registry from a JSON file (DEVICE_REGISTRY, default
+devices.json next to this module). tuya_local.py owns the live DEVICES
+dict and re-reads the file when it changes (reload_devices / registry_loop),
+so plugs can be added, removed or re-keyed without a restart.
+
+    {
+      "defaults": {
+        "version": 3.5,
+        "dps":   {"switch": "1", "power": "19", ...},
+        "scale": {"power": 10, "voltage": 10, "add_ele": 1000},
+        "poll":  {"base": 10, "min": 2, "max": 60}
+      },
+      "devices": {
+        "plug":   {"name": "Smart Plug", "id": "$PLUG_ID",
+                   "ip": "$PLUG_IP", "key": "$PLUG_KEY"},
+        "server": {"name": "Server", "id": "$SERVER_PLUG_ID",
+                   "ip": "$SERVER_PLUG_IP", "key": "$SERVER_PLUG_KEY",
+                   "is_server": true}
+      }
+    }
+
+Per device (anything omitted comes from "defaults", then the built-ins):
+  name, id, key        required; a string "$NAME" is read from the env
+  ip                   LAN address; may be omitted (or go stale after a
+                       DHCP change) — tuya_discovery beacons fill it in
+  version              Tuya protocol version (3.1 – 3.5)
+  dps / scale          DPS id per role and the divisor taking the raw int
+                       to W / V / kWh (merged over DEFAULT_DPS / DEFAULT_SCALE;
+                       map a role to null if the plug lacks it)
+  poll                 base / min / max seconds for pipeline.AdaptivePoller
+  is_server            server power: the UI double-confirms turning it off
+  month_offset_kwh     energy used this month before metering started
+  enabled              false parks the entry without deleting it
+
+When the file does not exist, the two plugs configured by PLUG_* and
+SERVER_PLUG_* env vars are used, as before the registry existed.
+"""
+
+import json
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REGISTRY_PATH = os.getenv(
+    "DEVICE_REGISTRY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "devices.json"))
+RELOAD_INTERVAL = float(os.getenv("DEVICE_REGISTRY_RELOAD", 5))   # seconds between mtime checks
+
+# ── DPS mapping (LN 2S metering plug) ─────────────────────────────────────
+DEFAULT_DPS = {
+    "switch":     "1",
+    "countdown":  "9",
+    "add_ele":    "17",   # kWh x 1000
+    "current":    "18",   # mA
+    "power":      "19",   # W x 10
+    "voltage":    "20",   # V x 10
+    "fault":      "26",
+    "led_mode":   "39",
+    "child_lock": "40",
+}
+DEFAULT_SCALE = {"power": 10, "voltage": 10, "add_ele": 1000, "current": 1}
+
+VERSIONS = (3.1, 3.2, 3.3, 3.4, 3.5)
+
+
+def load(path: str = REGISTRY_PATH) -> dict:
+    """
+    Parse the registry into {device_key: config}. Raises ValueError on a
+    malformed file so a bad edit never replaces a working registry;
+    invalid entries are skipped with a warning.
+    """
+    if not os.path.exists(path):
+        return _from_env()
+    try:
+        with open(path) as f:
+            raw = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"{path}: {e}") from None
+    if not isinstance(raw, dict) or not isinstance(raw.get("devices"), dict):
+        raise ValueError(f"{path}: expected an object with a \"devices\" object")
+
+    defaults = raw.get("defaults") or {}
+    devices = {}
+    for key, entry in raw["devices"].items():
+        try:
+            cfg = _normalize(key, entry, defaults)
+        except ValueError as e:
+            print(f"[device_registry] skipping {key!r}: {e}")
+            continue
+        if cfg["enabled"]:
+            devices[key] = cfg
+    return devices
+
+
+def mtime(path: str = REGISTRY_PATH) -> float | None:
+    """Modification time of the registry file, None when it does not exist."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _normalize(key: str, entry: dict, defaults: dict) -> dict:
+    if not isinstance(entry, dict):
+        raise ValueError("entry must be an object")
+    merged = {**defaults, **entry}
+    cfg = {
+        "name":             _expand(merged.get("name")) or key,
+        "id":               _expand(merged.get("id")),
+        "ip":               _expand(merged.get("ip")),
+        "key":              _expand(merged.get("key")),
+        "version":          float(merged.get("version", 3.5)),
+        "is_server":        bool(merged.get("is_server", False)),
+        "month_offset_kwh": float(merged.get("month_offset_kwh", 0.0)),
+        "enabled":          bool(merged.get("enabled", True)),
+        "dps":   {**DEFAULT_DPS, **(defaults.get("dps") or {}), **(entry.get("dps") or {})},
+        "scale": {**DEFAULT_SCALE, **(defaults.get("scale") or {}), **(entry.get("scale") or {})},
+        "poll":  {**(defaults.get("poll") or {}), **(entry.get("poll") or {})},
+    }
+    if not cfg["id"] or not cfg["key"]:
+        raise ValueError("id and key are required")
+    if cfg["version"] not in VERSIONS:
+        raise ValueError(f"unsupported protocol version {cfg['version']}")
+    if any(not isinstance(v, (int, float)) or v <= 0 for v in cfg["poll"].values()):
+        raise ValueError(f"poll intervals must be positive numbers: {cfg['poll']}")
+    return cfg
+
+
+def _expand(value):
+    """"$NAME" -> os.getenv("NAME"); anything else unchanged."""
+    if isinstance(value, str) and value.startswith("$"):
+        return os.getenv(value[1:])
+    return value
+
+
+def _from_env() -> dict:
+    devices = {}
+    for key, prefix, name, is_server, offset in (
+        ("plug",   "PLUG",        "Smart Plug", False, 42.5),
+        ("server", "SERVER_PLUG", "Server",     True,  150.2),
+    ):
+        entry = {
+            "name":             name,
+            "id":               f"${prefix}_ID",
+            "ip":               f"${prefix}_IP",
+            "key":              f"${prefix}_KEY",
+            "is_server":        is_server,
+            "month_offset_kwh": offset,
+        }
+        try:
+            devices[key] = _normalize(key, entry, {})
+        except ValueError as e:
+            print(f"[device_registry] {key}: {e} (set {prefix}_ID / {prefix}_KEY)")
+    return devices
@@ -48,7 +48,8 @@ module.exports = {
       max_memory_restart: '200M',
       env_file: '/mnt/nvme/Projects/dashboard/.env',
       env: {
-        PYTHONUNBUFFERED: '1'
+        PYTHONUNBUFFERED: '1',
+        PYTHONPATH: '/mnt/nvme/Projects/dashboard'
       },
       error_file: '/mnt/nvme/Projects/dashboard/logs/bot-error.log',
       out_file: '/mnt/nvme/Projects/dashboard/logs/bot-out.log',
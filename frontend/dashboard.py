@@ -11,13 +11,13 @@ import subprocess
 import threading
 import time
 
-from collections import deque
+from collections import defaultdict, deque
 from datetime import datetime
 from typing import Any, Dict, Optional
 from dotenv import load_dotenv
 
 from nicegui import ui, app, run
-from prometheus_api_client import PrometheusConnect
+from prometheus_client import REGISTRY, Counter, Gauge, start_http_server
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -28,13 +28,31 @@ if _project_root not in sys.path:
     sys.path.insert(0, _project_root)
 
 import tuya_local
+import tuya_discovery
 import db
+import schema
+import compactor
 import aws_iot_publisher
+import pipeline
+import sinks
 import cloud_db
+import prom_collector
+import prom_history
+import sys_sampler
+import net_prober
+import latency_stats
 # ─────────────────────────────────────────────────────────────────────────────
 #  PROMETHEUS
 # ─────────────────────────────────────────────────────────────────────────────
-prom = PrometheusConnect(url="http://localhost:9090", disable_ssl=True)
+# All Server Monitor gauges in one combined query per refresh (see prom_collector.py)
+prom = prom_collector.PromCollector()
+# Server Monitor history charts: cached query_range windows (see prom_history.py)
+prom_hist = prom_history.PromHistory(prom)
+
+# Our own exporter on DASHBOARD_METRICS_PORT, scraped by the Prometheus above
+c_breaker = Counter("tuya_breaker_transitions_total", "Circuit breaker transitions",
+                    ["device", "from_state", "to_state"])
+g_breaker = Gauge("tuya_breaker_open", "Circuit open (1) / half-open (0.5) / closed (0)", ["device"])
 
 # ─────────────────────────────────────────────────────────────────────────────
 #  ENV
@@ -42,6 +60,8 @@ prom = PrometheusConnect(url="http://localhost:9090", disable_ssl=True)
 env_path = "/mnt/nvme/Projects/dashboard/.env" 
 load_dotenv(env_path)
 
+DASHBOARD_METRICS_PORT = int(os.getenv("DASHBOARD_METRICS_PORT", 9325))
+
 # ─────────────────────────────────────────────────────────────────────────────
 #  GLOBAL STATE — system
 # ─────────────────────────────────────────────────────────────────────────────
@@ -59,22 +79,21 @@ last_update   = ""
 # ─────────────────────────────────────────────────────────────────────────────
 #  GLOBAL STATE — Smart Plugs (tinytuya local LAN)
 # ─────────────────────────────────────────────────────────────────────────────
-PLUG_POLL_INTERVAL = 10  # seconds
-
-plug_state: Dict[str, Dict[str, Any]] = {
-    "plug":   {"status": None, "ok": False, "history": deque(maxlen=120)},
-    "server": {"status": None, "ok": False, "history": deque(maxlen=120)},
-}
+PLUG_POLL_INTERVAL = 10  # seconds — base rate; pipeline.AdaptivePoller adapts per plug
+
+# One entry per registry device, created on first use
+plug_state: Dict[str, Dict[str, Any]] = defaultdict(
+    lambda: {"status": None, "ok": False, "history": deque(maxlen=120)})
+# Combined watts of all plugs, one point per PLUG_POLL_INTERVAL bucket: the
+# plugs are polled at different rates, so their histories don't line up
+plug_total_history: deque = deque(maxlen=120)
 plug_lock = threading.Lock()
 db_error_notified = False
 
 # ─────────────────────────────────────────────────────────────────────────────
 #  GLOBAL STATE — Energy DB cache (avoids blocking UI timers with DB queries)
 # ─────────────────────────────────────────────────────────────────────────────
-energy_cache: Dict[str, dict] = {
-    "plug":   {"total_kwh": 0, "cost_rm": 0},
-    "server": {"total_kwh": 0, "cost_rm": 0},
-}
+energy_cache: Dict[str, dict] = defaultdict(lambda: {"total_kwh": 0, "cost_rm": 0})
 energy_cache_lock = threading.Lock()
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -86,11 +105,13 @@ NETWORK_TARGET_LABELS = {
     "fast.com":   "Fast.com",
     "youtube.com": "YouTube",
 }
-NETWORK_PROBE_INTERVAL  = 10    # seconds between ping cycles
+NETWORK_PROBE_INTERVAL  = 10    # seconds between probe cycles
 NETWORK_TRACEROUTE_HOPS = 20   # max hops for traceroute
 NETWORK_AI_INTERVAL     = 300  # seconds between Gemini network analyses
 NETWORK_PACKET_LOSS_THRESHOLD = 1.0  # % — alert above this
-NETWORK_LATENCY_THRESHOLD_MS  = 150  # ms — alert above this
+NETWORK_LATENCY_THRESHOLD_MS  = 150  # ms — alert when the RTT percentile below is above this
+NETWORK_ANOMALY_WINDOW   = "1m"      # latency_stats window the thresholds are checked on
+NETWORK_ANOMALY_QUANTILE = "p95"
 NETWORK_TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 NETWORK_TELEGRAM_CHAT  = os.getenv("TELEGRAM_CHAT_ID", "")
 NETWORK_AI_CACHE_PATH  = "/mnt/nvme/Projects/dashboard/gemini_network_cache.txt"
@@ -105,6 +126,7 @@ network_state: dict = {
             "jitter":      0.0,
             "status":      "ok",
             "history":     deque([0.0] * 60, maxlen=60),
+            "stats":       {},   # latency_stats snapshot: window -> p50/p95/p99, loss, jitter
         }
         for t in NETWORK_TARGETS
     },
@@ -119,75 +141,29 @@ network_lock = threading.Lock()
 # ─────────────────────────────────────────────────────────────────────────────
 #  SYSTEM HELPERS
 # ─────────────────────────────────────────────────────────────────────────────
+# Read straight from sysfs / procfs (sys_sampler) — no smartctl / iostat forks,
+# and the HDD status is the I/O since the previous refresh, not a 1 s iostat sleep.
 def get_cpu_temp():
-    try:
-        with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
-            return round(float(f.read()) / 1000.0, 1)
-    except:
-        return 0
+    return sys_sampler.sampler.cpu_temp()
 
 def get_nvme_temp():
-    try:
-        result = subprocess.run(['smartctl', '-A', '/dev/nvme0n1'],
-                                capture_output=True, text=True, timeout=5)
-        for line in result.stdout.split('\n'):
-            if 'Temperature' in line and 'Celsius' in line:
-                parts = line.split()
-                for i, part in enumerate(parts):
-                    if part == 'Celsius' and i > 0:
-                        return int(parts[i-1])
-        return 0
-    except:
-        return 0
+    return int(sys_sampler.sampler.nvme_temp())
 
 def get_hdd_status():
-    try:
-        result = subprocess.run(['iostat', '-d', 'sda', '1', '2'],
-                                capture_output=True, text=True, timeout=3)
-        lines = result.stdout.strip().split('\n')
-        if len(lines) > 3:
-            last_line = lines[-1].split()
-            if len(last_line) > 3 and float(last_line[3]) > 0.1:
-                return 'active'
-        return 'idle'
-    except:
-        return 'idle'
+    return sys_sampler.sampler.disk_status()
 
 # ─────────────────────────────────────────────────────────────────────────────
-#  NETWORK HELPERS — Real ping / traceroute (ARM64-safe, subprocess only)
+#  NETWORK HELPERS — concurrent asyncio probes (net_prober) / traceroute
 # ─────────────────────────────────────────────────────────────────────────────
-def _probe_target(target: str, count: int = 4) -> dict:
-    """
-    Run `ping -c <count> -W 2 <target>` and extract:
-      latency (avg ms), jitter (mdev ms), packet_loss (%)
-    Returns a dict with those keys, or all-zero on failure.
-    """
-    empty = {"latency": 0.0, "jitter": 0.0, "packet_loss": 100.0}
-    try:
-        result = subprocess.run(
-            ["ping", "-c", str(count), "-W", "2", target],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            text=True, timeout=count * 3
-        )
-        out = result.stdout
+prober = net_prober.NetProber(on_sample=latency_stats.record)
 
-        # Packet loss: "2 packets transmitted, 2 received, 0% packet loss"
-        import re
-        loss_m = re.search(r'(\d+(?:\.\d+)?)%\s+packet loss', out)
-        packet_loss = float(loss_m.group(1)) if loss_m else 100.0
-
-        # Linux: round-trip min/avg/max/mdev = 14.1/15.2/16.0/0.9 ms
-        rtt_m = re.search(r'min/avg/max/m(?:dev|stddev)\s*=\s*[\d.]+/([\d.]+)/[\d.]+/([\d.]+)', out)
-        if rtt_m:
-            latency = round(float(rtt_m.group(1)), 2)
-            jitter  = round(float(rtt_m.group(2)), 2)
-        else:
-            latency, jitter = 0.0, 0.0
 
-        return {"latency": latency, "jitter": jitter, "packet_loss": packet_loss}
-    except Exception as e:
-        print(f"[network] ping error ({target}): {e}")
-        return empty
+def _percentile_line(stats: dict, window: str) -> str:
+    w = stats.get(window)
+    if not w or not w["count"]:
+        return f"{window}: no samples"
+    return (f"{window}: p50={w['p50']:.1f}ms p95={w['p95']:.1f}ms p99={w['p99']:.1f}ms "
+            f"jitter={w['jitter']:.1f}ms loss={w['loss']:.1f}%")
 
 
 def _run_traceroute(target: str) -> list[str]:
@@ -218,12 +194,10 @@ def _run_traceroute(target: str) -> list[str]:
 def _fetch_network_metrics() -> dict:
     """
     Sync function — runs in thread pool via run.io_bound().
-    Probes all NETWORK_TARGETS and returns a results dict.
+    Probes all NETWORK_TARGETS concurrently (one cycle, ~PROBE_TIMEOUT s) and
+    returns latency / jitter / packet_loss over net_prober's sliding window.
     """
-    results = {}
-    for target in NETWORK_TARGETS:
-        results[target] = _probe_target(target)
-    return results
+    return prober.probe(NETWORK_TARGETS)
 
 
 def _call_gemini_network(summary: str) -> str:
@@ -292,17 +266,22 @@ async def update_network_state():
             anomaly_targets = []
             all_ok = True
 
+            snapshots = {target: latency_stats.snapshot(target) for target in results}
+
             with network_lock:
                 for target, data in results.items():
                     td = network_state["targets"][target]
                     td["latency"]     = data["latency"]
                     td["packet_loss"] = data["packet_loss"]
                     td["jitter"]      = data["jitter"]
-                    td["history"].append(data["latency"])
+                    td["stats"]       = snapshots[target]
+                    td["history"].append(data["cycle_latency"])
 
+                    # Percentile, not mean: a few slow replies should not hide behind fast ones
+                    w = snapshots[target][NETWORK_ANOMALY_WINDOW]
                     is_anomaly = (
-                        data["packet_loss"] >= NETWORK_PACKET_LOSS_THRESHOLD
-                        or data["latency"]  >= NETWORK_LATENCY_THRESHOLD_MS
+                        w["loss"] >= NETWORK_PACKET_LOSS_THRESHOLD
+                        or w[NETWORK_ANOMALY_QUANTILE] >= NETWORK_LATENCY_THRESHOLD_MS
                     )
                     td["status"] = "warn" if is_anomaly else "ok"
                     if is_anomaly:
@@ -321,9 +300,10 @@ async def update_network_state():
                     td   = network_state["targets"][target]
 
                     # Log packet loss event
+                    w   = td["stats"][NETWORK_ANOMALY_WINDOW]
                     msg = (f"{ts_str} - ⚠️ {target}: "
-                           f"{td['packet_loss']:.1f}% loss, "
-                           f"{td['latency']:.0f}ms latency")
+                           f"{w['loss']:.1f}% loss, "
+                           f"{w[NETWORK_ANOMALY_QUANTILE]:.0f}ms {NETWORK_ANOMALY_QUANTILE}")
                     network_state["route_log"].insert(0, msg)
 
                     # Detect route flapping
@@ -347,9 +327,11 @@ async def update_network_state():
                 alert_lines = []
                 with network_lock:
                     for t in anomaly_targets:
-                        td = network_state["targets"][t]
+                        w = network_state["targets"][t]["stats"][NETWORK_ANOMALY_WINDOW]
                         alert_lines.append(
-                            f"  • <b>{t}</b>: {td['packet_loss']:.1f}% loss, {td['latency']:.0f}ms"
+                            f"  • <b>{t}</b>: {w['loss']:.1f}% loss, "
+                            f"{w[NETWORK_ANOMALY_QUANTILE]:.0f}ms {NETWORK_ANOMALY_QUANTILE} "
+                            f"({NETWORK_ANOMALY_WINDOW})"
                         )
                 alert_msg = (
                     "🚨 <b>Network Anomaly Detected</b>\n"
@@ -371,7 +353,9 @@ async def update_network_state():
                         summary_lines.append(
                             f"{t}: latency={td['latency']:.1f}ms, "
                             f"jitter={td['jitter']:.1f}ms, "
-                            f"packet_loss={td['packet_loss']:.1f}%"
+                            f"packet_loss={td['packet_loss']:.1f}%\n"
+                            f"  {_percentile_line(td['stats'], '1m')}\n"
+                            f"  {_percentile_line(td['stats'], '1h')}"
                         )
                     route_snapshot = "\n".join(network_state["route_log"][:5])
                     summary = "\n".join(summary_lines)
@@ -391,105 +375,137 @@ async def update_network_state():
 # ─────────────────────────────────────────────────────────────────────────────
 #  PLUG POLLING THREAD (tinytuya local LAN)
 # ─────────────────────────────────────────────────────────────────────────────
+def _apply_plug_reading(dev_key: str, r: Optional[dict]):
+    """Pipeline on_state hook — the only work done under plug_lock."""
+    with plug_lock:
+        if r is None:
+            plug_state[dev_key]["ok"] = False
+            return
+        plug_state[dev_key]["status"] = r["status"]
+        plug_state[dev_key]["ok"]     = True
+        plug_state[dev_key]["history"].append({
+            "t": r["polled_at"].strftime("%H:%M:%S"),
+            "w": r["status"]["watts"],
+        })
+        _update_plug_total(r["ts"])
+
+
+def _update_plug_total(ts: float):
+    """Caller holds plug_lock. Each plug counts with its last-known watts;
+    buckets no plug was polled in repeat the previous total."""
+    bucket = int(ts // PLUG_POLL_INTERVAL)
+    if plug_total_history:
+        bucket = max(bucket, plug_total_history[-1]["bucket"])
+    watts  = sum(st["status"]["watts"] for st in plug_state.values() if st["status"])
+    if plug_total_history and plug_total_history[-1]["bucket"] == bucket:
+        plug_total_history.pop()
+    elif plug_total_history:
+        last = plug_total_history[-1]
+        for b in range(max(last["bucket"] + 1, bucket - plug_total_history.maxlen), bucket):
+            plug_total_history.append(_total_point(b, last["w"]))
+    plug_total_history.append(_total_point(bucket, watts))
+
+
+def _total_point(bucket: int, watts: float) -> dict:
+    t = datetime.fromtimestamp(bucket * PLUG_POLL_INTERVAL).strftime("%H:%M:%S")
+    return {"t": t, "w": watts, "bucket": bucket}
+
+
+plug_poller   = pipeline.AdaptivePoller(base=PLUG_POLL_INTERVAL)   # follows the device registry
+plug_pipeline = pipeline.Pipeline(plug_poller, on_state=_apply_plug_reading)
+
+
 def plug_polling_loop():
-    """Poll both smart plugs via tinytuya and store to DB."""
-    last_poll_time: Dict[str, Optional[float]] = {"plug": None, "server": None}
+    """Poll every registered smart plug via tinytuya, each at its own adaptive rate;
+    readings fan out to the registered sinks (MariaDB, AWS IoT Core)."""
+    plug_pipeline.run(pipeline.SCHEDULER_TICK)
 
-    while True:
-        for dev_key in ("plug", "server"):
-            status = tuya_local.get_status(dev_key)
-            now = time.time()
 
-            with plug_lock:
-                if status:
-                    plug_state[dev_key]["status"] = status
-                    plug_state[dev_key]["ok"]     = True
-                    plug_state[dev_key]["history"].append({
-                        "t": datetime.now().strftime("%H:%M:%S"),
-                        "w": status["watts"],
-                    })
-
-                    # Wh delta calculation
-                    wh_delta = 0.0
-                    if last_poll_time[dev_key]:
-                        elapsed_h = (now - last_poll_time[dev_key]) / 3600
-                        wh_delta  = status["watts"] * elapsed_h
-
-                    last_poll_time[dev_key] = now
-
-                    # Store to MariaDB
-                    try:
-                        # Publish to AWS IoT Core
-                        aws_iot_publisher.publish(dev_key, status, wh_delta)
-                        
-                        db.insert_energy(
-                            device_id=tuya_local.DEVICES[dev_key]["id"],
-                            device_name=status["device_name"],
-                            watts=status["watts"],
-                            wh_delta=wh_delta,
-                            voltage=status["voltage"],
-                            current_ma=status["current_ma"],
-                        )
-                        db.aggregate_daily(tuya_local.DEVICES[dev_key]["id"])
-                    except Exception as e:
-                        print(f"[db] insert error ({dev_key}): {e}")
-                else:
-                    plug_state[dev_key]["ok"] = False
+def _on_breaker_change(dev_key: str, old: str, new: str):
+    c_breaker.labels(dev_key, old, new).inc()
+    g_breaker.labels(dev_key).set({"open": 1, "half_open": 0.5}.get(new, 0))
+
+
+def _on_plug_push(dev_key: str, status: dict):
+    """Listener callback: pushed DPS changes go straight to the live gauges.
+    History points and DB writes stay on the poll loop's cadence."""
+    with plug_lock:
+        plug_state[dev_key]["status"] = status
+        plug_state[dev_key]["ok"]     = True
 
-        time.sleep(PLUG_POLL_INTERVAL)
+
+def _on_registry_change(added: list, removed: list, changed: list):
+    """Forget the live state of plugs removed from the registry; panels
+    rebuild themselves on their next refresh."""
+    with plug_lock:
+        for dev_key in removed:
+            plug_state.pop(dev_key, None)
+    with energy_cache_lock:
+        for dev_key in removed:
+            energy_cache.pop(dev_key, None)
 
 # ─────────────────────────────────────────────────────────────────────────────
 #  SYSTEM METRICS LOOP
 # ─────────────────────────────────────────────────────────────────────────────
 def _fetch_all_metrics() -> dict:
-    """Pure sync function — runs in thread pool via run.io_bound(), never blocks event loop."""
+    """Pure sync function — runs in thread pool via run.io_bound(), never blocks event loop.
+    Gauges whose query failed or timed out are left out, so the UI keeps their last value."""
     stats = {}
     iot = {}
+    t0 = time.perf_counter()
+    res = prom.collect()
+    prom_ms = (time.perf_counter() - t0) * 1000
+
+    def value(key):
+        series = res.get(key)
+        return float(series[0]['value'][1]) if series else None
 
-    cpu_q = prom.custom_query(
-        query='100 - (avg(rate(node_cpu_seconds_total{mode="idle"}[1m])) * 100)')
-    stats['cpu_percent'] = round(float(cpu_q[0]['value'][1]), 1) if cpu_q else 0
-    stats['cpu_temp']    = get_cpu_temp()
+    if 'cpu_percent' in res:
+        cpu = value('cpu_percent')
+        stats['cpu_percent'] = round(cpu, 1) if cpu is not None else 0
+    stats['cpu_temp'] = get_cpu_temp()
 
-    mem_used  = prom.custom_query(query='node_memory_MemTotal_bytes - node_memory_MemAvailable_bytes')
-    mem_total = prom.custom_query(query='node_memory_MemTotal_bytes')
+    mem_used, mem_total = value('mem_used'), value('mem_total')
     if mem_used and mem_total:
-        stats['memory_used_gb']  = round(float(mem_used[0]['value'][1]) / (1024**3), 2)
-        stats['memory_total_gb'] = round(float(mem_total[0]['value'][1]) / (1024**3), 2)
+        stats['memory_used_gb']  = round(mem_used / (1024**3), 2)
+        stats['memory_total_gb'] = round(mem_total / (1024**3), 2)
         stats['memory_percent']  = round(
             stats['memory_used_gb'] / stats['memory_total_gb'] * 100, 1)
 
-    nvme_used  = prom.custom_query(query='node_filesystem_size_bytes{mountpoint="/mnt/nvme"} - node_filesystem_avail_bytes{mountpoint="/mnt/nvme"}')
-    nvme_total = prom.custom_query(query='node_filesystem_size_bytes{mountpoint="/mnt/nvme"}')
+    nvme_used, nvme_total = value('nvme_used'), value('nvme_total')
     if nvme_used and nvme_total:
-        stats['nvme_used_gb']  = round(float(nvme_used[0]['value'][1]) / (1024**3), 1)
-        stats['nvme_total_gb'] = round(float(nvme_total[0]['value'][1]) / (1024**3), 1)
+        stats['nvme_used_gb']  = round(nvme_used / (1024**3), 1)
+        stats['nvme_total_gb'] = round(nvme_total / (1024**3), 1)
         stats['nvme_percent']  = round(
             stats['nvme_used_gb'] / stats['nvme_total_gb'] * 100, 1)
     stats['nvme_temp'] = get_nvme_temp()
 
-    hdd_used  = prom.custom_query(query='node_filesystem_size_bytes{mountpoint="/mnt/hdd-public"} - node_filesystem_avail_bytes{mountpoint="/mnt/hdd-public"}')
-    hdd_total = prom.custom_query(query='node_filesystem_size_bytes{mountpoint="/mnt/hdd-public"}')
+    hdd_used, hdd_total = value('hdd_used'), value('hdd_total')
     if hdd_used and hdd_total:
-        stats['hdd_used_gb']  = round(float(hdd_used[0]['value'][1]) / (1024**3), 1)
-        stats['hdd_total_gb'] = round(float(hdd_total[0]['value'][1]) / (1024**3), 1)
+        stats['hdd_used_gb']  = round(hdd_used / (1024**3), 1)
+        stats['hdd_total_gb'] = round(hdd_total / (1024**3), 1)
         stats['hdd_percent']  = round(
             stats['hdd_used_gb'] / stats['hdd_total_gb'] * 100, 1)
     stats['hdd_status'] = get_hdd_status()
 
-    esp32_temps    = prom.custom_query(query='esp32_temperature_celsius')
-    esp32_humidity = prom.custom_query(query='esp32_humidity_percent')
-    for metric in esp32_temps:
+    for metric in res.get('esp32_temp', []):
         did = metric['metric']['device_id']
         iot.setdefault(did, {})['temperature'] = round(float(metric['value'][1]), 1)
-    for metric in esp32_humidity:
+    for metric in res.get('esp32_humidity', []):
         did = metric['metric']['device_id']
         iot.setdefault(did, {})['humidity'] = round(float(metric['value'][1]), 1)
 
-    return {'system': stats, 'iot': iot}
+    return {'system': stats, 'iot': iot,
+            'timing': {'prom_ms': prom_ms, 'total_ms': (time.perf_counter() - t0) * 1000}}
+
+
+# End-to-end refresh latency, logged every METRICS_LOG_EVERY refreshes
+metrics_latency = {'prom_ms': deque(maxlen=100), 'total_ms': deque(maxlen=100)}
+METRICS_LOG_EVERY = 60
 
 
 async def update_metrics():
+    refreshes = 0
     while True:
         global system_stats, iot_devices, last_update
         try:
@@ -497,6 +513,13 @@ async def update_metrics():
             system_stats.update(result['system'])
             iot_devices.update(result['iot'])
             last_update = datetime.now().strftime("%H:%M:%S")
+            for k, v in result['timing'].items():
+                metrics_latency[k].append(v)
+            refreshes += 1
+            if refreshes % METRICS_LOG_EVERY == 0:
+                print("[metrics] refresh latency (last 100): " + ", ".join(
+                    f"{k} mean {sum(v) / len(v):.0f} max {max(v):.0f}"
+                    for k, v in metrics_latency.items()))
         except Exception as e:
             print(f"❌ Metrics error: {e}")
         await asyncio.sleep(7)
@@ -790,11 +813,10 @@ def render_server_content():
                                         'text-lg font-bold text-slate-800 dark:text-white')
 
                 # Quick plug status summary cards
-                for dev_key in ("plug", "server"):
+                for dev_key, cfg in tuya_local.DEVICES.items():
                     with plug_lock:
                         s  = plug_state[dev_key]["status"]
                         ok = plug_state[dev_key]["ok"]
-                    cfg = tuya_local.DEVICES[dev_key]
 
                     with ui.card().classes(
                         'glass-card p-4 min-w-[200px] hover:scale-105 '
@@ -828,6 +850,38 @@ def render_server_content():
 
         ui.timer(6.0, update_iot_display)
 
+        # ── History charts (Prometheus query_range, cached) ──────────────────
+        with ui.row().classes('w-full items-center justify-between mt-8 mb-2'):
+            with ui.row().classes('items-center gap-2'):
+                ui.icon('timeline', color='primary')
+                ui.label('History').classes('text-lg font-semibold text-slate-800 dark:text-gray-200')
+            history_zoom = ui.toggle(list(prom_history.ZOOMS), value='1h',
+                                     on_change=lambda: update_history()).props('unelevated size=sm').classes(
+                'bg-slate-100 dark:bg-slate-800/50 text-slate-600 dark:text-slate-400')
+
+        with ui.grid().classes('w-full gap-4 sm:gap-6 grid-cols-1 lg:grid-cols-3'):
+            history_charts = {
+                ('cpu', 'memory'):               _history_chart('CPU & Memory', '%'),
+                ('disk',):                       _history_chart('Disk Usage', '%'),
+                ('esp32_temp', 'esp32_humidity'): _history_chart('ESP32 Sensors', '°C / %'),
+            }
+
+        async def update_history():
+            try:
+                data = await run.io_bound(prom_hist.history, history_zoom.value)
+            except Exception as e:
+                print(f"History chart error: {e}")
+                return
+            for keys, chart in history_charts.items():
+                chart.options['series'] = [
+                    {'name': _history_series_name(key, name), 'type': 'line', 'showSymbol': False,
+                     'smooth': True, 'data': points}
+                    for key in keys for name, points in data['series'][key].items()]
+                chart.options['legend']['data'] = [sr['name'] for sr in chart.options['series']]
+                chart.update()
+
+        ui.timer(30.0, update_history)
+
         with ui.card().classes(
             'glass-card w-full p-4 sm:p-6 mt-2 sm:mt-4 bg-slate-200/50 dark:bg-slate-800/50 '
             'border-l-4 border-slate-300 dark:border-white'):
@@ -838,11 +892,34 @@ def render_server_content():
                     ui.label().bind_text_from(globals(), 'ai_insights').classes(
                         'text-slate-700 dark:text-gray-300 whitespace-pre-wrap leading-relaxed')
 
+def _history_chart(title: str, unit: str):
+    with ui.card().classes('glass-card p-4'):
+        ui.label(title).classes('text-slate-500 dark:text-slate-400 text-xs font-bold uppercase tracking-widest')
+        return ui.echart({
+            'tooltip': {'trigger': 'axis', 'backgroundColor': 'rgba(15, 23, 42, 0.6)',
+                        'textStyle': {'color': '#f8fafc', 'fontFamily': 'Inter'}},
+            'legend':  {'data': [], 'textStyle': {'color': '#94a3b8'}, 'top': 0},
+            'grid':    {'left': '3%', 'right': '4%', 'bottom': '3%', 'top': 30, 'containLabel': True},
+            'xAxis':   {'type': 'time', 'axisLabel': {'color': '#94a3b8'}},
+            'yAxis':   {'type': 'value', 'name': unit, 'nameTextStyle': {'color': '#94a3b8'},
+                        'axisLabel': {'color': '#94a3b8'},
+                        'splitLine': {'lineStyle': {'color': 'rgba(255,255,255,0.05)'}}},
+            'series':  [],
+        }).classes('w-full h-[220px]')
+
+
+def _history_series_name(key: str, name: str) -> str:
+    label = {'cpu': 'CPU', 'memory': 'Memory', 'disk': 'Disk',
+             'esp32_temp': 'Temp', 'esp32_humidity': 'Humidity'}[key]
+    return f"{label} {name}" if name else label
+
 # ─────────────────────────────────────────────────────────────────────────────
 # ─────────────────────────────────────────────────────────────────────────────
 #  TAB 2 — ENERGY
 # ─────────────────────────────────────────────────────────────────────────────
-def render_energy_content():
+def render_energy_content(visible=lambda: True):
+    """`visible()` is True while the Energy tab is showing; only then are
+    the plugs on screen asked to be polled fast."""
     peak_watt = [0.0]
     selected_device = {'value': 'all'}  # default device for energy view
 
@@ -895,16 +972,12 @@ def render_energy_content():
                 ui.label('Controls').classes('text-sm font-bold text-slate-400 uppercase')
 
                 def on_device_change(e):
-                    if e.value == 'Server Plug':
-                        selected_device['value'] = 'server'
-                    elif e.value == 'Smart Plug':
-                        selected_device['value'] = 'plug'
-                    else:
-                        selected_device['value'] = 'all'
-
-                ui.select(
-                    ['All Plugs (Total)', 'Smart Plug', 'Server Plug'], value='All Plugs (Total)',
-                    label='Device Selector', on_change=on_device_change
+                    selected_device['value'] = e.value or 'all'
+
+                device_select = ui.select(
+                    {'all': 'All Plugs (Total)',
+                     **{k: cfg['name'] for k, cfg in tuya_local.DEVICES.items()}},
+                    value='all', label='Device Selector', on_change=on_device_change
                 ).props('outlined rounded popup-content-class="glass-menu"').classes('w-full')
 
         # ── Power history chart ──────────────────────────────────────────────
@@ -970,26 +1043,34 @@ def render_energy_content():
         async def update_energy_stats():
             dk = selected_device['value']
 
+            devices = tuya_local.DEVICES
+            options = {'all': 'All Plugs (Total)', **{k: cfg['name'] for k, cfg in devices.items()}}
+            if device_select.options != options:
+                device_select.set_options(options, value=dk if dk in options else 'all')
+                dk = selected_device['value'] = device_select.value
+
+            if visible():
+                for d_key in (devices if dk == 'all' else [dk]):
+                    plug_poller.watch(d_key)
+
             if dk == 'all':
                 pwr_w, today_kwh, cost_rm, month_kwh = 0.0, 0.0, 0.0, 0.0
                 with plug_lock:
-                    for d_key in ["plug", "server"]:
+                    for d_key in devices:
                         s = plug_state[d_key]["status"]
                         if s: pwr_w += s["watts"]
-                    h1 = list(plug_state["plug"]["history"])
-                    h2 = list(plug_state["server"]["history"])
+                    total = list(plug_total_history)
 
                 # Read from cache — zero blocking
                 with energy_cache_lock:
-                    for d_key in ["plug", "server"]:
+                    for d_key, cfg in devices.items():
                         today_kwh += energy_cache[d_key]["total_kwh"]
                         cost_rm += energy_cache[d_key]["cost_rm"]
-                        month_kwh += energy_cache[d_key]["total_kwh"] + (42.5 if d_key == "plug" else 150.2)
+                        month_kwh += energy_cache[d_key]["total_kwh"] + cfg["month_offset_kwh"]
                 
                 pwr_kw = pwr_w / 1000.0
-                min_len = min(len(h1), len(h2))
-                labels = [h1[i]["t"] for i in range(min_len)] if min_len > 0 else []
-                values = [round(h1[i]["w"] + h2[i]["w"], 1) for i in range(min_len)] if min_len > 0 else []
+                labels = [p["t"] for p in total]
+                values = [round(p["w"], 1) for p in total]
 
             else:
                 with plug_lock:
@@ -1006,7 +1087,7 @@ def render_energy_content():
                     today_kwh = energy_cache[dk]["total_kwh"]
                     cost_rm   = energy_cache[dk]["cost_rm"]
                     
-                month_kwh = today_kwh + (42.5 if dk == "plug" else 150.2)
+                month_kwh = today_kwh + devices[dk]["month_offset_kwh"]
                 labels = [p["t"] for p in history]
                 values = [round(p["w"], 1) for p in history]
 
@@ -1027,14 +1108,11 @@ def render_energy_content():
                 try:
                     if chart_filter['value'] == 'Day':
                         if dk == 'all':
-                            pts1 = await run.io_bound(db.get_hourly_history, tuya_local.DEVICES["plug"]["id"], 24)
-                            pts2 = await run.io_bound(db.get_hourly_history, tuya_local.DEVICES["server"]["id"], 24)
-                            d1 = {p["hour_str"]: (p["kwh"] or 0) for p in pts1}
-                            d2 = {p["hour_str"]: (p["kwh"] or 0) for p in pts2}
-                            all_hours = sorted(list(set(d1.keys()) | set(d2.keys())))
-                            pts = [{"hour_str": h, "kwh": d1.get(h, 0) + d2.get(h, 0)} for h in all_hours]
+                            pts = await run.io_bound(
+                                db.get_hourly_history_many,
+                                [cfg["id"] for cfg in devices.values()], 24, True)
                         else:
-                            pts = await run.io_bound(db.get_hourly_history, tuya_local.DEVICES[dk]["id"], 24)
+                            pts = await run.io_bound(db.get_hourly_history, devices[dk]["id"], 24)
                         labels = [datetime.strptime(p["hour_str"], "%Y-%m-%d %H:%M:%S").strftime("%H:00") for p in pts]
                         values = [round((p["kwh"] or 0), 3) for p in pts]
                         area_chart.options['yAxis'][0]['name'] = 'Energy (kWh)'
@@ -1043,14 +1121,11 @@ def render_energy_content():
                     elif chart_filter['value'] in ['Week', 'Month']:
                         days_limit = 7 if chart_filter['value'] == 'Week' else 30
                         if dk == 'all':
-                            pts1 = await run.io_bound(db.get_daily_history, tuya_local.DEVICES["plug"]["id"], days_limit)
-                            pts2 = await run.io_bound(db.get_daily_history, tuya_local.DEVICES["server"]["id"], days_limit)
-                            d1 = {str(p["date_str"]): (p["kwh"] or 0) for p in pts1}
-                            d2 = {str(p["date_str"]): (p["kwh"] or 0) for p in pts2}
-                            all_days = sorted(list(set(d1.keys()) | set(d2.keys())))
-                            pts = [{"date_str": d, "kwh": d1.get(d, 0) + d2.get(d, 0)} for d in all_days]
+                            pts = await run.io_bound(
+                                db.get_daily_history_many,
+                                [cfg["id"] for cfg in devices.values()], days_limit, True)
                         else:
-                            pts = await run.io_bound(db.get_daily_history, tuya_local.DEVICES[dk]["id"], days_limit)
+                            pts = await run.io_bound(db.get_daily_history, devices[dk]["id"], days_limit)
                         labels = [datetime.strptime(str(p["date_str"]), "%Y-%m-%d").strftime("%b %d") for p in pts]
                         values = [round((p["kwh"] or 0), 3) for p in pts]
                         area_chart.options['yAxis'][0]['name'] = 'Energy (kWh)'
@@ -1295,7 +1370,9 @@ def _build_plug_panel(dev_key: str) -> dict:
 # ─────────────────────────────────────────────────────────────────────────────
 #  TAB 3 — PLUGS
 # ─────────────────────────────────────────────────────────────────────────────
-def render_plugs_content():
+def render_plugs_content(visible=lambda: True):
+    """`visible()` is True while the Plugs tab is showing; only then are
+    its plugs asked to be polled fast."""
     with ui.column().classes('w-full gap-4 sm:gap-6'):
 
 
@@ -1303,9 +1380,21 @@ def render_plugs_content():
             ui.icon('electrical_services', color='positive')
             ui.label('Device Control').classes('text-lg font-semibold text-slate-800 dark:text-gray-200')
 
-        with ui.grid().classes('w-full gap-6 grid-cols-1 lg:grid-cols-2'):
-            plug_refs   = _build_plug_panel("plug")
-            server_refs = _build_plug_panel("server")
+        panel_grid = ui.grid().classes('w-full gap-6 grid-cols-1 lg:grid-cols-2')
+
+    panel_refs: Dict[str, dict] = {}
+    built_from = {"devices": None}
+
+    def _build_panels():
+        """One panel per registry device; rebuilt when the registry changes."""
+        built_from["devices"] = tuya_local.DEVICES
+        panel_grid.clear()
+        panel_refs.clear()
+        with panel_grid:
+            for dev_key in built_from["devices"]:
+                panel_refs[dev_key] = _build_plug_panel(dev_key)
+
+    _build_panels()
 
     # ── Live update timer ────────────────────────────────────────────────
     def _update_panel(refs: dict):
@@ -1352,8 +1441,13 @@ def render_plugs_content():
         refs["chart"].update()
 
     def _refresh_plugs():
-        _update_panel(plug_refs)
-        _update_panel(server_refs)
+        if tuya_local.DEVICES != built_from["devices"]:
+            _build_panels()
+        if visible():
+            for dk in panel_refs:
+                plug_poller.watch(dk)
+        for refs in panel_refs.values():
+            _update_panel(refs)
 
     ui.timer(4.0, _refresh_plugs)
 
@@ -1392,9 +1486,9 @@ def index_page():
             with ui.tab_panel('Server').classes('p-0'):
                 render_server_content()
             with ui.tab_panel('Energy').classes('p-0'):
-                render_energy_content()
+                render_energy_content(visible=lambda: toggle.value == 'Energy')
             with ui.tab_panel('Plugs').classes('p-0'):
-                render_plugs_content()
+                render_plugs_content(visible=lambda: toggle.value == 'Plugs')
             with ui.tab_panel('Network').classes('p-0'):
                 render_network_content()
 
@@ -1456,6 +1550,13 @@ def render_network_content():
 
                 # Per-target status cards
                 target_cards: dict = {}
+                with ui.row().classes('w-full items-center justify-between'):
+                    ui.label('RTT Percentiles').classes(
+                        'font-semibold text-slate-700 dark:text-gray-300')
+                    stats_window = ui.toggle(list(latency_stats.WINDOWS), value=NETWORK_ANOMALY_WINDOW,
+                                             on_change=lambda: _refresh_network_ui()).props(
+                        'unelevated size=sm').classes(
+                        'bg-slate-100 dark:bg-slate-800/50 text-slate-600 dark:text-slate-400')
                 with ui.grid().classes('w-full gap-4 grid-cols-1 sm:grid-cols-3'):
                     for target in NETWORK_TARGETS:
                         with ui.card().classes(
@@ -1468,7 +1569,12 @@ def render_network_content():
                             loss_label = ui.label('0.0% loss').classes(
                                 'text-xs text-positive font-semibold mt-1 '
                                 'bg-green-100 dark:bg-green-900/30 px-2 py-0.5 rounded')
-                            target_cards[target] = {'lat': lat_label, 'loss': loss_label, 'card': c}
+                            pct_label  = ui.label('p50 — · p95 — · p99 —').classes(
+                                'text-xs font-mono text-slate-500 dark:text-gray-400 mt-2')
+                            jit_label  = ui.label('jitter — · 0 samples').classes(
+                                'text-xs text-slate-400 dark:text-gray-500')
+                            target_cards[target] = {'lat': lat_label, 'loss': loss_label,
+                                                    'pct': pct_label, 'jit': jit_label, 'card': c}
 
             # ── Right: AI + Actions + Route Log ──────────────────────────────
             with ui.column().classes('col-span-1 gap-4'):
@@ -1508,7 +1614,9 @@ def render_network_content():
                                 lines.append(
                                     f"{t}: latency={td['latency']:.1f}ms, "
                                     f"jitter={td['jitter']:.1f}ms, "
-                                    f"packet_loss={td['packet_loss']:.1f}%"
+                                    f"packet_loss={td['packet_loss']:.1f}%\n"
+                                    f"  {_percentile_line(td['stats'], '1m')}\n"
+                                    f"  {_percentile_line(td['stats'], '1h')}"
                                 )
                             events = "\n".join(network_state['route_log'][:5])
                             summary = "\n".join(lines)
@@ -1568,6 +1676,7 @@ def render_network_content():
                     'packet_loss': td['packet_loss'],
                     'history':     list(td['history']),
                     'status':      td['status'],
+                    'stats':       td['stats'],
                 }
                 for t, td in network_state['targets'].items()
             }
@@ -1590,6 +1699,14 @@ def render_network_content():
                 f"{td['latency']:.1f} ms" if td['latency'] > 0 else "— ms")
             elems['loss'].set_text(f"{td['packet_loss']:.1f}% loss")
 
+            w = td['stats'].get(stats_window.value)
+            if w and w['count']:
+                elems['pct'].set_text(f"p50 {w['p50']:.1f} · p95 {w['p95']:.1f} · p99 {w['p99']:.1f} ms")
+                elems['jit'].set_text(f"jitter {w['jitter']:.1f} ms · {w['loss']:.1f}% loss · {w['sent']} samples")
+            else:
+                elems['pct'].set_text('p50 — · p95 — · p99 —')
+                elems['jit'].set_text('jitter — · 0 samples')
+
             if td['packet_loss'] >= NETWORK_PACKET_LOSS_THRESHOLD:
                 elems['loss'].classes(
                     replace='text-xs text-negative font-semibold mt-1 '
@@ -1621,35 +1738,57 @@ def energy_cache_loop():
     """Single background thread polls DB summaries every 10s, caches results.
     UI timers read from this cache instead of querying DB directly."""
     while True:
-        for dev_key in ("plug", "server"):
+        devices = tuya_local.DEVICES
+        try:
+            summaries = db.get_today_summary_many([cfg["id"] for cfg in devices.values()])
+        except Exception as e:
+            print(f"[energy_cache] today summary: {e}")
+            summaries = {}
+
+        for dev_key, cfg in devices.items():
             try:
-                summary = db.get_today_summary(tuya_local.DEVICES[dev_key]["id"])
-                db.aggregate_monthly(tuya_local.DEVICES[dev_key]["id"])
-                monthly = db.get_monthly_history(tuya_local.DEVICES[dev_key]["id"], months=1)
+                summary = summaries.get(cfg["id"])
+                if summary is None:
+                    continue
+                db.aggregate_monthly(cfg["id"])
+                monthly = db.get_monthly_history(cfg["id"], months=1)
                 month_kwh = float(monthly[0]["total_kwh"]) if monthly else summary["total_kwh"]
                 with energy_cache_lock:
                     energy_cache[dev_key] = {**summary, "month_kwh": month_kwh}
             except Exception as e:
                 print(f"[energy_cache] {dev_key}: {e}")
+        time.sleep(PLUG_POLL_INTERVAL)
 
 # ─────────────────────────────────────────────────────────────────────────────
 #  STARTUP
 # ─────────────────────────────────────────────────────────────────────────────
+try:
+    schema.migrate(verbose=True)
+except Exception as e:
+    print(f"[schema] migration error: {e}")
+
 app.on_startup(lambda: asyncio.create_task(update_metrics()))
 app.on_startup(lambda: asyncio.create_task(update_ai_insights()))
 app.on_startup(lambda: asyncio.create_task(update_network_state()))
+start_http_server(DASHBOARD_METRICS_PORT)
+print(f"Prometheus dashboard metrics → http://localhost:{DASHBOARD_METRICS_PORT}/metrics")
+tuya_local.on_breaker_change(_on_breaker_change)
+REGISTRY.register(latency_stats.LatencyCollector())
+sinks.register("db",    sinks.db_sink)
+sinks.register("cloud", sinks.cloud_sink)
+tuya_local.on_registry_change(_on_registry_change)
+tuya_local.start_listeners(on_update=_on_plug_push)
+tuya_discovery.start(on_beacon=tuya_local.apply_beacon)
+threading.Thread(target=tuya_local.registry_loop, daemon=True).start()
 threading.Thread(target=plug_polling_loop, daemon=True).start()
 threading.Thread(target=energy_cache_loop, daemon=True).start()
-
-try:
-                summary = db.get_today_summary(tuya_local.DEVICES[dev_key]["id"])
-                db.aggregate_monthly(tuya_local.DEVICES[dev_key]["id"])
-                monthly = db.get_monthly_history(tuya_local.DEVICES[dev_key]["id"], months=1)
-                month_kwh = float(monthly[0]["total_kwh"]) if monthly else summary["total_kwh"]
-                with energy_cache_lock:
-                    energy_cache[dev_key] = {**summary, "month_kwh": month_kwh}
-            except Exception as e:
-                print(f"[energy_cache] {dev_key}: {e}")
+threading.Thread(target=db.reconcile_loop, args=(tuya_local.device_ids,), daemon=True).start()
+threading.Thread(target=compactor.compactor_loop, daemon=True).start()
+app.on_shutdown(sinks.close_all)
+app.on_shutdown(db.energy_writer.close)
+app.on_shutdown(aws_iot_publisher.publisher.close)
+app.on_shutdown(prom.close)
+app.on_shutdown(prober.stop)
 
 @ui.page('/cloud')
 async def cloud_page():
@@ -1662,7 +1801,8 @@ async def cloud_page():
         # ── Today's summary cards ──────────────────────────────────────────────
         ui.label("Today's Summary").classes('text-h6 text-grey-4')
         with ui.row().classes('w-full gap-4'):
-            for dev_key, dev_name in [('plug', 'Smart Plug'), ('server', 'Server Plug')]:
+            for dev_key, cfg in tuya_local.DEVICES.items():
+                dev_name = cfg['name']
                 summary = cloud_db.get_today_summary(dev_key)
                 with ui.card().classes('flex-1 q-pa-md'):
                     ui.label(dev_name).classes('text-subtitle1 text-bold q-mb-sm')
@@ -1677,6 +1817,34 @@ async def cloud_page():
                                 ui.label(label).classes('text-caption text-grey-5')
                                 ui.label(value).classes('text-body1 text-bold')
 
+        # ── IoT Core publisher queue (store-and-forward spool) ────────────────
+        ui.label('IoT Core Publisher').classes('text-h6 text-grey-4')
+        with ui.card().classes('w-full q-pa-md'):
+            with ui.grid(columns=4).classes('w-full gap-2'):
+                iot_labels = {}
+                for key, label in [
+                    ('connected',         'Connection'),
+                    ('spool_depth',       'Spooled'),
+                    ('oldest_age_s',      'Oldest (s)'),
+                    ('replay_msgs_per_s', 'Replay msg/s'),
+                    ('memory_depth',      'In Memory'),
+                    ('acked',             'Acked'),
+                    ('replayed',          'Replayed'),
+                    ('dropped',           'Dropped'),
+                ]:
+                    with ui.column().classes('gap-0'):
+                        ui.label(label).classes('text-caption text-grey-5')
+                        iot_labels[key] = ui.label('—').classes('text-body1 text-bold')
+
+        def refresh_iot_metrics():
+            m = aws_iot_publisher.publisher.metrics()
+            for key, lbl in iot_labels.items():
+                v = m[key]
+                lbl.set_text(('🟢 Online' if v else '🔴 Offline') if key == 'connected' else str(v))
+
+        refresh_iot_metrics()
+        ui.timer(5.0, refresh_iot_metrics)
+
         ui.separator()
 
         # ── Recent readings tables ─────────────────────────────────────────────
@@ -1689,7 +1857,8 @@ async def cloud_page():
             {'name': 'sw', 'label': 'Switch',        'field': 'sw', 'align': 'center'},
         ]
 
-        for dev_key, dev_name in [('plug', 'Smart Plug'), ('server', 'Server Plug')]:
+        for dev_key, cfg in tuya_local.DEVICES.items():
+            dev_name = cfg['name']
             ui.label(f'{dev_name} — Last 15 Readings').classes('text-h6 q-mt-sm')
             readings = cloud_db.get_recent_readings(dev_key, limit=15)
 
@@ -0,0 +1,225 @@
+"""
+latency_stats.py
+================
+Streaming RTT statistics per network target: p50 / p95 / p99, mean,
+jitter and loss over the last 1m / 15m / 1h / 24h, in fixed memory and
+O(1) work per sample.
+
+RTTs go into a log-bucketed histogram: bucket i covers
+[MIN_RTT_MS * GROWTH**i, MIN_RTT_MS * GROWTH**(i+1)), so a percentile is
+reported to within ±GROWTH/2 (about 5 %) from 0.05 ms up to MAX_RTT_MS,
+with BUCKETS counters however many samples arrive.
+
+Each window is a ring of SLOTS sub-histograms (1m -> 3 s slots, 24h ->
+72 min) plus a running total. A sample increments its slot and the total;
+when the ring advances, the expiring slot is subtracted from the total —
+each count is added once and removed once, so the per-sample cost stays
+constant and the window slides in 1/SLOTS steps.
+
+    record("8.8.8.8", time.time(), 14.2)     # net_prober on_sample hook
+    record("8.8.8.8", time.time(), None)     # lost
+    snapshot("8.8.8.8")["1m"]
+    # {"count": 24, "sent": 24, "loss": 0.0, "mean": 14.1, "jitter": 0.7,
+    #  "p50": 14.0, "p95": 16.3, "p99": 17.1}
+
+LatencyCollector exposes every target / window to prometheus_client:
+
+    network_rtt_ms{target, window, quantile="0.5|0.95|0.99"}
+    network_jitter_ms{target, window}
+    network_packet_loss_percent{target, window}
+    network_probe_samples{target, window}
+"""
+
+import math
+import threading
+import time
+
+from prometheus_client.core import GaugeMetricFamily
+
+WINDOWS    = {"1m": 60, "15m": 900, "1h": 3600, "24h": 86400}   # name -> seconds
+SLOTS      = 20         # ring slots per window
+MIN_RTT_MS = 0.05
+MAX_RTT_MS = 60000.0
+GROWTH     = 1.1        # bucket width ratio
+BUCKETS    = math.ceil(math.log(MAX_RTT_MS / MIN_RTT_MS) / math.log(GROWTH)) + 1
+QUANTILES  = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+_LOG_GROWTH = math.log(GROWTH)
+
+
+def bucket_of(rtt: float) -> int:
+    if rtt <= MIN_RTT_MS:
+        return 0
+    return min(BUCKETS - 1, int(math.log(rtt / MIN_RTT_MS) / _LOG_GROWTH))
+
+
+def bucket_value(i: int) -> float:
+    """Representative RTT of bucket i (geometric midpoint)."""
+    return MIN_RTT_MS * GROWTH ** (i + 0.5)
+
+
+class _Slot:
+    __slots__ = ("buckets", "sent", "received", "rtt_sum", "jitter_sum", "jitter_n")
+
+    def __init__(self):
+        self.buckets = {}        # bucket -> count, at most BUCKETS entries
+        self.sent = self.received = self.jitter_n = 0
+        self.rtt_sum = self.jitter_sum = 0.0
+
+
+class _Window:
+    """Ring of SLOTS slots covering `span` seconds, plus their running total."""
+
+    def __init__(self, span: float, slots: int = SLOTS):
+        self.slot_len = span / slots
+        self.ring     = [_Slot() for _ in range(slots)]
+        self.current  = None     # absolute index of the newest slot
+        self.total    = [0] * BUCKETS
+        self.sent = self.received = self.jitter_n = 0
+        self.rtt_sum = self.jitter_sum = 0.0
+
+    def add(self, ts: float, rtt: float | None, jitter: float | None) -> None:
+        self.advance(ts)
+        slot = self.ring[self.current % len(self.ring)]
+        slot.sent += 1
+        self.sent += 1
+        if rtt is not None:
+            b = bucket_of(rtt)
+            slot.buckets[b] = slot.buckets.get(b, 0) + 1
+            self.total[b] += 1
+            slot.received += 1
+            self.received += 1
+            slot.rtt_sum += rtt
+            self.rtt_sum += rtt
+        if jitter is not None:
+            slot.jitter_sum += jitter
+            self.jitter_sum += jitter
+            slot.jitter_n += 1
+            self.jitter_n += 1
+
+    def advance(self, ts: float) -> None:
+        index = int(ts // self.slot_len)
+        if self.current is None:
+            self.current = index
+            return
+        if index <= self.current:
+            return      # same slot, or the clock stepped back: keep filling the newest
+        for i in range(self.current + 1, min(index, self.current + len(self.ring)) + 1):
+            self._expire(self.ring[i % len(self.ring)])
+        self.current = index
+
+    def _expire(self, slot: _Slot) -> None:
+        for b, n in slot.buckets.items():
+            self.total[b] -= n
+        self.sent       -= slot.sent
+        self.received   -= slot.received
+        self.rtt_sum    -= slot.rtt_sum
+        self.jitter_sum -= slot.jitter_sum
+        self.jitter_n   -= slot.jitter_n
+        slot.__init__()
+
+    def summary(self) -> dict:
+        out = {
+            "count":  self.received,
+            "sent":   self.sent,
+            "loss":   round((self.sent - self.received) / self.sent * 100, 1) if self.sent else 0.0,
+            "mean":   round(self.rtt_sum / self.received, 2) if self.received else 0.0,
+            "jitter": round(self.jitter_sum / self.jitter_n, 2) if self.jitter_n else 0.0,
+        }
+        out.update(self._quantiles())
+        return out
+
+    def _quantiles(self) -> dict:
+        out = {name: 0.0 for name in QUANTILES}
+        if not self.received:
+            return out
+        pending = sorted(QUANTILES.items(), key=lambda kv: kv[1])
+        seen = 0
+        for b, n in enumerate(self.total):
+            seen += n
+            while pending and seen >= pending[0][1] * self.received:
+                out[pending.pop(0)[0]] = round(bucket_value(b), 2)
+            if not pending:
+                break
+        return out
+
+
+class LatencyStats:
+    """All WINDOWS for one target."""
+
+    def __init__(self, windows: dict = WINDOWS, slots: int = SLOTS):
+        self._lock    = threading.Lock()
+        self._windows = {name: _Window(span, slots) for name, span in windows.items()}
+        self._prev    = None     # last received RTT, for jitter
+
+    def add(self, rtt: float | None, ts: float = None) -> None:
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            jitter = None
+            if rtt is not None:
+                if self._prev is not None:
+                    jitter = abs(rtt - self._prev)
+                self._prev = rtt
+            for window in self._windows.values():
+                window.add(ts, rtt, jitter)
+
+    def snapshot(self, now: float = None) -> dict:
+        """{window: summary}, with slots older than the window dropped first."""
+        now = time.time() if now is None else now
+        with self._lock:
+            out = {}
+            for name, window in self._windows.items():
+                window.advance(now)
+                out[name] = window.summary()
+            return out
+
+
+# ── Registry ───────────────────────────────────────────────────────────────
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get(target: str) -> LatencyStats:
+    with _stats_lock:
+        if target not in _stats:
+            _stats[target] = LatencyStats()
+        return _stats[target]
+
+
+def record(target: str, ts: float, rtt: float | None) -> None:
+    """net_prober on_sample hook: one RTT sample (None = lost)."""
+    get(target).add(rtt, ts)
+
+
+def snapshot(target: str) -> dict:
+    return get(target).snapshot()
+
+
+def targets() -> list:
+    with _stats_lock:
+        return list(_stats)
+
+
+# ── Prometheus ─────────────────────────────────────────────────────────────
+
+class LatencyCollector:
+    """prometheus_client collector; computed at scrape time from the registry."""
+
+    def collect(self):
+        rtt     = GaugeMetricFamily("network_rtt_ms", "Probe RTT percentile (ms)",
+                                    labels=["target", "window", "quantile"])
+        jitter  = GaugeMetricFamily("network_jitter_ms", "Mean |ΔRTT| between consecutive replies (ms)",
+                                    labels=["target", "window"])
+        loss    = GaugeMetricFamily("network_packet_loss_percent", "Lost probes (%)",
+                                    labels=["target", "window"])
+        samples = GaugeMetricFamily("network_probe_samples", "Probes sent within the window",
+                                    labels=["target", "window"])
+        for target in targets():
+            for window, s in snapshot(target).items():
+                for name, q in QUANTILES.items():
+                    rtt.add_metric([target, window, str(q)], s[name])
+                jitter.add_metric([target, window], s["jitter"])
+                loss.add_metric([target, window], s["loss"])
+                samples.add_metric([target, window], s["sent"])
+        yield from (rtt, jitter, loss, samples)
@@ -0,0 +1,334 @@
+"""
+net_prober.py
+=============
+Asyncio network prober for the Network Monitor: every target is probed
+concurrently on one event loop, so a cycle takes about
+(PROBE_COUNT - 1) * PROBE_SPACING + PROBE_TIMEOUT seconds whether there
+are three targets or fifty, and nothing is forked.
+
+Two probe kinds:
+
+  icmp   echo request / reply over one shared ICMP socket — an
+         unprivileged datagram socket (net.ipv4.ping_group_range) when
+         allowed, a raw socket when running as root
+  tcp    time to complete a TCP handshake; a refused connection (RST)
+         still counts as a reply
+
+A target is "host" (PROBE_MODE: icmp, tcp, or auto — icmp when an ICMP
+socket can be opened, otherwise tcp to TCP_PORT) or "tcp://host:port".
+Hostnames are resolved asynchronously and cached for RESOLVE_TTL.
+
+Every RTT sample (None = lost) is passed to `on_sample(target, ts, rtt_ms)`
+as it completes and kept in a per-target sliding window (PROBE_WINDOW
+seconds) from which latency, jitter and loss are computed:
+
+    {"8.8.8.8": {"latency": 14.2, "jitter": 0.8, "packet_loss": 0.0,
+                 "sent": 24, "received": 24, "cycle_latency": 14.0,
+                 "kind": "icmp"}, ...}
+
+The loop runs on its own thread so RTTs are not inflated by whatever else
+the caller's event loop is doing. probe() is a blocking call for
+run.io_bound(); cycle() is the coroutine it runs on the prober loop.
+
+    python net_prober.py 8.8.8.8 youtube.com tcp://github.com:443 --cycles 3
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import struct
+import threading
+import time
+from collections import deque
+
+PROBE_MODE    = os.getenv("NETWORK_PROBE_MODE", "auto")          # icmp | tcp | auto
+PROBE_COUNT   = int(os.getenv("NETWORK_PROBE_COUNT", 4))         # samples per target per cycle
+PROBE_SPACING = float(os.getenv("NETWORK_PROBE_SPACING", 0.25))  # seconds between a target's samples
+PROBE_TIMEOUT = float(os.getenv("NETWORK_PROBE_TIMEOUT", 2.0))   # seconds before a sample is lost
+PROBE_WINDOW  = float(os.getenv("NETWORK_PROBE_WINDOW", 60))     # seconds of samples in the stats
+TCP_PORT      = int(os.getenv("NETWORK_TCP_PORT", 443))
+RESOLVE_TTL   = 300         # seconds a DNS answer is reused
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY   = 0
+PAYLOAD = b"server-dashboard" + bytes(40)     # 56 bytes, like ping
+
+
+# ── Sliding window ─────────────────────────────────────────────────────────
+
+class ProbeWindow:
+    """RTT samples (None = lost) of one target over the last `seconds`."""
+
+    def __init__(self, seconds: float = PROBE_WINDOW):
+        self.seconds = seconds
+        self.samples = deque()      # (ts, rtt_ms | None)
+
+    def add(self, ts: float, rtt: float | None) -> None:
+        self.samples.append((ts, rtt))
+        while self.samples and self.samples[0][0] < ts - self.seconds:
+            self.samples.popleft()
+
+    def summary(self) -> dict:
+        """latency = mean RTT, jitter = mean |ΔRTT| between consecutive replies
+        (RFC 3550 interarrival jitter, unsmoothed), packet_loss in %."""
+        rtts = [rtt for _, rtt in self.samples if rtt is not None]
+        sent = len(self.samples)
+        diffs = [abs(b - a) for a, b in zip(rtts, rtts[1:])]
+        return {
+            "latency":     round(statistics.fmean(rtts), 2) if rtts else 0.0,
+            "jitter":      round(statistics.fmean(diffs), 2) if diffs else 0.0,
+            "packet_loss": round((sent - len(rtts)) / sent * 100, 1) if sent else 100.0,
+            "sent":        sent,
+            "received":    len(rtts),
+        }
+
+
+# ── ICMP ───────────────────────────────────────────────────────────────────
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _echo_request(ident: int, seq: int) -> bytes:
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = _checksum(header + PAYLOAD)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, csum, ident, seq) + PAYLOAD
+
+
+def _open_icmp_socket():
+    """(socket, is_raw) — datagram first, it needs no privileges — or (None, False)."""
+    for kind in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+        except OSError:
+            continue
+        sock.setblocking(False)
+        return sock, kind == socket.SOCK_RAW
+    return None, False
+
+
+class IcmpPinger:
+    """One ICMP socket shared by every target; replies are matched by sequence number."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, sock: socket.socket, raw: bool):
+        self.loop    = loop
+        self.sock    = sock
+        self.raw     = raw
+        self.ident   = os.getpid() & 0xFFFF   # datagram sockets replace it with their own
+        self._seq    = 0
+        self._pending = {}                     # seq -> (addr, future)
+        loop.add_reader(sock.fileno(), self._on_readable)
+
+    async def ping(self, addr: str, timeout: float) -> float | None:
+        seq = self._next_seq()
+        fut = self.loop.create_future()
+        self._pending[seq] = (addr, fut)
+        try:
+            t0 = time.perf_counter()
+            self.sock.sendto(_echo_request(self.ident, seq), (addr, 0))
+            received = await asyncio.wait_for(fut, timeout)
+            return (received - t0) * 1000
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self._pending.pop(seq, None)
+
+    def close(self) -> None:
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+
+    def _next_seq(self) -> int:
+        for _ in range(0x10000):
+            self._seq = (self._seq + 1) & 0xFFFF
+            if self._seq not in self._pending:
+                return self._seq
+        raise RuntimeError("no free ICMP sequence number")
+
+    def _on_readable(self) -> None:
+        while True:
+            try:
+                data, (addr, _) = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            received = time.perf_counter()
+            if self.raw:
+                data = data[(data[0] & 0x0F) * 4:]      # strip the IP header
+            if len(data) < 8 or data[0] != ICMP_ECHO_REPLY:
+                continue
+            _, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+            if self.raw and ident != self.ident:
+                continue        # someone else's ping
+            pending = self._pending.get(seq)
+            if pending and pending[0] == addr and not pending[1].done():
+                pending[1].set_result(received)
+
+
+# ── Prober ─────────────────────────────────────────────────────────────────
+
+class NetProber:
+    """Concurrent ICMP / TCP prober with per-target sliding-window stats."""
+
+    def __init__(self, mode: str = PROBE_MODE, count: int = PROBE_COUNT,
+                 spacing: float = PROBE_SPACING, timeout: float = PROBE_TIMEOUT,
+                 window: float = PROBE_WINDOW, on_sample=None):
+        self.mode     = mode
+        self.count    = count
+        self.spacing  = spacing
+        self.timeout  = timeout
+        self.window   = window
+        self.on_sample = on_sample
+        self.windows  = {}       # target -> ProbeWindow (touched only on the prober loop)
+        self._dns     = {}       # host -> (addr, expires)
+        self._icmp    = None
+        self._loop    = None
+        self._thread  = None
+        self._start_lock = threading.Lock()
+
+    # ── Public ──────────────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever,
+                                            name="net-prober", daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._open_icmp(), self._loop).result()
+
+    def probe(self, targets) -> dict:
+        """Blocking: one cycle over `targets`, returns {target: summary}."""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self.cycle(list(targets)), self._loop)
+        return future.result()
+
+    async def cycle(self, targets: list) -> dict:
+        """One cycle, every target concurrently. Must run on the prober loop."""
+        results = await asyncio.gather(*(self._probe_target(t) for t in targets))
+        return dict(zip(targets, results))
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        if self._icmp is not None:
+            self._loop.call_soon_threadsafe(self._icmp.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2)
+        self._loop = None
+
+    # ── Probing ─────────────────────────────────────────────────────────────
+
+    async def _open_icmp(self) -> None:
+        if self.mode == "tcp":
+            return
+        sock, raw = _open_icmp_socket()
+        if sock is None:
+            print(f"[net_prober] no ICMP socket (not root, outside ping_group_range); "
+                  f"probing with TCP connect to :{TCP_PORT}")
+            return
+        self._icmp = IcmpPinger(asyncio.get_running_loop(), sock, raw)
+        print(f"[net_prober] ICMP via {'raw' if raw else 'datagram'} socket")
+
+    def _kind(self, target: str) -> tuple:
+        """target -> (kind, host, port)"""
+        if target.startswith("tcp://"):
+            host, _, port = target[len("tcp://"):].rpartition(":")
+            return "tcp", host, int(port)
+        if self.mode == "tcp" or self._icmp is None:
+            return "tcp", target, TCP_PORT
+        return "icmp", target, 0
+
+    async def _resolve(self, host: str) -> str | None:
+        cached = self._dns.get(host)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+        except (socket.gaierror, OSError) as e:
+            print(f"[net_prober] cannot resolve {host}: {e}")
+            return cached[0] if cached else None     # stale beats nothing
+        addr = infos[0][4][0]
+        self._dns[host] = (addr, time.monotonic() + RESOLVE_TTL)
+        return addr
+
+    async def _probe_target(self, target: str) -> dict:
+        kind, host, port = self._kind(target)
+        window = self.windows.setdefault(target, ProbeWindow(self.window))
+        addr = await self._resolve(host)
+
+        async def sample(i):
+            await asyncio.sleep(i * self.spacing)
+            if addr is None:
+                rtt = None
+            elif kind == "icmp":
+                rtt = await self._icmp.ping(addr, self.timeout)
+            else:
+                rtt = await _tcp_ping(addr, port, self.timeout)
+            self._record(target, window, rtt)
+            return rtt
+
+        rtts = await asyncio.gather(*(sample(i) for i in range(self.count)))
+        received = [r for r in rtts if r is not None]
+        return {**window.summary(),
+                "cycle_latency": round(statistics.fmean(received), 2) if received else 0.0,
+                "kind": kind}
+
+    def _record(self, target: str, window: ProbeWindow, rtt: float | None) -> None:
+        ts = time.time()
+        window.add(ts, rtt)
+        if self.on_sample:
+            try:
+                self.on_sample(target, ts, rtt)
+            except Exception as e:
+                print(f"[net_prober] on_sample({target}) error: {e}")
+
+
+async def _tcp_ping(addr: str, port: int, timeout: float) -> float | None:
+    """Handshake time in ms; a refused connection still proves the host answered."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    t0 = time.perf_counter()
+    try:
+        await asyncio.wait_for(asyncio.get_running_loop().sock_connect(sock, (addr, port)), timeout)
+    except ConnectionRefusedError:
+        pass
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        sock.close()
+    return (time.perf_counter() - t0) * 1000
+
+
+# ── CLI ────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe targets concurrently and print latency / jitter / loss.")
+    parser.add_argument("targets", nargs="+", help='host or "tcp://host:port"')
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--mode", default=PROBE_MODE, choices=("auto", "icmp", "tcp"))
+    args = parser.parse_args()
+
+    prober = NetProber(mode=args.mode)
+    for n in range(args.cycles):
+        t0 = time.perf_counter()
+        results = prober.probe(args.targets)
+        print(f"cycle {n + 1}: {len(results)} targets in {time.perf_counter() - t0:.2f} s")
+        for target, r in results.items():
+            print(f"  {target:<28} {r['kind']:<4} latency {r['latency']:7.2f} ms   "
+                  f"jitter {r['jitter']:6.2f} ms   loss {r['packet_loss']:5.1f}%   "
+                  f"({r['received']}/{r['sent']})")
+    prober.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+pipeline.py
+===========
+Reading pipeline shared by the dashboard and tuya_plug.py.
+
+    source ──► transforms ──► on_state (UI state, under the caller's lock)
+                          └─► sinks.dispatch (DB, cloud, metrics … each on
+                              its own worker, see sinks.py)
+
+Source     TuyaPoller: one concurrent get_status_many() snapshot per cycle
+           (served from push listeners where they are fresh).
+           AdaptivePoller: same, but only the devices whose own adaptive
+           interval is due, within a global request budget. Run the
+           pipeline with a short tick (SCHEDULER_TICK) when using it.
+Transforms callables reading -> reading | None, run in order; returning
+           None rejects the reading (counted per transform in `stats`).
+           Defaults: validate, EnergyIntegrator.
+
+A reading is a plain dict:
+
+    {"device_key": "plug", "device_id": "...", "status": {...},
+     "ts": 1718000000.0, "polled_at": datetime, "wh_delta": 0.0123,
+     "wh_method": "counter", "wh_segments": [(start, end, wh), ...]}
+
+Unit scaling (raw DPS ints → W / V / mA / kWh) stays in
+tuya_local._parse_status, since the push listeners need it too; readings
+enter the pipeline already in engineering units.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import sinks
+import tuya_local
+
+MAX_WATTS   = float(os.getenv("PIPELINE_MAX_WATTS", 4000))   # above plug rating → bad frame
+MAX_VOLTAGE = float(os.getenv("PIPELINE_MAX_VOLTAGE", 300))
+# Adaptive scheduling (AdaptivePoller)
+SCHEDULER_TICK     = 0.5                                        # seconds between due checks
+POLL_MIN_INTERVAL  = float(os.getenv("POLL_MIN_INTERVAL", 2))   # load changing / UI watching
+POLL_MAX_INTERVAL  = float(os.getenv("POLL_MAX_INTERVAL", 60))  # flat load / relay off
+POLL_MAX_BACKOFF   = float(os.getenv("POLL_MAX_BACKOFF", 300))  # unreachable
+POLL_BUDGET        = float(os.getenv("POLL_BUDGET", 4))         # network polls / second, all plugs
+POLL_WATCH_TTL     = 15.0                                       # seconds a watch() lasts
+POLL_CHANGE_W      = 5.0                                        # watts (or 10%) counts as a change
+# Without the counter, watts are only interpolated across gaps up to this long
+ENERGY_MAX_GAP = float(os.getenv("ENERGY_MAX_GAP", 900))   # seconds
+
+
+# ── Source ─────────────────────────────────────────────────────────────────
+
+class TuyaPoller:
+    """
+    Concurrent snapshot of the given plugs: {device_key: status | None}.
+    Without device_keys it follows the registry (tuya_local.DEVICES).
+    """
+
+    def __init__(self, device_keys=None):
+        self.device_keys = tuple(device_keys) if device_keys else None
+
+    def poll(self) -> dict:
+        return tuya_local.get_status_many(self.device_keys)
+
+
+class AdaptivePoller:
+    """
+    Per-device poll intervals instead of one fixed rate:
+
+      load changing, or a UI client watching  → POLL_MIN_INTERVAL
+      flat load                               → grows ×1.5 per poll from
+                                                `base` to POLL_MAX_INTERVAL
+      relay off                               → POLL_MAX_INTERVAL
+      unreachable                             → base × 2^failures, capped
+                                                at POLL_MAX_BACKOFF
+
+    A device's registry "poll" policy (base / min / max) overrides `base`,
+    POLL_MIN_INTERVAL and POLL_MAX_INTERVAL for that device.
+
+    A token bucket caps network polls at `budget` per second across all
+    devices; due devices beyond it wait for the next tick, most overdue
+    first. Devices served from a fresh push listener cost no tokens.
+
+    Without device_keys the poller follows the registry: devices added to
+    it are due at once, removed ones are dropped from the schedule.
+    """
+
+    def __init__(self, device_keys=None, base: float = 10.0, budget: float = POLL_BUDGET):
+        self.device_keys = tuple(device_keys) if device_keys else None
+        self.base        = base
+        self.budget      = budget
+        self._lock       = threading.Lock()
+        self._watch      = {}      # device_key -> monotonic expiry
+        self._tokens     = max(1.0, budget)
+        self._refill_at  = time.monotonic()
+        self.sched       = {}
+        self.stats = {"polls": 0, "deferred": 0}
+        self._sync()
+
+    def watch(self, device_key: str, ttl: float = POLL_WATCH_TTL) -> None:
+        """A UI is showing this device — poll it fast for the next `ttl` s."""
+        now = time.monotonic()
+        with self._lock:
+            self._watch[device_key] = now + ttl
+            st = self.sched.get(device_key)
+            if st and st["failures"] == 0:
+                st["due"] = min(st["due"], now + self._policy(device_key)[1])
+
+    def intervals(self) -> dict:
+        with self._lock:
+            return {k: st["interval"] for k, st in self.sched.items()}
+
+    def poll(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._tokens = min(max(1.0, self.budget),
+                               self._tokens + (now - self._refill_at) * self.budget)
+            self._refill_at = now
+            self._sync()
+            chosen = []
+            for k in sorted(self.sched, key=lambda k: self.sched[k]["due"]):
+                if self.sched[k]["due"] > now:
+                    break
+                if not tuya_local.listener_fresh(k):
+                    if self._tokens < 1:
+                        self.stats["deferred"] += 1
+                        continue
+                    self._tokens -= 1
+                chosen.append(k)
+
+        results = tuya_local.get_status_many(chosen) if chosen else {}
+        done = time.monotonic()
+        with self._lock:
+            for k, status in results.items():
+                if k in self.sched:
+                    self._reschedule(k, status, done)
+            self.stats["polls"] += len(results)
+        return results
+
+    def _policy(self, k: str) -> tuple:
+        """(base, min, max) poll interval for one device."""
+        poll = tuya_local.DEVICES.get(k, {}).get("poll") or {}
+        return (poll.get("base", self.base),
+                poll.get("min", POLL_MIN_INTERVAL),
+                poll.get("max", POLL_MAX_INTERVAL))
+
+    def _sync(self) -> None:
+        # Caller holds the lock (or is __init__). Match sched to the device set.
+        keys = self.device_keys if self.device_keys is not None else tuple(tuya_local.DEVICES)
+        for k in keys:
+            if k not in self.sched:
+                self.sched[k] = {"interval": self._policy(k)[0], "due": 0.0,
+                                 "watts": None, "failures": 0}
+        if len(self.sched) != len(keys):
+            for k in set(self.sched) - set(keys):
+                del self.sched[k]
+                self._watch.pop(k, None)
+
+    def _reschedule(self, k: str, status, now: float) -> None:
+        st = self.sched[k]
+        base, fast, slow = self._policy(k)
+        if status is None:
+            st["failures"] += 1
+            st["interval"] = min(POLL_MAX_BACKOFF, base * 2 ** st["failures"])
+        else:
+            st["failures"] = 0
+            prev, w = st["watts"], status["watts"]
+            st["watts"] = w
+            changing = prev is not None and abs(w - prev) > max(POLL_CHANGE_W, 0.1 * prev)
+            if changing or self._watch.get(k, 0) > now:
+                st["interval"] = fast
+            elif not status["switch"]:
+                st["interval"] = slow
+            else:
+                st["interval"] = min(slow, max(base, st["interval"] * 1.5))
+        st["due"] = now + st["interval"]
+
+
+# ── Transforms ─────────────────────────────────────────────────────────────
+
+def validate(r: dict):
+    """Drop physically impossible frames (garbled DPS, firmware glitches)."""
+    s = r["status"]
+    if not 0 <= s["watts"] <= MAX_WATTS:
+        return None
+    if not 0 <= s["voltage"] <= MAX_VOLTAGE:
+        return None
+    if s["current_ma"] < 0:
+        return None
+    return r
+
+
+class EnergyIntegrator:
+    """
+    Energy since the previous accepted reading of the same device.
+
+    Every interval is first estimated by trapezoidal integration of the two
+    watt samples (0 Wh across a gap longer than ENERGY_MAX_GAP — the plug
+    was offline, there is nothing to interpolate). The plug's own add_ele
+    counter (DPS 17, 1 Wh resolution) then keeps the books exact: whenever
+    it advances, the interval is given whatever brings the energy booked
+    since the last counter step up to the metered amount — which also
+    recovers the energy of any missed polls or gaps. A counter that has not
+    moved (sub-Wh interval, or a stale value from a push listener) just
+    leaves the trapezoid estimate in place, so nothing is counted twice.
+
+    The counter is ignored, and re-based, when it goes backwards (reset /
+    wrap / power cycle) or jumps by more than MAX_WATTS could deliver.
+
+    Sets r["wh_delta"] and r["wh_method"] ("counter" | "trapezoid" |
+    "reset" | "glitch" | "gap" | "first"). When the interval crosses an
+    hour boundary, r["wh_segments"] splits the energy per hour in
+    proportion to time, so rollups book it to the right hour and day.
+    """
+
+    def __init__(self, max_gap: float = ENERGY_MAX_GAP):
+        self.max_gap = max_gap
+        self.state   = {}     # device_key -> {ts, watts, base, base_ts, booked}
+        self.methods = {}     # method -> count
+
+    def __call__(self, r: dict):
+        s       = r["status"]
+        ts      = r["ts"]
+        watts   = s["watts"]
+        add_ele = tuya_local.dps_id(r["device_key"], "add_ele")
+        counter = s["add_ele_kwh"] if add_ele and add_ele in s.get("raw_dps", {}) else None
+
+        st = self.state.get(r["device_key"])
+        if st is None or ts <= st["ts"]:
+            self.state[r["device_key"]] = {
+                "ts": ts, "watts": watts, "base": counter, "base_ts": ts, "booked": 0.0}
+            return self._set(r, 0.0, "first")
+
+        prev_ts = st["ts"]
+        if ts - prev_ts <= self.max_gap:
+            wh, method = (st["watts"] + watts) / 2 * (ts - prev_ts) / 3600, "trapezoid"
+        else:
+            wh, method = 0.0, "gap"
+
+        base = st["base"]
+        if counter is None or base is None or counter < base:
+            if counter is not None and base is not None:
+                method = "reset"
+            st.update(base=counter, base_ts=ts, booked=0.0)
+        elif counter > base:
+            metered = (counter - base) * 1000
+            if metered > MAX_WATTS * (ts - st["base_ts"]) / 3600 + 1:   # +1 Wh: resolution
+                method = "glitch"
+                st.update(base=counter, base_ts=ts, booked=0.0)
+            else:
+                # Book exactly what the meter says since the last step; an
+                # earlier overestimate carries forward against the next one
+                excess = st["booked"] - metered
+                wh, method = max(0.0, -excess), "counter"
+                st.update(base=counter, base_ts=ts, booked=max(0.0, excess))
+        else:
+            st["booked"] += wh
+
+        st["ts"], st["watts"] = ts, watts
+        return self._set(r, wh, method, prev_ts)
+
+    def _set(self, r: dict, wh: float, method: str, prev_ts: float = None) -> dict:
+        r["wh_delta"]    = wh
+        r["wh_method"]   = method
+        r["wh_segments"] = _split_by_hour(prev_ts, r["ts"], wh) if prev_ts and wh else []
+        self.methods[method] = self.methods.get(method, 0) + 1
+        return r
+
+
+def _split_by_hour(start_ts: float, end_ts: float, wh: float) -> list:
+    """[(start, end, wh)] for each clock hour touched by (start_ts, end_ts]."""
+    start, end = datetime.fromtimestamp(start_ts), datetime.fromtimestamp(end_ts)
+    total = end_ts - start_ts
+    segments, cursor = [], start
+    while True:
+        boundary = cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        seg_end = min(boundary, end)
+        segments.append((cursor, seg_end, wh * (seg_end - cursor).total_seconds() / total))
+        if seg_end >= end:
+            return segments
+        cursor = seg_end
+
+
+# ── Pipeline ───────────────────────────────────────────────────────────────
+
+class Pipeline:
+    """
+    Runs source → transforms → on_state + sinks once per interval.
+
+    on_state(device_key, reading | None) is called for every device each
+    cycle (None when the poll failed or the reading was rejected) and is
+    where the entry point updates its in-memory UI state. Everything slow
+    belongs in a sink.
+    """
+
+    def __init__(self, source, transforms=None, on_state=None):
+        self.source     = source
+        self.transforms = list(transforms) if transforms is not None else [validate, EnergyIntegrator()]
+        self.on_state   = on_state
+        self.stats = {
+            "cycles":       0,
+            "readings":     0,
+            "missed":       0,     # device returned nothing this cycle
+            "rejected":     {},    # transform name -> count
+            "last_cycle_s": 0.0,
+        }
+
+    def run_once(self) -> None:
+        for dev_key, status in self.source.poll().items():
+            r = self._process(dev_key, status)
+            if self.on_state:
+                try:
+                    self.on_state(dev_key, r)
+                except Exception as e:
+                    print(f"[pipeline] on_state({dev_key}) error: {e}")
+            if r is not None:
+                sinks.dispatch(r)
+                self.stats["readings"] += 1
+        self.stats["cycles"] += 1
+
+    def run(self, interval: float) -> None:
+        """Background thread target: one cycle every `interval` seconds."""
+        while True:
+            t0 = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[pipeline] cycle error: {e}")
+            elapsed = time.monotonic() - t0
+            self.stats["last_cycle_s"] = round(elapsed, 3)
+            time.sleep(max(0.0, interval - elapsed))
+
+    def _process(self, dev_key: str, status):
+        cfg = tuya_local.DEVICES.get(dev_key)
+        if not status or cfg is None:      # failed, or removed from the registry mid-cycle
+            self.stats["missed"] += 1
+            return None
+        r = {
+            "device_key": dev_key,
+            "device_id":  cfg["id"],
+            "status":     status,
+            "ts":         time.time(),
+            "polled_at":  datetime.now(),
+            "wh_delta":   0.0,
+        }
+        for t in self.transforms:
+            try:
+                r = t(r)
+            except Exception as e:
+                print(f"[pipeline] {_name(t)}({dev_key}) error: {e}")
+                r = None
+            if r is None:
+                rejected = self.stats["rejected"]
+                rejected[_name(t)] = rejected.get(_name(t), 0) + 1
+                return None
+        return r
+
+
+def _name(t) -> str:
+    return getattr(t, "__name__", type(t).__name__)
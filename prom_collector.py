@@ -0,0 +1,211 @@
+"""
+prom_collector.py
+=================
+Instant-query collector for the dashboard's Prometheus gauges.
+
+QUERIES maps a result key to a PromQL expression. collect() sends them all
+as ONE combined query — each expression wrapped in
+
+    label_replace(<expr>, "dashboard_query", "<key>", "", "")
+
+and joined with `or` — over a keep-alive requests.Session, then splits the
+result back per key by that label. A refresh is a single HTTP round trip
+instead of one per gauge.
+
+The combined query carries a server-side evaluation timeout (PROM_TIMEOUT)
+and a matching client timeout. If it fails or times out, collect() falls
+back to sending each expression as its own concurrent request with its own
+timeout: whatever answers is used, keys that did not are left out of the
+result so the caller keeps their previous values.
+
+Results have the same shape as PrometheusConnect.custom_query():
+
+    {"cpu_percent": [{"metric": {...}, "value": [ts, "12.5"]}], ...}
+
+`stats()` reports refresh latency per mode (batched / concurrent).
+
+    python prom_collector.py --bench 20     # sequential vs batched vs concurrent
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROM_URL     = os.getenv("PROM_URL", "http://localhost:9090")
+PROM_TIMEOUT = float(os.getenv("PROM_TIMEOUT", 2.0))   # seconds, per query
+PROM_WORKERS = int(os.getenv("PROM_WORKERS", 8))       # concurrent fallback requests
+TAG_LABEL    = "dashboard_query"
+
+# Server Monitor gauges
+QUERIES = {
+    "cpu_percent":    '100 - (avg(rate(node_cpu_seconds_total{mode="idle"}[1m])) * 100)',
+    "mem_used":       'node_memory_MemTotal_bytes - node_memory_MemAvailable_bytes',
+    "mem_total":      'node_memory_MemTotal_bytes',
+    "nvme_used":      'node_filesystem_size_bytes{mountpoint="/mnt/nvme"} - node_filesystem_avail_bytes{mountpoint="/mnt/nvme"}',
+    "nvme_total":     'node_filesystem_size_bytes{mountpoint="/mnt/nvme"}',
+    "hdd_used":       'node_filesystem_size_bytes{mountpoint="/mnt/hdd-public"} - node_filesystem_avail_bytes{mountpoint="/mnt/hdd-public"}',
+    "hdd_total":      'node_filesystem_size_bytes{mountpoint="/mnt/hdd-public"}',
+    "esp32_temp":     'esp32_temperature_celsius',
+    "esp32_humidity": 'esp32_humidity_percent',
+}
+
+
+def combine(queries: dict) -> str:
+    """{key: expr} -> one expression whose series carry TAG_LABEL=key."""
+    return " or ".join(
+        f'label_replace({expr}, "{TAG_LABEL}", "{key}", "", "")'
+        for key, expr in queries.items())
+
+
+def split(result: list, keys) -> dict:
+    """Undo combine(): {key: [series without TAG_LABEL]} for every key."""
+    out = {key: [] for key in keys}
+    for series in result:
+        key = series["metric"].pop(TAG_LABEL, None)
+        if key in out:
+            out[key].append(series)
+    return out
+
+
+class PromError(Exception):
+    """Prometheus answered with an error, or not at all."""
+
+
+class PromCollector:
+    """Fetches a fixed set of instant queries in as few round trips as possible."""
+
+    def __init__(self, url: str = PROM_URL, queries: dict = None,
+                 timeout: float = PROM_TIMEOUT, workers: int = PROM_WORKERS):
+        self.url      = url.rstrip("/")
+        self.queries  = dict(queries or QUERIES)
+        self.timeout  = timeout
+        self._session = requests.Session()      # keep-alive across refreshes
+        self._pool    = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prom")
+        self._lock    = threading.Lock()
+        self._latency = {"batched": deque(maxlen=100), "concurrent": deque(maxlen=100)}
+        self.fallbacks = 0
+        self.missing   = 0      # keys dropped by a timed-out / failed query
+        self.last_error = None
+
+    # ── Public ──────────────────────────────────────────────────────────────
+
+    def collect(self) -> dict:
+        """All queries: batched, or per-query concurrent if the batch fails."""
+        t0 = time.perf_counter()
+        try:
+            result = self.collect_batched()
+            mode = "batched"
+        except PromError as e:
+            self.last_error = str(e)
+            self.fallbacks += 1
+            print(f"[prom] combined query failed ({e}), falling back to per-query")
+            result = self.collect_concurrent()
+            mode = "concurrent"
+        with self._lock:
+            self._latency[mode].append((time.perf_counter() - t0) * 1000)
+        return result
+
+    def collect_batched(self) -> dict:
+        """One HTTP request for every query. Raises PromError."""
+        return split(self.query(combine(self.queries)), self.queries)
+
+    def collect_concurrent(self, keys=None) -> dict:
+        """One request per query in parallel; keys that fail or time out are omitted."""
+        keys = list(keys or self.queries)
+        futures = {self._pool.submit(self.query, self.queries[k]): k for k in keys}
+        done, _ = wait(futures, timeout=self.timeout + 1)
+        result = {}
+        for fut, key in futures.items():
+            if fut in done and fut.exception() is None:
+                result[key] = fut.result()
+            else:
+                self.missing += 1
+                if fut in done:
+                    self.last_error = f"{key}: {fut.exception()}"
+        return result
+
+    def collect_sequential(self) -> dict:
+        """One request after another — the old behaviour, kept for --bench."""
+        return {key: self.query(expr) for key, expr in self.queries.items()}
+
+    def query(self, expr: str, timeout: float = None) -> list:
+        """Instant query; returns the result vector. Raises PromError."""
+        timeout = timeout or self.timeout
+        return self._get("/api/v1/query", {"query": expr}, timeout)["result"]
+
+    def query_range(self, expr: str, start: float, end: float, step: float,
+                    timeout: float = None) -> list:
+        """Range query over [start, end] (unix s); returns the result matrix. Raises PromError."""
+        timeout = timeout or self.timeout
+        return self._get("/api/v1/query_range",
+                         {"query": expr, "start": f"{start:.3f}", "end": f"{end:.3f}",
+                          "step": f"{step:g}s"}, timeout)["result"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = {}
+            for mode, samples in self._latency.items():
+                s = sorted(samples)
+                out[mode] = {
+                    "count":   len(s),
+                    "last_ms": round(samples[-1], 1) if s else 0.0,
+                    "mean_ms": round(statistics.fmean(s), 1) if s else 0.0,
+                    "p95_ms":  round(s[int(0.95 * (len(s) - 1))], 1) if s else 0.0,
+                }
+        out.update(fallbacks=self.fallbacks, missing=self.missing, last_error=self.last_error)
+        return out
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+
+    # ── HTTP ────────────────────────────────────────────────────────────────
+
+    def _get(self, path: str, params: dict, timeout: float) -> dict:
+        # Prometheus aborts evaluation after `timeout`; the client waits a bit longer
+        params = {**params, "timeout": f"{timeout:g}s"}
+        try:
+            resp = self._session.get(self.url + path, params=params, timeout=timeout + 0.5)
+            body = resp.json()
+        except (requests.RequestException, ValueError) as e:
+            raise PromError(str(e)) from None
+        if body.get("status") != "success":
+            raise PromError(body.get("error") or f"HTTP {resp.status_code}")
+        return body["data"]
+
+
+# ── Benchmark ──────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a full Server Monitor refresh three ways.")
+    parser.add_argument("--bench", type=int, default=20, help="refreshes per mode")
+    parser.add_argument("--url", default=PROM_URL)
+    args = parser.parse_args()
+
+    c = PromCollector(args.url)
+    for mode, fn in (("sequential", c.collect_sequential),
+                     ("batched",    c.collect_batched),
+                     ("concurrent", c.collect_concurrent)):
+        fn()    # warm the keep-alive connection
+        times = []
+        for _ in range(args.bench):
+            t0 = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - t0) * 1000)
+        times.sort()
+        print(f"{mode:<11} n={len(times):<3} mean {statistics.fmean(times):7.1f} ms   "
+              f"p50 {times[len(times) // 2]:7.1f} ms   p95 {times[int(0.95 * (len(times) - 1))]:7.1f} ms")
+    c.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+prom_history.py
+===============
+History for the Server Monitor charts from Prometheus query_range.
+
+Every zoom level has a fixed span and step (ZOOMS). One call to
+history(zoom) returns all HISTORY_QUERIES series for that window, fetched
+with a single combined query_range (see prom_collector.combine).
+
+Fetched points are cached in memory in blocks keyed by (query, step,
+aligned window): a window is BLOCK_POINTS steps starting at a multiple of
+its own length, so the same block is reused by every later request at that
+zoom. Past blocks are complete and never fetched again; the open block at
+the right edge remembers how far it has been fetched, so a refresh asks
+Prometheus only for the new tail (plus the last TAIL_REFETCH points, which
+may still be changing while scrapes land). Least recently used blocks are
+evicted past MAX_BLOCKS.
+
+    {"zoom": "6h", "step": 60, "start": ..., "end": ...,
+     "series": {"cpu": {"": [[ts_ms, 12.5], ...]},
+                "esp32_temp": {"esp32-1": [[ts_ms, 28.1], ...]}, ...}}
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import prom_collector
+
+# zoom -> (span seconds, step seconds)
+ZOOMS = {
+    "1h":  (3600,       15),
+    "6h":  (6 * 3600,   60),
+    "24h": (24 * 3600,  300),
+    "7d":  (7 * 86400,  1800),
+}
+BLOCK_POINTS = 240      # steps per cached block
+TAIL_REFETCH = 2        # newest points re-read on every refresh
+MAX_BLOCKS   = 256
+
+# `$rate` becomes a rate() window wide enough for the step
+HISTORY_QUERIES = {
+    "cpu":            '100 - (avg(rate(node_cpu_seconds_total{mode="idle"}[$rate])) * 100)',
+    "memory":         '100 * (1 - node_memory_MemAvailable_bytes / node_memory_MemTotal_bytes)',
+    "disk":           '100 * (1 - node_filesystem_avail_bytes{mountpoint=~"/mnt/nvme|/mnt/hdd-public"}'
+                      ' / node_filesystem_size_bytes{mountpoint=~"/mnt/nvme|/mnt/hdd-public"})',
+    "esp32_temp":     'esp32_temperature_celsius',
+    "esp32_humidity": 'esp32_humidity_percent',
+}
+# Label naming each series within a query, first one present wins
+SERIES_LABELS = ("device_id", "mountpoint")
+
+
+class PromHistory:
+    """Range-query cache in front of one PromCollector."""
+
+    def __init__(self, collector: prom_collector.PromCollector,
+                 queries: dict = None, max_blocks: int = MAX_BLOCKS):
+        self.collector  = collector
+        self.queries    = dict(queries or HISTORY_QUERIES)
+        self.max_blocks = max_blocks
+        self._lock      = threading.Lock()
+        # (query key, step, block start) -> {series name: {ts: value}}
+        self._blocks    = OrderedDict()
+        # (step, block start) -> last timestamp fetched for every query in the block
+        self._fetched   = {}
+        self.stats = {"requests": 0, "points_fetched": 0, "cache_hits": 0, "errors": 0}
+
+    def history(self, zoom: str) -> dict:
+        """All series for the zoom's window ending now. Raises KeyError for an unknown zoom."""
+        span, step = ZOOMS[zoom]
+        end   = math.floor(time.time() / step) * step
+        start = end - span
+        block = step * BLOCK_POINTS
+
+        with self._lock:
+            first_block = math.floor(start / block) * block
+            blocks = list(range(first_block, end + 1, block))
+
+            # Everything not yet fetched is one contiguous range up to `end`
+            fetch_from = None
+            for b in blocks:
+                done = self._fetched.get((step, b))
+                if done is None or done < min(b + block - step, end):
+                    fetch_from = b if done is None else done + step
+                    break
+                self.stats["cache_hits"] += 1
+            if fetch_from is not None:
+                try:
+                    self._fetch(fetch_from, end, step, block)
+                except prom_collector.PromError as e:
+                    # Serve what is cached; the next refresh retries the gap
+                    self.stats["errors"] += 1
+                    print(f"[prom_history] {zoom}: {e}")
+
+            series = {key: {} for key in self.queries}
+            for key in self.queries:
+                for b in blocks:
+                    cached = self._blocks.get((key, step, b))
+                    if cached is None:
+                        continue
+                    self._blocks.move_to_end((key, step, b))
+                    for name, points in cached.items():
+                        series[key].setdefault(name, []).extend(
+                            [ts * 1000, v] for ts, v in sorted(points.items())
+                            if start <= ts <= end)
+        return {"zoom": zoom, "step": step, "start": start, "end": end, "series": series}
+
+    def _fetch(self, start: float, end: float, step: int, block: int) -> None:
+        # Caller holds the lock
+        rate = f"{max(60, 4 * step)}s"
+        queries = {k: q.replace("$rate", rate) for k, q in self.queries.items()}
+        result = prom_collector.split(
+            self.collector.query_range(prom_collector.combine(queries), start, end, step),
+            queries)
+        self.stats["requests"] += 1
+
+        for key, matrix in result.items():
+            for s in matrix:
+                name = next((s["metric"][l] for l in SERIES_LABELS if l in s["metric"]), "")
+                for ts, value in s["values"]:
+                    ts = int(float(ts))
+                    b = ts - ts % block
+                    value = float(value)
+                    if not math.isfinite(value):
+                        continue        # NaN / Inf, e.g. a division by a missing series
+                    self._blocks.setdefault((key, step, b), {}).setdefault(name, {})[ts] = round(value, 2)
+                    self.stats["points_fetched"] += 1
+
+        # Mark what is final; the newest TAIL_REFETCH points stay open
+        settled = end - TAIL_REFETCH * step
+        for b in range(start - start % block, end + 1, block):
+            last = min(b + block - step, settled)
+            if last >= b:
+                self._fetched[(step, b)] = max(self._fetched.get((step, b), last), last)
+        while len(self._blocks) > self.max_blocks:
+            (key, s, b), _ = self._blocks.popitem(last=False)
+            self._fetched.pop((s, b), None)
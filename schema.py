@@ -0,0 +1,235 @@
+"""
+schema.py
+=========
+Table definitions and migrations for the homelab energy database.
+
+db.py assumes these tables exist; `migrate()` creates any that are missing
+and applies pending migrations (indexes, new columns). Every statement is
+idempotent and applied migrations are recorded in `schema_migrations`, so
+it is safe to run on every start-up.
+
+    python schema.py            # apply pending migrations
+    python schema.py --status   # list applied / pending migrations
+"""
+
+import argparse
+import os
+from datetime import date, timedelta
+
+import db
+
+# Days of plug_energy history folded into plug_hourly_summary by migration 004
+HOURLY_BACKFILL_DAYS = int(os.getenv("DB_HOURLY_BACKFILL_DAYS", 7))
+
+# ── Tables ─────────────────────────────────────────────────────────────────
+# Fresh installs get the final shape straight away; MIGRATIONS below bring
+# older deployments (which created these tables by hand) up to the same.
+
+TABLES = {
+    "plug_energy": """
+        CREATE TABLE IF NOT EXISTS plug_energy (
+            id           BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            device_id    VARCHAR(64)  NOT NULL,
+            device_name  VARCHAR(64)  NOT NULL,
+            watts        DOUBLE       NOT NULL DEFAULT 0,
+            wh_delta     DOUBLE       NOT NULL DEFAULT 0,
+            voltage      DOUBLE       NOT NULL DEFAULT 0,
+            current_ma   INT          NOT NULL DEFAULT 0,
+            polled_at    DATETIME     NOT NULL,
+            PRIMARY KEY (id),
+            KEY idx_energy_device_polled (device_id, polled_at)
+        ) ENGINE=InnoDB
+    """,
+    "plug_state": """
+        CREATE TABLE IF NOT EXISTS plug_state (
+            id           BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            device_id    VARCHAR(64)  NOT NULL,
+            device_name  VARCHAR(64)  NOT NULL,
+            state        TINYINT(1)   NOT NULL,
+            source       VARCHAR(32)  NOT NULL DEFAULT 'dashboard',
+            created_at   DATETIME     NOT NULL,
+            PRIMARY KEY (id),
+            KEY idx_state_device_created (device_id, created_at)
+        ) ENGINE=InnoDB
+    """,
+    "plug_hourly_summary": """
+        CREATE TABLE IF NOT EXISTS plug_hourly_summary (
+            device_id     VARCHAR(64)  NOT NULL,
+            device_name   VARCHAR(64)  NOT NULL,
+            hour_start    DATETIME     NOT NULL,
+            total_wh      DOUBLE       NOT NULL DEFAULT 0,
+            avg_watts     DOUBLE       NOT NULL DEFAULT 0,
+            peak_watts    DOUBLE       NOT NULL DEFAULT 0,
+            min_voltage   DOUBLE       NULL,
+            max_voltage   DOUBLE       NULL,
+            reading_count INT          NOT NULL DEFAULT 0,
+            PRIMARY KEY (device_id, hour_start)
+        ) ENGINE=InnoDB
+    """,
+    # 1-minute downsample of plug_energy, written by compactor.py
+    "plug_energy_1m": """
+        CREATE TABLE IF NOT EXISTS plug_energy_1m (
+            device_id     VARCHAR(64)  NOT NULL,
+            device_name   VARCHAR(64)  NOT NULL,
+            minute_start  DATETIME     NOT NULL,
+            total_wh      DOUBLE       NOT NULL DEFAULT 0,
+            avg_watts     DOUBLE       NOT NULL DEFAULT 0,
+            max_watts     DOUBLE       NOT NULL DEFAULT 0,
+            min_voltage   DOUBLE       NULL,
+            max_voltage   DOUBLE       NULL,
+            reading_count INT          NOT NULL DEFAULT 0,
+            PRIMARY KEY (device_id, minute_start)
+        ) ENGINE=InnoDB
+    """,
+    # (device, day) pairs whose raw rows are rolled up and safe to delete
+    "plug_compaction_log": """
+        CREATE TABLE IF NOT EXISTS plug_compaction_log (
+            device_id     VARCHAR(64)  NOT NULL,
+            date          DATE         NOT NULL,
+            raw_rows      INT          NOT NULL DEFAULT 0,
+            compacted_at  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (device_id, date)
+        ) ENGINE=InnoDB
+    """,
+    "plug_daily_summary": """
+        CREATE TABLE IF NOT EXISTS plug_daily_summary (
+            device_id     VARCHAR(64)  NOT NULL,
+            device_name   VARCHAR(64)  NOT NULL,
+            date          DATE         NOT NULL,
+            total_wh      DOUBLE       NOT NULL DEFAULT 0,
+            total_kwh     DOUBLE AS (total_wh / 1000.0) STORED,
+            cost_rm       DOUBLE       NOT NULL DEFAULT 0,
+            avg_watts     DOUBLE       NOT NULL DEFAULT 0,
+            peak_watts    DOUBLE       NOT NULL DEFAULT 0,
+            reading_count INT          NOT NULL DEFAULT 0,
+            PRIMARY KEY (device_id, date)
+        ) ENGINE=InnoDB
+    """,
+    "plug_monthly_summary": """
+        CREATE TABLE IF NOT EXISTS plug_monthly_summary (
+            device_id     VARCHAR(64)  NOT NULL,
+            device_name   VARCHAR(64)  NOT NULL,
+            `year_month`  CHAR(7)      NOT NULL,
+            total_kwh     DOUBLE       NOT NULL DEFAULT 0,
+            cost_rm       DOUBLE       NOT NULL DEFAULT 0,
+            PRIMARY KEY (device_id, `year_month`)
+        ) ENGINE=InnoDB
+    """,
+}
+
+# ── Migrations ─────────────────────────────────────────────────────────────
+# Append only — never edit or reorder an entry once it has shipped.
+
+MIGRATIONS = [
+    ("001_daily_summary_reading_count", """
+        ALTER TABLE plug_daily_summary
+            ADD COLUMN IF NOT EXISTS reading_count INT NOT NULL DEFAULT 0
+    """),
+    ("002_energy_device_polled_at_index", """
+        CREATE INDEX IF NOT EXISTS idx_energy_device_polled
+            ON plug_energy (device_id, polled_at)
+    """),
+    ("003_daily_summary_device_date_index", """
+        CREATE INDEX IF NOT EXISTS idx_daily_device_date
+            ON plug_daily_summary (device_id, date)
+    """),
+    # Recent history only, so the Day chart has data as soon as the
+    # rollup ships; see _backfill_hourly()
+    ("004_backfill_hourly_summary", lambda: _backfill_hourly()),
+    ("005_hourly_summary_voltage_range", """
+        ALTER TABLE plug_hourly_summary
+            ADD COLUMN IF NOT EXISTS min_voltage DOUBLE NULL AFTER peak_watts,
+            ADD COLUMN IF NOT EXISTS max_voltage DOUBLE NULL AFTER min_voltage
+    """),
+]
+
+
+def _ensure_migrations_table(cursor) -> None:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name        VARCHAR(128) NOT NULL,
+            applied_at  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (name)
+        ) ENGINE=InnoDB
+    """)
+
+
+def applied_migrations() -> set:
+    """Return the names of migrations already recorded."""
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        _ensure_migrations_table(cursor)
+        cursor.execute("SELECT name FROM schema_migrations")
+        names = {r[0] for r in cursor.fetchall()}
+        cursor.close()
+    return names
+
+
+def _backfill_hourly(days: int = HOURLY_BACKFILL_DAYS) -> None:
+    """
+    Build plug_hourly_summary for the last `days` days, one device-day per
+    transaction so start-up never holds a full-table scan or a long lock.
+    Older hours are not needed: get_hourly_history() reads at most a day.
+    """
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT device_id FROM plug_energy")
+        device_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+
+    today = date.today()
+    for device_id in device_ids:
+        for offset in range(days):
+            db.aggregate_hourly(device_id, (today - timedelta(days=offset)).isoformat())
+
+
+def migrate(verbose: bool = False) -> list:
+    """
+    Create missing tables and apply pending migrations in order. A migration
+    is either a SQL statement or a callable that does its own data work.
+    Returns the names of migrations applied by this call.
+    """
+    with db.get_conn() as conn:
+        cursor = conn.cursor()
+        for name, ddl in TABLES.items():
+            cursor.execute(ddl)
+        cursor.close()
+
+    done = applied_migrations()
+    applied = []
+    for name, ddl in MIGRATIONS:
+        if name in done:
+            continue
+        if callable(ddl):
+            # Data migrations manage their own (bounded) transactions
+            ddl()
+        # DDL auto-commits in MariaDB, so each migration is its own step
+        with db.get_conn() as conn:
+            cursor = conn.cursor()
+            if not callable(ddl):
+                cursor.execute(ddl)
+            cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+            cursor.close()
+        applied.append(name)
+        if verbose:
+            print(f"[schema] applied {name}")
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply homelab DB schema migrations.")
+    parser.add_argument("--status", action="store_true", help="list migrations and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        done = applied_migrations()
+        for name, _ in MIGRATIONS:
+            print(f"{'✅' if name in done else '⏳'} {name}")
+        return
+
+    applied = migrate(verbose=True)
+    print(f"[schema] up to date ({len(applied)} applied)")
+
+
+if __name__ == "__main__":
+    main()
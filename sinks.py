@@ -0,0 +1,212 @@
+"""
+sinks.py
+========
+Independent workers for the side effects of a plug reading.
+
+The reading pipeline (pipeline.py) only updates in-memory state under
+the caller's lock, then hands each reading to `dispatch()`. Every
+registered sink (DB, cloud, metrics, ...) has its own bounded queue and
+worker thread, so a slow or failing sink never delays the poller, the UI
+readers of the shared state, or the other sinks.
+
+Per sink, at registration:
+  batch_size / max_wait  hand the handler a list of up to batch_size
+                         readings, waiting at most max_wait s to fill it
+                         (batch_size=1: one reading per call)
+  retries / retry_delay  retry a failing call with exponential backoff
+                         before counting it in `errors` and moving on
+  drop                   "oldest" (default) evicts the head of a full
+                         queue, "newest" rejects the incoming reading;
+                         either way it is counted in `dropped`
+
+Readings are the dicts built by pipeline.py.
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+import aws_iot_publisher
+import db
+
+SINK_MAX_QUEUE = 1000   # readings buffered per sink before dropping the oldest
+
+
+class SinkWorker:
+    """One sink: a bounded queue drained by a daemon thread calling handler()."""
+
+    def __init__(self, name: str, handler, max_queue: int = SINK_MAX_QUEUE,
+                 batch_size: int = 1, max_wait: float = 0.0,
+                 retries: int = 0, retry_delay: float = 1.0,
+                 drop: str = "oldest"):
+        if drop not in ("oldest", "newest"):
+            raise ValueError(f"drop must be 'oldest' or 'newest', not {drop!r}")
+        self.name        = name
+        self.handler     = handler
+        self.max_queue   = max_queue
+        self.batch_size  = max(1, batch_size)
+        self.max_wait    = max_wait
+        self.retries     = retries
+        self.retry_delay = retry_delay
+        self.drop        = drop
+
+        self._buf: deque = deque()
+        self._cond       = threading.Condition()
+        self._closed     = False
+        self._thread     = threading.Thread(
+            target=self._run, name=f"sink-{name}", daemon=True)
+        self._thread.start()
+
+        self.received   = 0
+        self.processed  = 0
+        self.dropped    = 0
+        self.errors     = 0
+        self.retried    = 0
+        self.last_error = None
+        self.busy_s     = 0.0   # total time spent in handler
+
+    def put(self, reading: dict) -> None:
+        """Queue a reading; never blocks."""
+        with self._cond:
+            if self._closed:
+                return
+            self.received += 1
+            if len(self._buf) >= self.max_queue:
+                self.dropped += 1
+                if self.drop == "newest":
+                    return
+                self._buf.popleft()
+            self._buf.append(reading)
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify()
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._buf)
+
+    def stats(self) -> dict:
+        return {
+            "depth":      self.depth(),
+            "received":   self.received,
+            "processed":  self.processed,
+            "dropped":    self.dropped,
+            "errors":     self.errors,
+            "retried":    self.retried,
+            "last_error": self.last_error,
+            "avg_ms":     round(self.busy_s * 1000 / self.processed, 2) if self.processed else 0.0,
+        }
+
+    def close(self, timeout: float = 5) -> None:
+        """Stop accepting readings and let the worker finish what is queued."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=timeout)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buf or self._closed)
+                if self.batch_size > 1 and not self._closed:
+                    # Give a partial batch up to max_wait to fill
+                    self._cond.wait_for(
+                        lambda: len(self._buf) >= self.batch_size or self._closed,
+                        timeout=self.max_wait)
+                if not self._buf:
+                    return
+                n = min(self.batch_size, len(self._buf))
+                items = [self._buf.popleft() for _ in range(n)]
+
+            t0 = time.perf_counter()
+            self._deliver(items)
+            self.busy_s += time.perf_counter() - t0
+            self.processed += len(items)
+
+    def _deliver(self, items: list) -> None:
+        arg = items if self.batch_size > 1 else items[0]
+        for attempt in range(self.retries + 1):
+            try:
+                self.handler(arg)
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                if attempt < self.retries and not self._closed:
+                    self.retried += 1
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                    continue
+                self.errors += 1
+                print(f"[sink:{self.name}] error ({len(items)} readings, "
+                      f"{items[0].get('device_key')}...): {e}")
+
+
+# ── Registry ───────────────────────────────────────────────────────────────
+
+_sinks: dict = {}
+_sinks_lock = threading.Lock()
+
+
+def register(name: str, handler, **options) -> SinkWorker:
+    """Add (or return the existing) sink called `name`. See SinkWorker for options."""
+    with _sinks_lock:
+        if name not in _sinks:
+            _sinks[name] = SinkWorker(name, handler, **options)
+        return _sinks[name]
+
+
+def dispatch(reading: dict) -> None:
+    """Fan one reading out to every registered sink."""
+    with _sinks_lock:
+        workers = list(_sinks.values())
+    for w in workers:
+        w.put(reading)
+
+
+def stats() -> dict:
+    with _sinks_lock:
+        return {name: w.stats() for name, w in _sinks.items()}
+
+
+def close_all() -> None:
+    with _sinks_lock:
+        workers = list(_sinks.values())
+    for w in workers:
+        w.close()
+
+
+# ── Standard sinks ─────────────────────────────────────────────────────────
+
+def db_sink(r: dict) -> None:
+    """
+    Buffered insert into plug_energy (see db.EnergyWriter).
+    When the reading's energy spans several clock hours (a gap after missed
+    polls), the earlier hours get their share as separate rows stamped just
+    before each hour boundary, at the interval's average power.
+    """
+    s = r["status"]
+    segments = r.get("wh_segments") or []
+    for seg_start, seg_end, wh in segments[:-1]:
+        seg_h = (seg_end - seg_start).total_seconds() / 3600
+        db.energy_writer.submit(
+            device_id=r["device_id"],
+            device_name=s["device_name"],
+            watts=round(wh / seg_h, 2) if seg_h else 0.0,
+            wh_delta=wh,
+            voltage=s["voltage"],
+            current_ma=s["current_ma"],
+            polled_at=seg_end - timedelta(seconds=1),
+        )
+    db.energy_writer.submit(
+        device_id=r["device_id"],
+        device_name=s["device_name"],
+        watts=s["watts"],
+        wh_delta=segments[-1][2] if segments else r["wh_delta"],
+        voltage=s["voltage"],
+        current_ma=s["current_ma"],
+        polled_at=r["polled_at"],
+    )
+
+
+def cloud_sink(r: dict) -> None:
+    """Queue the reading for AWS IoT Core."""
+    aws_iot_publisher.publish(r["device_key"], r["status"], r["wh_delta"])
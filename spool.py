@@ -0,0 +1,135 @@
+"""
+spool.py
+========
+Disk-backed FIFO for messages that could not be delivered yet.
+
+A single SQLite file (stdlib sqlite3, WAL mode) holds the payloads in
+arrival order. Producers append, a consumer reads oldest-first with
+`peek()` and deletes rows once the far end has acknowledged them, so a
+crash or restart never loses an unacknowledged message — it is simply
+replayed again (at-least-once).
+
+Disk use is capped by `max_bytes`: when an append pushes the payload total
+over the cap, the oldest rows are evicted first — down to EVICT_HEADROOM
+below the cap, so the next appends don't evict again — and counted in
+`evicted`.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+EVICT_HEADROOM = 0.10     # evict down to 90 % of max_bytes
+EVICT_BATCH    = 500      # rows read per eviction query
+
+
+class Spool:
+    """Append-only, size-capped message queue in one SQLite file."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path      = path
+        self.max_bytes = max_bytes
+        self._lock     = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL    NOT NULL,
+                size       INTEGER NOT NULL,
+                payload    BLOB    NOT NULL
+            )
+        """)
+        row = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool").fetchone()
+        self._depth, self._bytes = int(row[0]), int(row[1])
+
+        self.appended = 0
+        self.deleted  = 0
+        self.evicted  = 0
+
+    def append(self, payloads: list, created_at: float = None) -> None:
+        """Add payloads (str or bytes) at the tail, evicting from the head if over the cap."""
+        if not payloads:
+            return
+        ts = created_at or time.time()
+        rows = [(ts, len(p if isinstance(p, bytes) else p.encode()), p) for p in payloads]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO spool (created_at, size, payload) VALUES (?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+            self._depth += len(rows)
+            self._bytes += sum(r[1] for r in rows)
+            self.appended += len(rows)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def peek(self, after_id: int = 0, limit: int = 100) -> list:
+        """Oldest rows with id > after_id as [(id, payload)]."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, payload FROM spool WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit)).fetchall()
+
+    def delete(self, ids: list) -> None:
+        """Remove delivered rows. Unknown / already-evicted ids are ignored."""
+        if not ids:
+            return
+        with self._lock:
+            marks = ", ".join("?" * len(ids))
+            row = self._db.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool WHERE id IN ({marks})",
+                ids).fetchone()
+            self._db.execute(f"DELETE FROM spool WHERE id IN ({marks})", ids)
+            self._depth -= int(row[0])
+            self._bytes -= int(row[1])
+            self.deleted += int(row[0])
+
+    def depth(self) -> int:
+        return self._depth
+
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def oldest_age(self) -> float:
+        """Seconds since the oldest queued message was spooled (0 when empty)."""
+        with self._lock:
+            # Rows are appended in time order, so the head row is the oldest
+            row = self._db.execute(
+                "SELECT created_at FROM spool ORDER BY id LIMIT 1").fetchone()
+        return max(0.0, time.time() - row[0]) if row and row[0] else 0.0
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _evict(self) -> None:
+        # Caller holds the lock. Drop oldest rows until EVICT_HEADROOM below
+        # the cap, reading only the head of the table a batch at a time.
+        target = self.max_bytes * (1 - EVICT_HEADROOM)
+        over = self._bytes - target
+        count, freed, last_id = 0, 0, None
+        while freed < over:
+            rows = self._db.execute(
+                "SELECT id, size FROM spool WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id or 0, EVICT_BATCH)).fetchall()
+            if not rows:
+                break
+            for row_id, size in rows:
+                last_id = row_id
+                count += 1
+                freed += size
+                if freed >= over:
+                    break
+        if last_id is None:
+            return
+        self._db.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+        self._depth -= count
+        self._bytes -= freed
+        self.evicted += count
+        print(f"[spool] {self.path}: evicted {count} oldest messages ({freed} bytes)")
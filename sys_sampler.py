@@ -0,0 +1,182 @@
+"""
+sys_sampler.py
+==============
+In-process host sampler reading sysfs / procfs directly — no smartctl,
+iostat or ps forks, and no sleeping in the caller.
+
+  temperatures  /sys/class/hwmon/*/temp*_input (and the NVMe controller's
+                own hwmon under /sys/class/nvme), thermal_zone0 fallback
+  disk I/O      /proc/diskstats
+  processes     /proc/[pid]/stat
+
+Rates (disk throughput / utilisation, per-process CPU) come from the
+difference between the current snapshot and the one taken on the previous
+call, so calling once per dashboard refresh yields the averages over the
+refresh interval. The very first call has nothing to compare against:
+disk rates read 0 and process CPU falls back to the lifetime average, as
+`ps` reports it.
+
+    sampler = SystemSampler()
+    sampler.nvme_temp()          # °C, 0 if unavailable
+    sampler.disk_io("sda")       # {"read_kbps", "write_kbps", "iops", "util_percent"}
+    sampler.top_processes(5)     # [("python3", 12.5), ...]
+"""
+
+import glob
+import os
+import threading
+import time
+
+CLK_TCK     = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+SECTOR      = 512       # /proc/diskstats always counts 512-byte sectors
+NVME_DEVICE = os.getenv("NVME_DEVICE", "nvme0")   # controller, as in /sys/class/nvme
+HDD_DEVICE  = os.getenv("HDD_DEVICE", "sda")
+CPU_SENSORS = ("coretemp", "k10temp", "cpu_thermal", "soc_thermal", "zenpower")
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _millideg(path: str) -> float:
+    raw = _read(path)
+    try:
+        return round(int(raw) / 1000.0, 1)
+    except (TypeError, ValueError):
+        return 0
+
+
+class SystemSampler:
+    """Keeps the previous disk / process snapshots needed for rates."""
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._disk  = {}      # device -> (monotonic, fields)
+        self._procs = None    # (monotonic, {pid: (comm, ticks, start ticks)})
+
+    # ── Temperatures ──────────────────────────────────────────────────────
+
+    def cpu_temp(self) -> float:
+        for hwmon in glob.glob("/sys/class/hwmon/hwmon*"):
+            if _read(os.path.join(hwmon, "name")) in CPU_SENSORS:
+                t = _millideg(os.path.join(hwmon, "temp1_input"))
+                if t:
+                    return t
+        return _millideg("/sys/class/thermal/thermal_zone0/temp")
+
+    def nvme_temp(self, controller: str = NVME_DEVICE) -> float:
+        # Composite temperature (temp1) of the controller's own hwmon device
+        for path in (glob.glob(f"/sys/class/nvme/{controller}/hwmon*/temp1_input")
+                     + glob.glob(f"/sys/class/nvme/{controller}/device/hwmon/hwmon*/temp1_input")):
+            t = _millideg(path)
+            if t:
+                return t
+        # Older layouts only list it under /sys/class/hwmon with name "nvme"
+        for hwmon in sorted(glob.glob("/sys/class/hwmon/hwmon*")):
+            if _read(os.path.join(hwmon, "name")) == "nvme":
+                device = os.path.realpath(os.path.join(hwmon, "device"))
+                if controller in device or os.path.basename(device).startswith(controller):
+                    return _millideg(os.path.join(hwmon, "temp1_input"))
+        return 0
+
+    # ── Disk I/O ──────────────────────────────────────────────────────────
+
+    def disk_io(self, device: str = HDD_DEVICE) -> dict:
+        """Throughput and utilisation of `device` since the previous call."""
+        rates = {"read_kbps": 0.0, "write_kbps": 0.0, "iops": 0.0, "util_percent": 0.0}
+        fields = _diskstats().get(device)
+        if fields is None:
+            return rates
+        now = time.monotonic()
+        with self._lock:
+            prev = self._disk.get(device)
+            self._disk[device] = (now, fields)
+        if prev is None or now <= prev[0]:
+            return rates
+
+        dt = now - prev[0]
+        d = [cur - old for cur, old in zip(fields, prev[1])]
+        # fields: reads, reads merged, sectors read, ms reading,
+        #         writes, writes merged, sectors written, ms writing,
+        #         in flight, ms doing I/O, ...
+        rates["read_kbps"]    = round(d[2] * SECTOR / 1024 / dt, 1)
+        rates["write_kbps"]   = round(d[6] * SECTOR / 1024 / dt, 1)
+        rates["iops"]         = round((d[0] + d[4]) / dt, 1)
+        rates["util_percent"] = round(min(100.0, d[9] / (dt * 1000) * 100), 1)
+        return rates
+
+    def disk_status(self, device: str = HDD_DEVICE) -> str:
+        """'active' if the disk moved data since the previous call, else 'idle'."""
+        io = self.disk_io(device)
+        return "active" if io["read_kbps"] + io["write_kbps"] > 0.1 else "idle"
+
+    # ── Processes ─────────────────────────────────────────────────────────
+
+    def top_processes(self, n: int = 5) -> list:
+        """[(comm, cpu %)] of the busiest processes since the previous call."""
+        now = time.monotonic()
+        procs = _proc_ticks()
+        with self._lock:
+            prev, self._procs = self._procs, (now, procs)
+
+        usage = []
+        if prev is not None and now > prev[0]:
+            dt = now - prev[0]
+            for pid, (comm, ticks, start) in procs.items():
+                old = prev[1].get(pid)
+                if old is not None and old[2] == start:     # not a recycled pid
+                    usage.append((comm, (ticks - old[1]) / CLK_TCK / dt * 100))
+        else:
+            # No earlier snapshot: lifetime average, as ps reports it
+            uptime = _uptime()
+            for comm, ticks, start in procs.values():
+                age = uptime - start / CLK_TCK
+                if age > 0:
+                    usage.append((comm, ticks / CLK_TCK / age * 100))
+
+        usage.sort(key=lambda u: u[1], reverse=True)
+        return [(comm, round(cpu, 1)) for comm, cpu in usage[:n]]
+
+
+def _diskstats() -> dict:
+    """{device: [counters...]} from /proc/diskstats."""
+    out = {}
+    raw = _read("/proc/diskstats") or ""
+    for line in raw.splitlines():
+        parts = line.split()
+        if len(parts) >= 14:
+            out[parts[2]] = [int(x) for x in parts[3:14]]
+    return out
+
+
+def _parse_stat(raw: str):
+    # comm may contain spaces and parentheses: it runs to the LAST ')'
+    lpar, rpar = raw.find("("), raw.rfind(")")
+    return raw[lpar + 1:rpar], raw[rpar + 2:].split()
+
+
+def _proc_ticks() -> dict:
+    """{pid: (comm, utime + stime, starttime)} in clock ticks for every live process."""
+    procs = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        raw = _read(f"/proc/{entry}/stat")
+        if not raw:
+            continue        # exited between listdir and open
+        comm, rest = _parse_stat(raw)
+        # rest[0] is field 3 (state); utime / stime are 14 / 15, starttime 22
+        procs[int(entry)] = (comm, int(rest[11]) + int(rest[12]), int(rest[19]))
+    return procs
+
+
+def _uptime() -> float:
+    raw = _read("/proc/uptime")
+    return float(raw.split()[0]) if raw else 0.0
+
+
+sampler = SystemSampler()
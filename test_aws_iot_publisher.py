@@ -0,0 +1,48 @@
+import gzip, json
+import os, sys
+
+_project_root = os.path.dirname(os.path.abspath(__file__))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+import aws_iot_publisher as iot
+
+T0 = 1_718_000_000.0
+
+
+def readings(n):
+    return [(T0 + i * 10.01, iot._payload("plug" if i % 2 else "server",
+                                          {"device_name": f"dev{i}", "switch": True,
+                                           "watts": 100.0 + i, "voltage": 230.0,
+                                           "current_ma": 400 + i, "add_ele_kwh": 1.5},
+                                          wh_delta=0.25 * i, ts=T0 + i * 10.01))
+            for i in range(n)]
+
+
+def test_encode_batch_is_columnar():
+    rs = readings(3)
+    doc = json.loads(iot._encode_batch(rs))
+    assert doc["schema"] == "plug.readings.batch.v1"
+    assert doc["count"] == 3
+    assert doc["t0"] == T0
+    assert doc["dt"] == [0, 10.01, 20.02]
+    assert set(doc) == {"schema", "count", "t0", "dt", *iot._BATCH_FIELDS}
+    for field in iot._BATCH_FIELDS:
+        assert doc[field] == [p[field] for _, p in rs]
+
+
+def test_encode_batch_round_trips_to_rows():
+    rs = readings(5)
+    doc = json.loads(iot._encode_batch(rs))
+    rows = [{f: doc[f][i] for f in iot._BATCH_FIELDS} for i in range(doc["count"])]
+    assert rows == [{f: p[f] for f in iot._BATCH_FIELDS} for _, p in rs]
+    assert [round(doc["t0"] + dt, 3) for dt in doc["dt"]] == [round(ts, 3) for ts, _ in rs]
+
+
+def test_encode_batch_gzip():
+    rs = readings(50)
+    text = iot._encode_batch(rs)
+    packed = iot._encode_batch(rs, compress=True)
+    assert isinstance(packed, bytes)
+    assert gzip.decompress(packed).decode() == text
+    assert len(packed) < len(text)
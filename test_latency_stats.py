@@ -0,0 +1,88 @@
+import os, sys
+
+import pytest
+
+_project_root = os.path.dirname(os.path.abspath(__file__))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+import latency_stats
+
+T0 = 1_700_000_000.0
+BOUND = latency_stats.GROWTH / 2 - 0.5 + 0.001      # ±5 % bucket bound
+
+
+def exact(values, q):
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+
+def within_bound(got, want):
+    return abs(got - want) <= want * BOUND
+
+
+def test_percentiles_within_bucket_bound():
+    stats = latency_stats.LatencyStats()
+    rtts = [1.0 + i * 0.5 for i in range(200)]       # 1 .. 100.5 ms
+    for i, rtt in enumerate(rtts):
+        stats.add(rtt, T0 + i * 0.1)
+    w = stats.snapshot(T0 + 20)["1m"]
+    assert w["count"] == w["sent"] == 200
+    for name, q in latency_stats.QUANTILES.items():
+        assert within_bound(w[name], exact(rtts, q)), (name, w[name], exact(rtts, q))
+    assert w["mean"] == pytest.approx(sum(rtts) / len(rtts))
+
+
+def test_loss_and_jitter():
+    stats = latency_stats.LatencyStats()
+    # 10, 12, lost, 10, 14: jitter over consecutive replies = (2 + 2 + 4) / 3
+    for i, rtt in enumerate([10.0, 12.0, None, 10.0, 14.0]):
+        stats.add(rtt, T0 + i)
+    w = stats.snapshot(T0 + 5)["1m"]
+    assert (w["sent"], w["count"]) == (5, 4)
+    assert w["loss"] == pytest.approx(20.0)
+    assert w["jitter"] == pytest.approx(8.0 / 3, abs=0.01)
+
+
+def test_windows_expire_slot_by_slot():
+    stats = latency_stats.LatencyStats()
+    stats.add(50.0, T0)
+    stats.add(5.0, T0 + 30)
+
+    snap = stats.snapshot(T0 + 70)          # first sample's 3 s slot has left the 1m window
+    assert snap["1m"]["count"] == 1
+    assert within_bound(snap["1m"]["p99"], 5.0)
+    assert snap["15m"]["count"] == 2
+    assert within_bound(snap["15m"]["p99"], 50.0)
+
+    snap = stats.snapshot(T0 + 100)         # both gone from 1m, still in the longer windows
+    assert snap["1m"] == {"count": 0, "sent": 0, "loss": 0.0, "mean": 0.0, "jitter": 0.0,
+                          "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    assert snap["1h"]["count"] == 2
+
+
+def test_jump_past_whole_window_resets_counts():
+    stats = latency_stats.LatencyStats()
+    for i in range(100):
+        stats.add(20.0 if i % 10 else None, T0 + i)
+    # Next sample arrives more than 24h later: every window starts over
+    stats.add(7.0, T0 + 100 + 86400 * 2)
+    snap = stats.snapshot(T0 + 100 + 86400 * 2)
+    for name, w in snap.items():
+        assert (w["sent"], w["count"], w["loss"]) == (1, 1, 0.0), name
+        assert within_bound(w["p50"], 7.0)
+        assert w["jitter"] == pytest.approx(13.0)    # vs the last reply before the jump
+
+    snap = stats.snapshot(T0 + 100 + 86400 * 4)
+    for name, w in snap.items():
+        assert (w["sent"], w["count"]) == (0, 0), name
+        assert w["mean"] == 0.0 and w["p99"] == 0.0
+
+
+def test_out_of_range_rtts_clamp_to_end_buckets():
+    stats = latency_stats.LatencyStats()
+    stats.add(0.001, T0)
+    stats.add(latency_stats.MAX_RTT_MS * 10, T0 + 1)
+    w = stats.snapshot(T0 + 2)["1m"]
+    assert w["p50"] == pytest.approx(latency_stats.bucket_value(0), abs=0.01)
+    assert w["p99"] == pytest.approx(latency_stats.bucket_value(latency_stats.BUCKETS - 1), abs=0.01)
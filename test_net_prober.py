@@ -0,0 +1,50 @@
+import os, sys
+
+import pytest
+
+_project_root = os.path.dirname(os.path.abspath(__file__))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+import net_prober
+
+T0 = 1_700_000_000.0
+
+
+def test_empty_window_reports_total_loss():
+    s = net_prober.ProbeWindow(60).summary()
+    assert s == {"latency": 0.0, "jitter": 0.0, "packet_loss": 100.0, "sent": 0, "received": 0}
+
+
+def test_latency_jitter_and_loss():
+    w = net_prober.ProbeWindow(60)
+    for i, rtt in enumerate([10.0, 14.0, None, 12.0, None, 20.0]):
+        w.add(T0 + i, rtt)
+    s = w.summary()
+    assert s["latency"] == pytest.approx(14.0)
+    # |Δ| between consecutive replies, lost probes skipped: 4, 2, 8
+    assert s["jitter"] == pytest.approx(14 / 3, abs=0.01)
+    assert s["packet_loss"] == pytest.approx(33.3)
+    assert (s["sent"], s["received"]) == (6, 4)
+
+
+def test_all_lost():
+    w = net_prober.ProbeWindow(60)
+    for i in range(3):
+        w.add(T0 + i, None)
+    s = w.summary()
+    assert (s["latency"], s["jitter"], s["packet_loss"]) == (0.0, 0.0, 100.0)
+
+
+def test_old_samples_expire():
+    w = net_prober.ProbeWindow(60)
+    w.add(T0, None)
+    w.add(T0 + 30, 100.0)
+    w.add(T0 + 60, 50.0)                     # T0 is exactly 60 s old: kept
+    assert w.summary()["sent"] == 3
+    w.add(T0 + 61, 50.0)                     # T0 drops out
+    s = w.summary()
+    assert (s["sent"], s["packet_loss"]) == (3, 0.0)
+    w.add(T0 + 200, 40.0)                    # everything else drops out
+    assert w.summary() == {"latency": 40.0, "jitter": 0.0, "packet_loss": 0.0,
+                           "sent": 1, "received": 1}
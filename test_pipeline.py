@@ -0,0 +1,309 @@
+import math
+import os, sys
+from datetime import datetime
+
+import pytest
+
+_project_root = os.path.dirname(os.path.abspath(__file__))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+import pipeline
+
+T0 = datetime(2024, 1, 1, 10, 0, 0).timestamp()
+
+
+@pytest.fixture(autouse=True)
+def add_ele_dps(monkeypatch):
+    # Every test device meters energy on the default add_ele DPS
+    monkeypatch.setattr(pipeline.tuya_local, "dps_id", lambda key, role: "17")
+
+
+def reading(ts, watts=100.0, kwh=None, key="plug", voltage=230.0, current_ma=450):
+    status = {"watts": watts, "voltage": voltage, "current_ma": current_ma,
+              "add_ele_kwh": kwh, "raw_dps": {"17": 0} if kwh is not None else {}}
+    return {"device_key": key, "ts": ts, "status": status}
+
+
+# ── validate ───────────────────────────────────────────────────────────────
+
+def test_validate_accepts_normal_frames():
+    r = reading(T0)
+    assert pipeline.validate(r) is r
+    assert pipeline.validate(reading(T0, watts=0, voltage=0, current_ma=0)) is not None
+
+
+@pytest.mark.parametrize("fields", [
+    {"watts": -1},
+    {"watts": pipeline.MAX_WATTS + 1},
+    {"voltage": pipeline.MAX_VOLTAGE + 1},
+    {"voltage": -5},
+    {"current_ma": -1},
+])
+def test_validate_rejects_impossible_frames(fields):
+    assert pipeline.validate(reading(T0, **fields)) is None
+
+
+# ── EnergyIntegrator ───────────────────────────────────────────────────────
+
+def simulate(integ, interval, span, watts=1000.0, skip=(), reset_at=None, counter_from=12.345):
+    """
+    Poll a constant load every `interval` s for `span` s. The plug counter
+    shows whole Wh of true energy (1 Wh resolution); polls in `skip` are
+    missed; at `reset_at` the counter restarts from 0.
+    Returns (readings, true Wh).
+    """
+    out, offset = [], counter_from * 1000
+    steps = int(span / interval)
+    for i in range(steps + 1):
+        ts = T0 + i * interval
+        true_wh = watts * (ts - T0) / 3600
+        if reset_at is not None and ts >= reset_at:
+            offset = -watts * (reset_at - T0) / 3600
+        if i in skip:
+            continue
+        counter = math.floor(offset + true_wh + 1e-9) / 1000
+        out.append(integ(reading(ts, watts, counter)))
+    return out, watts * steps * interval / 3600
+
+
+def booked(readings):
+    return sum(r["wh_delta"] for r in readings)
+
+
+def test_normal_run_books_metered_energy():
+    rs, true_wh = simulate(pipeline.EnergyIntegrator(), interval=2, span=600)
+    assert rs[0]["wh_method"] == "first"
+    assert {r["wh_method"] for r in rs[1:]} <= {"trapezoid", "counter"}
+    assert booked(rs) == pytest.approx(true_wh, abs=1.0)
+
+
+@pytest.mark.parametrize("interval", [2, 10, 36, 60])
+def test_longer_poll_interval_loses_no_energy(interval):
+    rs, true_wh = simulate(pipeline.EnergyIntegrator(), interval=interval, span=3600)
+    assert booked(rs) == pytest.approx(true_wh, abs=1.0)
+
+
+def test_missed_polls_are_recovered_by_counter():
+    rs, true_wh = simulate(pipeline.EnergyIntegrator(), interval=10, span=1200,
+                           skip=range(20, 50))
+    assert booked(rs) == pytest.approx(true_wh, abs=1.0)
+
+
+def test_gap_longer_than_max_gap():
+    integ = pipeline.EnergyIntegrator(max_gap=300)
+    # Plug offline for 20 minutes, counter carried on metering
+    rs, true_wh = simulate(integ, interval=60, span=3600, skip=range(10, 30))
+    assert booked(rs) == pytest.approx(true_wh, abs=1.0)
+
+    # Without a counter there is nothing to recover the gap from
+    integ = pipeline.EnergyIntegrator(max_gap=300)
+    integ(reading(T0, 1000.0))
+    r = integ(reading(T0 + 1200, 1000.0))
+    assert r["wh_method"] == "gap"
+    assert r["wh_delta"] == 0.0
+
+
+def test_counter_reset_rebases():
+    integ = pipeline.EnergyIntegrator()
+    rs, true_wh = simulate(integ, interval=10, span=1200, reset_at=T0 + 605)
+    methods = [r["wh_method"] for r in rs]
+    assert methods.count("reset") == 1
+    reset = rs[methods.index("reset")]
+    assert reset["wh_delta"] == pytest.approx(1000.0 * 10 / 3600)     # trapezoid
+    assert booked(rs) == pytest.approx(true_wh, abs=2.0)
+
+
+def test_counter_glitch_is_ignored():
+    integ = pipeline.EnergyIntegrator()
+    integ(reading(T0, 500.0, 1.000))
+    r = integ(reading(T0 + 10, 500.0, 9.000))      # 8 kWh in 10 s
+    assert r["wh_method"] == "glitch"
+    assert r["wh_delta"] == pytest.approx(500.0 * 10 / 3600)
+    r = integ(reading(T0 + 82, 500.0, 9.010))      # metering resumes from the new base
+    assert r["wh_method"] == "counter"
+    assert r["wh_delta"] == pytest.approx(10.0)
+
+
+def test_trapezoid_overestimate_carries_forward():
+    integ = pipeline.EnergyIntegrator()
+    integ(reading(T0, 1000.0, 1.000))
+    r = integ(reading(T0 + 36, 1000.0, 1.000))     # counter not moved: estimate 10 Wh
+    assert (r["wh_method"], r["wh_delta"]) == ("trapezoid", pytest.approx(10.0))
+    r = integ(reading(T0 + 40, 1000.0, 1.004))     # meter says 4 Wh: 6 Wh carried
+    assert (r["wh_method"], r["wh_delta"]) == ("counter", 0.0)
+    r = integ(reading(T0 + 80, 1000.0, 1.020))     # 16 Wh metered, 6 already booked
+    assert r["wh_delta"] == pytest.approx(10.0)
+
+
+def test_hour_boundary_split():
+    start = datetime(2024, 1, 1, 10, 59, 30).timestamp()
+    integ = pipeline.EnergyIntegrator()
+    integ(reading(start, 600.0))
+    r = integ(reading(start + 120, 600.0))
+    assert r["wh_delta"] == pytest.approx(20.0)
+    (s1, e1, wh1), (s2, e2, wh2) = r["wh_segments"]
+    assert e1 == s2 == datetime(2024, 1, 1, 11, 0, 0)
+    assert wh1 == pytest.approx(20.0 * 30 / 120)
+    assert wh2 == pytest.approx(20.0 * 90 / 120)
+
+
+def test_split_by_hour_multiple_hours():
+    start = datetime(2024, 1, 1, 22, 30, 0).timestamp()
+    segments = pipeline._split_by_hour(start, start + 3 * 3600, 30.0)
+    assert [s.hour for s, _, _ in segments] == [22, 23, 0, 1]
+    assert [wh for _, _, wh in segments] == pytest.approx([5.0, 10.0, 10.0, 5.0])
+    assert segments[2][0] == datetime(2024, 1, 2, 0, 0, 0)
+
+
+def test_no_segments_without_energy():
+    integ = pipeline.EnergyIntegrator()
+    integ(reading(T0, 0.0, 1.000))
+    r = integ(reading(T0 + 60, 0.0, 1.000))
+    assert r["wh_delta"] == 0.0
+    assert r["wh_segments"] == []
+
+
+# ── AdaptivePoller ─────────────────────────────────────────────────────────
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def poller_env(monkeypatch):
+    """AdaptivePoller on a fake clock and fake plugs: env["status"][key] is
+    what the next poll of that plug returns, env["polled"] records each call."""
+    clock = Clock()
+    env = {"clock": clock, "polled": [], "fresh": set(),
+           "status": {k: {"watts": 100.0, "switch": True} for k in ("plug", "server")}}
+
+    def get_status_many(keys):
+        env["polled"].append(tuple(keys))
+        return {k: env["status"][k] for k in keys}
+
+    monkeypatch.setattr(pipeline, "time", clock)
+    monkeypatch.setattr(pipeline.tuya_local, "get_status_many", get_status_many)
+    monkeypatch.setattr(pipeline.tuya_local, "listener_fresh", lambda k: k in env["fresh"])
+    return env
+
+
+def test_poller_flat_load_backs_off(poller_env):
+    p = pipeline.AdaptivePoller(("plug",), base=10, budget=4)
+    expected = [15.0, 22.5, 33.75, 50.625, pipeline.POLL_MAX_INTERVAL, pipeline.POLL_MAX_INTERVAL]
+    for want in expected:
+        assert set(p.poll()) == {"plug"}
+        assert p.intervals()["plug"] == want
+        assert p.poll() == {}                            # not due yet
+        poller_env["clock"].now += want
+
+
+def test_poller_load_change_and_relay_off(poller_env):
+    p = pipeline.AdaptivePoller(("plug",), base=10, budget=4)
+    p.poll()
+    poller_env["status"]["plug"] = {"watts": 300.0, "switch": True}
+    poller_env["clock"].now += 15
+    assert set(p.poll()) == {"plug"}
+    assert p.intervals()["plug"] == pipeline.POLL_MIN_INTERVAL
+    poller_env["status"]["plug"] = {"watts": 300.0, "switch": False}
+    poller_env["clock"].now += pipeline.POLL_MIN_INTERVAL
+    p.poll()
+    assert p.intervals()["plug"] == pipeline.POLL_MAX_INTERVAL
+
+
+def test_poller_failures_back_off_exponentially(poller_env):
+    p = pipeline.AdaptivePoller(("plug",), base=10, budget=4)
+    poller_env["status"]["plug"] = None
+    for want in (20, 40, 80, 160, pipeline.POLL_MAX_BACKOFF, pipeline.POLL_MAX_BACKOFF):
+        p.poll()
+        assert p.intervals()["plug"] == want
+        poller_env["clock"].now += want
+    poller_env["status"]["plug"] = {"watts": 100.0, "switch": True}
+    assert set(p.poll()) == {"plug"}
+    assert p.sched["plug"]["failures"] == 0
+    assert p.intervals()["plug"] <= pipeline.POLL_MAX_INTERVAL
+
+
+def test_poller_watch_pulls_the_next_poll_forward(poller_env):
+    p = pipeline.AdaptivePoller(("plug",), base=10, budget=4)
+    p.poll()
+    p.watch("plug", ttl=15)
+    poller_env["clock"].now += pipeline.POLL_MIN_INTERVAL
+    assert set(p.poll()) == {"plug"}
+    assert p.intervals()["plug"] == pipeline.POLL_MIN_INTERVAL
+    poller_env["clock"].now += 20                       # watch expired
+    p.poll()
+    assert p.intervals()["plug"] == 10
+
+
+def test_poller_token_bucket_caps_polls(poller_env):
+    keys = tuple(f"p{i}" for i in range(5))
+    poller_env["status"] = {k: {"watts": 100.0, "switch": True} for k in keys}
+    p = pipeline.AdaptivePoller(keys, base=10, budget=2)
+
+    assert len(p.poll()) == 2                            # bucket starts full (2 tokens)
+    assert p.stats["deferred"] == 3
+    poller_env["clock"].now += 0.5                       # +1 token
+    assert p.poll().keys() == {"p2"}                     # most overdue first
+    poller_env["clock"].now += 60                        # refill is capped at `budget`
+    assert len(p.poll()) == 2
+
+
+def test_poller_fresh_listener_costs_no_tokens(poller_env):
+    p = pipeline.AdaptivePoller(("plug", "server"), base=10, budget=1)
+    poller_env["fresh"].add("plug")
+    assert set(p.poll()) == {"plug", "server"}
+    assert p.stats["deferred"] == 0
+
+
+# ── Pipeline ───────────────────────────────────────────────────────────────
+
+class FakeSource:
+    def __init__(self, frames):
+        self.frames = frames
+
+    def poll(self):
+        return self.frames
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(pipeline.tuya_local, "DEVICES",
+                        {"plug": {"id": "plug-id"}, "server": {"id": "server-id"}})
+
+
+def test_run_once_routes_readings(monkeypatch, registry):
+    dispatched, states = [], {}
+    monkeypatch.setattr(pipeline.sinks, "dispatch", dispatched.append)
+    good = {"watts": 100.0, "voltage": 230.0, "current_ma": 450}
+    bad  = {"watts": -3.0,  "voltage": 230.0, "current_ma": 450}
+    p = pipeline.Pipeline(FakeSource({"plug": good, "server": bad}),
+                          on_state=lambda key, r: states.__setitem__(key, r))
+
+    p.run_once()
+    assert [(r["device_key"], r["device_id"]) for r in dispatched] == [("plug", "plug-id")]
+    assert states["plug"]["status"] is good and states["server"] is None
+    assert p.stats["rejected"] == {"validate": 1}
+
+    p.source.frames = {"plug": None}
+    p.run_once()
+    assert states["plug"] is None
+    assert (p.stats["cycles"], p.stats["readings"], p.stats["missed"]) == (2, 1, 1)
+
+
+def test_transform_errors_reject_the_reading(monkeypatch, registry):
+    dispatched = []
+    monkeypatch.setattr(pipeline.sinks, "dispatch", dispatched.append)
+
+    def explode(r):
+        raise ValueError("boom")
+
+    p = pipeline.Pipeline(FakeSource({"plug": {"watts": 1.0, "voltage": 1.0, "current_ma": 1}}),
+                          transforms=[explode])
+    p.run_once()
+    assert dispatched == []
+    assert p.stats["rejected"] == {"explode": 1}
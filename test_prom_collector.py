@@ -0,0 +1,64 @@
+import os, sys
+
+import pytest
+
+_project_root = os.path.dirname(os.path.abspath(__file__))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+import prom_collector
+from prom_collector import TAG_LABEL, PromError
+
+QUERIES = {"cpu": "cpu_expr", "mem": "mem_expr", "disk": "disk_expr"}
+
+
+def series(value, **labels):
+    return {"metric": dict(labels), "value": [1718000000.0, str(value)]}
+
+
+@pytest.fixture
+def collector():
+    c = prom_collector.PromCollector("http://prom.invalid:9090/", QUERIES, timeout=0.5)
+    yield c
+    c.close()
+
+
+def test_combined_query_wraps_every_expression(collector, monkeypatch):
+    sent = []
+    monkeypatch.setattr(collector, "query", lambda expr: sent.append(expr) or [])
+    collector.collect_batched()
+    assert sent == [" or ".join(f'label_replace({expr}, "{TAG_LABEL}", "{key}", "", "")'
+                                for key, expr in QUERIES.items())]
+
+
+def test_batched_result_is_split_by_tag(collector, monkeypatch):
+    monkeypatch.setattr(collector, "query", lambda expr: [
+        series(12.5, **{TAG_LABEL: "cpu"}),
+        series(1, instance="a", **{TAG_LABEL: "mem"}),
+        series(2, instance="b", **{TAG_LABEL: "mem"}),
+        series(9, **{TAG_LABEL: "unknown"}),           # not ours: ignored
+        series(7),                                     # untagged: ignored
+    ])
+    result = collector.collect()
+    assert set(result) == set(QUERIES)
+    assert result["cpu"] == [series(12.5)]             # tag label removed again
+    assert [s["metric"]["instance"] for s in result["mem"]] == ["a", "b"]
+    assert result["disk"] == []
+    assert collector.stats()["batched"]["count"] == 1
+
+
+def test_failed_batch_falls_back_per_query(collector, monkeypatch):
+    def query(expr):
+        if " or " in expr:
+            raise PromError("query timed out")
+        if expr == "disk_expr":
+            raise PromError("bad gateway")
+        return [series(len(expr))]
+
+    monkeypatch.setattr(collector, "query", query)
+    result = collector.collect()
+    assert result == {"cpu": [series(8)], "mem": [series(8)]}   # disk left out
+    stats = collector.stats()
+    assert (stats["fallbacks"], stats["missing"]) == (1, 1)
+    assert stats["concurrent"]["count"] == 1
+    assert "disk" in stats["last_error"]
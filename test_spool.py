@@ -0,0 +1,56 @@
+import os, sys
+
+_project_root = os.path.dirname(os.path.abspath(__file__))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+import spool
+
+
+def table_totals(s):
+    return s._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool").fetchone()
+
+
+def test_fifo_peek_and_delete():
+    s = spool.Spool(":memory:", max_bytes=10_000)
+    s.append(["a", "b", "c"])
+    rows = s.peek()
+    assert [p for _, p in rows] == ["a", "b", "c"]
+    s.delete([rows[0][0], rows[1][0], 999])          # unknown id ignored
+    assert [p for _, p in s.peek()] == ["c"]
+    assert s.peek(after_id=rows[2][0]) == []
+    assert (s.depth(), s.size_bytes(), s.deleted) == (1, 1, 2)
+
+
+def test_eviction_drops_oldest_down_to_headroom():
+    s = spool.Spool(":memory:", max_bytes=1000)
+    s.append(["x" * 10] * 100)                       # exactly at the cap
+    assert s.evicted == 0
+    s.append(["y" * 10])                             # 1010 bytes, over the cap
+    assert s.size_bytes() <= 1000 * (1 - spool.EVICT_HEADROOM)
+    assert s.evicted == 101 - s.depth()
+    # Counters agree with the table, and the newest message survived
+    assert table_totals(s) == (s.depth(), s.size_bytes())
+    assert s.peek(limit=1000)[-1][1] == "y" * 10
+    assert all(p == "x" * 10 for _, p in s.peek(limit=1000)[:-1])
+
+
+def test_eviction_spans_several_batches(monkeypatch):
+    monkeypatch.setattr(spool, "EVICT_BATCH", 7)
+    s = spool.Spool(":memory:", max_bytes=500)
+    s.append(["z" * 10] * 50)
+    s.append(["z" * 10] * 30)                        # 800 bytes, frees 350
+    assert s.size_bytes() == 450
+    assert s.evicted == 35
+    assert table_totals(s) == (45, 450)
+
+
+def test_oldest_age():
+    s = spool.Spool(":memory:", max_bytes=10_000)
+    assert s.oldest_age() == 0.0
+    now = spool.time.time()
+    s.append(["old"], created_at=now - 60)
+    s.append(["new"], created_at=now - 5)
+    assert 59 <= s.oldest_age() <= 61
+    s.delete([s.peek(limit=1)[0][0]])
+    assert 4 <= s.oldest_age() <= 6
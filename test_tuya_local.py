@@ -0,0 +1,113 @@
+import os, sys
+
+import pytest
+
+_project_root = os.path.dirname(os.path.abspath(__file__))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+import tuya_local
+from tuya_local import CLOSED, HALF_OPEN, OPEN
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(tuya_local, "time", c)
+    return c
+
+
+@pytest.fixture
+def transitions(monkeypatch):
+    seen = []
+    monkeypatch.setattr(tuya_local, "_breaker_hooks", [])
+    tuya_local.on_breaker_change(lambda key, old, new: seen.append((key, old, new)))
+    return seen
+
+
+def test_opens_after_threshold(clock, transitions):
+    b = tuya_local.CircuitBreaker("plug", threshold=3)
+    b.failure()
+    b.failure()
+    assert b.state == CLOSED and b.allow()
+    b.failure()
+    assert b.state == OPEN
+    assert not b.allow()
+    assert b.stats()["short_circuited"] == 1
+    assert b.stats()["retry_in_s"] == tuya_local.BREAKER_BASE
+    assert transitions == [("plug", CLOSED, OPEN)]
+
+
+def test_success_resets_the_failure_count(clock):
+    b = tuya_local.CircuitBreaker("plug", threshold=3)
+    for _ in range(2):
+        b.failure()
+    b.success()
+    b.failure()
+    b.failure()
+    assert b.state == CLOSED
+
+
+def test_single_half_open_probe(clock, transitions):
+    b = tuya_local.CircuitBreaker("plug", threshold=1)
+    b.failure()
+    clock.now += tuya_local.BREAKER_BASE - 0.1
+    assert not b.allow()
+    clock.now += 0.1
+    assert b.allow()                     # this caller is the probe
+    assert b.state == HALF_OPEN
+    assert not b.allow()                 # everyone else waits for it
+    b.success()
+    assert b.state == CLOSED and b.allow()
+    assert transitions == [("plug", CLOSED, OPEN), ("plug", OPEN, HALF_OPEN),
+                           ("plug", HALF_OPEN, CLOSED)]
+    assert b.stats()["transitions"] == {"closed->open": 1, "open->half_open": 1,
+                                        "half_open->closed": 1}
+
+
+def test_failed_probe_doubles_the_open_period(clock, transitions):
+    b = tuya_local.CircuitBreaker("plug", threshold=1)
+    b.failure()
+    delays = []
+    for _ in range(10):
+        delays.append(b.stats()["retry_in_s"])
+        clock.now += delays[-1]
+        assert b.allow()
+        b.failure()
+    assert delays[:4] == [5, 10, 20, 40]
+    assert max(delays) == tuya_local.BREAKER_MAX
+    assert transitions[-1] == ("plug", HALF_OPEN, OPEN)
+
+    # A successful probe starts the backoff over
+    clock.now += b.stats()["retry_in_s"]
+    assert b.allow()
+    b.success()
+    b.failure()
+    assert b.stats()["retry_in_s"] == tuya_local.BREAKER_BASE
+
+
+def test_force_always_goes_through(clock):
+    b = tuya_local.CircuitBreaker("plug", threshold=1)
+    b.failure()
+    assert b.allow(force=True)
+    assert b.state == OPEN
+    assert b.stats()["short_circuited"] == 0
+
+
+def test_hook_errors_are_contained(clock, transitions):
+    def broken(*args):
+        raise RuntimeError("boom")
+
+    tuya_local._breaker_hooks.insert(0, broken)
+    b = tuya_local.CircuitBreaker("plug", threshold=1)
+    b.failure()
+    assert b.state == OPEN
+    assert transitions == [("plug", CLOSED, OPEN)]
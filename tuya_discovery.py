@@ -0,0 +1,225 @@
+"""
+tuya_discovery.py
+=================
+Passive Tuya LAN discovery: maps device ids to their current IP address.
+
+Tuya devices broadcast a UDP beacon every few seconds while no client is
+connected to them — which is exactly the state a plug ends up in after a
+DHCP lease moves it and our session to the old address drops:
+
+  6666  protocol 3.1, plaintext JSON
+  6667  protocol 3.2 – 3.4, AES-ECB with the well-known UDP key
+  7000  protocol 3.5, AES-GCM (6699 framing)
+
+DiscoveryListener binds all three ports on one thread and decodes each
+beacon (tinytuya.decrypt_udp) into the TTL `cache`:
+
+    {gwId: {"ip": "192.168.1.2", "version": 3.5, "product_key": "...",
+            "seen": monotonic, "port": 7000}}
+
+cache.lookup() is a dict read, so pollers may consult it freely; nothing
+here ever scans or blocks on the network in the caller's thread. Entries
+not heard from within DISCOVERY_TTL expire. on_beacon hooks (see
+tuya_local.apply_beacon) push address changes into the device registry.
+
+    python tuya_discovery.py              # listen 15 s, print what answered
+    python tuya_discovery.py --seconds 60
+"""
+
+import argparse
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+import tinytuya
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DISCOVERY_ENABLED = os.getenv("TUYA_DISCOVERY", "1") == "1"
+DISCOVERY_PORTS   = (6666, 6667, 7000)
+DISCOVERY_TTL     = float(os.getenv("TUYA_DISCOVERY_TTL", 300))   # seconds a beacon stays valid
+
+# Running totals since process start
+metrics = {
+    "beacons":       0,
+    "decode_errors": 0,
+    "devices":       0,
+    "ports":         [],     # ports actually bound
+    "last_error":    None,
+}
+
+
+# ── Cache ──────────────────────────────────────────────────────────────────
+
+class DiscoveryCache:
+    """Device id -> last beacon, expiring after `ttl` seconds of silence."""
+
+    def __init__(self, ttl: float = DISCOVERY_TTL):
+        self.ttl    = ttl
+        self._lock  = threading.Lock()
+        self._items = {}
+
+    def update(self, dev_id: str, info: dict) -> dict | None:
+        """Store a beacon; returns the previous (unexpired) entry, if any."""
+        with self._lock:
+            prev = self._items.get(dev_id)
+            self._items[dev_id] = info
+        return prev if prev and not self._expired(prev) else None
+
+    def lookup(self, dev_id: str) -> dict | None:
+        """Freshest beacon for dev_id, or None if unseen / expired."""
+        with self._lock:
+            info = self._items.get(dev_id)
+        return dict(info) if info and not self._expired(info) else None
+
+    def entries(self) -> dict:
+        """All unexpired entries (expired ones are pruned)."""
+        with self._lock:
+            for dev_id in [d for d, i in self._items.items() if self._expired(i)]:
+                del self._items[dev_id]
+            return {d: dict(i) for d, i in self._items.items()}
+
+    def _expired(self, info: dict) -> bool:
+        return time.monotonic() - info["seen"] > self.ttl
+
+
+cache = DiscoveryCache()
+
+
+# ── Listener ───────────────────────────────────────────────────────────────
+
+class DiscoveryListener(threading.Thread):
+    """Receives beacons on every DISCOVERY_PORTS socket it could bind."""
+
+    def __init__(self, on_beacon=None, ports=DISCOVERY_PORTS):
+        super().__init__(name="tuya-discovery", daemon=True)
+        self.on_beacon = on_beacon
+        self.ports     = ports
+        self._socks    = {}      # socket -> port
+        self._stop     = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        for port in self.ports:
+            try:
+                self._socks[_bind(port)] = port
+            except OSError as e:
+                metrics["last_error"] = f"port {port}: {e}"
+                print(f"[tuya_discovery] cannot listen on UDP {port}: {e}")
+        metrics["ports"] = sorted(self._socks.values())
+        if not self._socks:
+            return
+
+        try:
+            while not self._stop.is_set():
+                readable, _, _ = select.select(list(self._socks), [], [], 1.0)
+                for sock in readable:
+                    try:
+                        data, (addr, _) = sock.recvfrom(4096)
+                    except OSError:
+                        continue
+                    self._handle(data, addr, self._socks[sock])
+        finally:
+            for sock in self._socks:
+                sock.close()
+
+    def _handle(self, data: bytes, addr: str, port: int) -> None:
+        info = _decode(data, addr, port)
+        if info is None:
+            metrics["decode_errors"] += 1
+            return
+        metrics["beacons"] += 1
+        dev_id = info.pop("id")
+        prev = cache.update(dev_id, info)
+        if prev is None:
+            metrics["devices"] = len(cache.entries())
+        if self.on_beacon:
+            try:
+                self.on_beacon(dev_id, info)
+            except Exception as e:
+                print(f"[tuya_discovery] on_beacon({dev_id}) error: {e}")
+
+
+def _bind(port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        # Share the port with tinytuya scans or a second dashboard
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", port))
+    return sock
+
+
+def _decode(data: bytes, addr: str, port: int) -> dict | None:
+    """Beacon bytes -> {"id", "ip", "version", "product_key", "seen", "port"}."""
+    try:
+        payload = json.loads(tinytuya.decrypt_udp(data))
+    except Exception:
+        return None
+    dev_id = payload.get("gwId") or payload.get("devId")
+    if not dev_id:
+        return None
+    try:
+        version = float(payload.get("version"))
+    except (TypeError, ValueError):
+        version = None
+    return {
+        "id":          dev_id,
+        "ip":          payload.get("ip") or addr,
+        "version":     version,
+        "product_key": payload.get("productKey"),
+        "seen":        time.monotonic(),
+        "port":        port,
+    }
+
+
+_listener = None
+
+
+def start(on_beacon=None):
+    """Start the listener thread (no-op when TUYA_DISCOVERY=0)."""
+    global _listener
+    if not DISCOVERY_ENABLED:
+        return None
+    if _listener is None or not _listener.is_alive():
+        _listener = DiscoveryListener(on_beacon)
+        _listener.start()
+    return _listener
+
+
+def stop() -> None:
+    if _listener is not None:
+        _listener.stop()
+
+
+# ── CLI ────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Listen for Tuya LAN beacons.")
+    parser.add_argument("--seconds", type=float, default=15,
+                        help="how long to listen (default: %(default)s)")
+    args = parser.parse_args()
+
+    listener = DiscoveryListener()
+    listener.start()
+    time.sleep(args.seconds)
+    listener.stop()
+
+    import device_registry
+    known = {cfg["id"]: key for key, cfg in device_registry.load().items()}
+    found = cache.entries()
+    print(f"[tuya_discovery] {len(found)} devices, {metrics['beacons']} beacons "
+          f"on UDP {metrics['ports']}")
+    for dev_id, info in sorted(found.items(), key=lambda kv: kv[1]["ip"]):
+        print(f"  {info['ip']:<16} v{info['version']}  {dev_id}  "
+              f"{known.get(dev_id, '(not in registry)')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,99 +1,733 @@
 """
 tuya_local.py
 =============
-tinytuya local LAN wrapper for two smart plugs.
-No cloud dependency after initial key extraction.
+tinytuya local LAN wrapper for the smart plugs in the device registry
+(device_registry.py). No cloud dependency after initial key extraction.
 
-Devices:
-  - Smart plug  (192.168.1.2)   -> full control
-  - Server plug (192.168.1.15)  -> full control + double-confirm off
+DEVICES is reloaded from the registry file when it changes (registry_loop
+or reload_devices()), without a restart: new plugs are picked up by the
+pollers and listeners on their next cycle, removed ones have their session
+closed, and a plug whose ip / key / version changed reconnects with a fresh
+session. on_registry_change() tells the UIs which keys came and went.
+apply_beacon(), hooked to tuya_discovery, does the same when a plug
+announces a new address after a DHCP change, so its IP need not be pinned
+in the registry at all.
+
+Each plug gets one persistent DeviceSession: the TCP socket and the protocol
+3.5 session key are negotiated once and reused by every poll and command.
+Calls on the same plug are serialized by the session lock; a failed call
+drops the socket and the next one reconnects.
+
+Each session sits behind a CircuitBreaker (closed → open → half-open).
+After TUYA_BREAKER_THRESHOLD consecutive failures a plug's circuit opens
+and polls return at once without touching the network. Once the open
+period ends, a single probe is let through: success closes the circuit,
+failure re-opens it for twice as long (up to BREAKER_MAX). Only state
+transitions are logged; breaker_stats() and on_breaker_change() expose
+them as metrics.
+
+get_status_many() polls plugs in parallel on a bounded pool
+(TUYA_POLL_WORKERS) with a per-device deadline, so one offline plug no
+longer delays the readings of the others.
+
+With listen mode on (TUYA_LISTEN=1, the default) start_listeners() runs a
+single ListenerHub thread that select()s over every plug's session socket,
+reads the DPS updates the plugs push and keeps the sockets alive with
+heartbeats. While the hub has heard from a plug within HEARTBEAT_TIMEOUT,
+get_status_many() serves that plug from the pushed state instead of
+polling it. Thread count stays fixed however many plugs are registered.
 """
 
+import atexit
 import os
+import threading
+import time
+import select
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
 import tinytuya
 from dotenv import load_dotenv
 
+import device_registry
+import tuya_discovery
+
 load_dotenv()
 
 # ── Device configs ─────────────────────────────────────────────────────────
+# {device_key: config} from the registry — see device_registry.py for the
+# fields. Rebound, never mutated, on reload: iterate a local reference.
+
+DEVICES = device_registry.load()
+
+
+# ── Sessions ───────────────────────────────────────────────────────────────
+
+SOCKET_TIMEOUT   = float(os.getenv("TUYA_SOCKET_TIMEOUT", 5))
+SESSION_MAX_IDLE = float(os.getenv("TUYA_SESSION_MAX_IDLE", 20))  # plugs drop idle sockets after ~30s
+POLL_DEADLINE    = float(os.getenv("TUYA_POLL_DEADLINE", SOCKET_TIMEOUT + 1))
+POLL_WORKERS     = int(os.getenv("TUYA_POLL_WORKERS", 16))   # concurrent polls, all plugs
+LISTEN_MODE        = os.getenv("TUYA_LISTEN", "1") == "1"
+LISTEN_SLICE       = 0.5    # seconds a listener holds the socket per receive()
+HEARTBEAT_INTERVAL = float(os.getenv("TUYA_HEARTBEAT_INTERVAL", 10))
+HEARTBEAT_TIMEOUT  = float(os.getenv("TUYA_HEARTBEAT_TIMEOUT", 25))  # silent longer -> poll instead
+BREAKER_THRESHOLD  = int(os.getenv("TUYA_BREAKER_THRESHOLD", 3))  # consecutive failures to open
+BREAKER_BASE       = 5.0     # seconds the circuit first stays open, doubled per failed probe
+BREAKER_MAX        = 600.0
 
-DEVICES = {
-    "plug": {
-        "name":      "Smart Plug",
-        "id":        os.getenv("PLUG_ID"),
-        "ip":        os.getenv("PLUG_IP"),
-        "key":       os.getenv("PLUG_KEY"),
-        "version":   3.5,
-        "is_server": False,
-    },
-    "server": {
-        "name":      "Server",
-        "id":        os.getenv("SERVER_PLUG_ID"),
-        "ip":        os.getenv("SERVER_PLUG_IP"),
-        "key":       os.getenv("SERVER_PLUG_KEY"),
-        "version":   3.5,
-        "is_server": True,
-    },
-}
-
-# ── DPS key mapping (LN 2S metering plug) ─────────────────────────────────
-DPS_SWITCH  = "1"
-DPS_CURRENT = "18"   # mA
-DPS_POWER   = "19"   # W x 10  → divide by 10
-DPS_VOLTAGE = "20"   # V x 10  → divide by 10
-DPS_ADD_ELE = "17"   # kWh x 1000 → divide by 1000
-DPS_FAULT   = "26"
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+SESSION_BUSY = {"Error": "session busy", "Err": "906"}   # call(blocking=False) lost the race
 
 
 def _get_device(key: str) -> tinytuya.OutletDevice:
-    """Create a fresh tinytuya device connection."""
+    """Create a tinytuya device that keeps its socket open between calls."""
     cfg = DEVICES[key]
+    if not cfg["ip"]:
+        # tinytuya would fall back to a blocking broadcast scan
+        raise ValueError(f"{key}: no IP address")
     d = tinytuya.OutletDevice(
         dev_id=cfg["id"],
         address=cfg["ip"],
         local_key=cfg["key"],
         version=cfg["version"],
     )
-    d.set_socketPersistent(False)
-    d.set_socketTimeout(5)
-    d.set_socketRetryLimit(2)
+    d.set_socketPersistent(True)
+    d.set_socketTimeout(SOCKET_TIMEOUT)
+    d.set_socketRetryLimit(1)
     return d
 
 
+_breaker_hooks = []
+
+
+def on_breaker_change(callback) -> None:
+    """Register callback(device_key, old_state, new_state) for every transition."""
+    _breaker_hooks.append(callback)
+
+
+class CircuitBreaker:
+    """Per-device closed / open / half-open state with doubling open periods."""
+
+    def __init__(self, key: str, threshold: int = BREAKER_THRESHOLD):
+        self.key             = key
+        self.threshold       = threshold
+        self.state           = CLOSED
+        self.failures        = 0       # consecutive
+        self.opens           = 0       # consecutive open periods, drives the backoff
+        self.retry_at        = 0.0     # monotonic time the next probe is allowed
+        self.short_circuited = 0
+        self.transitions     = {}      # "closed->open" -> count
+        self._lock           = threading.Lock()
+
+    def allow(self, force: bool = False) -> bool:
+        """
+        May a call go through? In the open state the first caller after
+        retry_at becomes the half-open probe; everyone else is refused until
+        it reports back. `force` (user commands) always goes through.
+        """
+        with self._lock:
+            if self.state == CLOSED or force:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.retry_at:
+                change = self._to(HALF_OPEN)
+            else:
+                self.short_circuited += 1
+                return False
+        self._notify(change)
+        return True
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            if self.state == CLOSED:
+                return
+            self.opens = 0
+            change = self._to(CLOSED)
+        print(f"[tuya_local] {self.key}: reachable again, circuit closed")
+        self._notify(change)
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == CLOSED and self.failures < self.threshold:
+                return
+            self.opens += 1
+            delay = min(BREAKER_MAX, BREAKER_BASE * 2 ** (self.opens - 1))
+            self.retry_at = time.monotonic() + delay
+            change = self._to(OPEN) if self.state != OPEN else None
+        print(f"[tuya_local] {self.key}: unreachable ({self.failures} failures), "
+              f"circuit open, next probe in {delay:.0f}s")
+        self._notify(change)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state":           self.state,
+                "failures":        self.failures,
+                "retry_in_s":      round(max(0.0, self.retry_at - time.monotonic()), 1)
+                                   if self.state == OPEN else 0.0,
+                "short_circuited": self.short_circuited,
+                "transitions":     dict(self.transitions),
+            }
+
+    def _to(self, new: str):
+        # Caller holds the lock; returns the change for _notify() once released
+        old, self.state = self.state, new
+        name = f"{old}->{new}"
+        self.transitions[name] = self.transitions.get(name, 0) + 1
+        return old, new
+
+    def _notify(self, change) -> None:
+        if not change:
+            return
+        for hook in list(_breaker_hooks):
+            try:
+                hook(self.key, *change)
+            except Exception as e:
+                print(f"[tuya_local] breaker hook error: {e}")
+
+
+class DeviceSession:
+    """One persistent connection to a plug, shared by polls and commands."""
+
+    def __init__(self, key: str):
+        self.key        = key
+        self.lock       = threading.Lock()
+        self.device     = None
+        self.last_used  = 0.0
+        self.connects   = 0
+        self.breaker    = CircuitBreaker(key)
+
+    def call(self, fn, respect_backoff: bool = True, blocking: bool = True):
+        """
+        Run fn(device) under the session lock and return its result.
+        Errors come back as a tinytuya-style {"Error": ...} dict so callers
+        handle them the same way as a device-reported error.
+        respect_backoff=False (user commands) goes through an open circuit.
+        blocking=False returns SESSION_BUSY instead of waiting for the lock.
+        """
+        if blocking:
+            if not self.breaker.allow(force=not respect_backoff):
+                return {"Error": "circuit open", "Err": "905"}
+            self.lock.acquire()
+        else:
+            # Lock first: a half-open probe must not be claimed and then abandoned
+            if not self.lock.acquire(blocking=False):
+                return SESSION_BUSY
+            if not self.breaker.allow(force=not respect_backoff):
+                self.lock.release()
+                return {"Error": "circuit open", "Err": "905"}
+
+        try:
+            now = time.monotonic()
+
+            # A socket idle past the plug's timeout is likely half-closed;
+            # reconnecting up front beats waiting SOCKET_TIMEOUT to find out
+            if self.device is not None and now - self.last_used > SESSION_MAX_IDLE:
+                self._drop()
+            try:
+                if self.device is None:
+                    self.device = _get_device(self.key)
+                    self.connects += 1
+                result = fn(self.device)
+            except Exception as e:
+                self._failed()
+                return {"Error": str(e), "Err": "901"}
+
+            if isinstance(result, dict) and result.get("Error"):
+                self._failed()
+            else:
+                self.breaker.success()
+                self.last_used = time.monotonic()
+            return result
+        finally:
+            self.lock.release()
+
+    def socket(self):
+        """The open socket, for select(); None while disconnected."""
+        return getattr(self.device, "socket", None) if self.device is not None else None
+
+    def close(self) -> None:
+        with self.lock:
+            self._drop()
+
+    def _failed(self) -> None:
+        self._drop()
+        self.breaker.failure()
+
+    def _drop(self) -> None:
+        if self.device is not None:
+            try:
+                self.device.close()
+            except Exception:
+                pass
+            self.device = None
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session(device_key: str) -> DeviceSession:
+    """Return the shared session for a plug, creating it on first use."""
+    with _sessions_lock:
+        s = _sessions.get(device_key)
+        if s is None:
+            s = _sessions[device_key] = DeviceSession(device_key)
+        return s
+
+
+def breaker_stats() -> dict:
+    """{device_key: breaker state / counters} for every device with a session."""
+    with _sessions_lock:
+        sessions = dict(_sessions)
+    return {key: s.breaker.stats() for key, s in sessions.items()}
+
+
+def close_sessions() -> None:
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+    for s in sessions:
+        s.close()
+
+
+atexit.register(close_sessions)
+
+
 def get_status(device_key: str) -> dict | None:
     """
     Poll device and return parsed status dict.
     Returns None on failure.
     """
     try:
-        d = _get_device(device_key)
-        raw = d.status()
-        dps = raw.get("dps", {})
+        raw = session(device_key).call(lambda d: d.status())
+        dps = (raw or {}).get("dps", {})
 
         if not dps:
             return None
 
-        return {
-            "device_key":  device_key,
-            "device_name": DEVICES[device_key]["name"],
-            "switch":      bool(dps.get(DPS_SWITCH, False)),
-            "watts":       round(dps.get(DPS_POWER, 0) / 10.0, 2),
-            "voltage":     round(dps.get(DPS_VOLTAGE, 0) / 10.0, 1),
-            "current_ma":  int(dps.get(DPS_CURRENT, 0)),
-            "add_ele_kwh": round(dps.get(DPS_ADD_ELE, 0) / 1000.0, 4),
-            "fault":       int(dps.get(DPS_FAULT, 0)),
-            "raw_dps":     dps,
-        }
+        return _parse_status(device_key, dps)
     except Exception as e:
         print(f"[tuya_local] get_status({device_key}) error: {e}")
         return None
 
 
+def _parse_status(device_key: str, dps: dict) -> dict:
+    cfg = DEVICES[device_key]
+    ids, scale = cfg["dps"], cfg["scale"]
+
+    def value(role):
+        return dps.get(ids.get(role), 0) / scale.get(role, 1)
+
+    return {
+        "device_key":  device_key,
+        "device_name": cfg["name"],
+        "switch":      bool(dps.get(ids.get("switch"), False)),
+        "watts":       round(value("power"), 2),
+        "voltage":     round(value("voltage"), 1),
+        "current_ma":  int(value("current")),
+        "add_ele_kwh": round(value("add_ele"), 4),
+        "fault":       int(dps.get(ids.get("fault"), 0)),
+        "raw_dps":     dps,
+    }
+
+
+def dps_id(device_key: str, role: str) -> str | None:
+    """The DPS id a device uses for `role` ("switch", "add_ele", ...), if any."""
+    cfg = DEVICES.get(device_key)
+    return cfg["dps"].get(role) if cfg else None
+
+
+# ── Concurrent polling ─────────────────────────────────────────────────────
+
+_poll_pool     = ThreadPoolExecutor(max_workers=POLL_WORKERS, thread_name_prefix="tuya-poll")
+_inflight      = {}     # device_key -> Future still running from an earlier cycle
+_inflight_lock = threading.Lock()
+
+
+def get_status_many(device_keys=None, deadline: float = POLL_DEADLINE) -> dict:
+    """
+    Poll several devices at once. Returns {device_key: status dict | None}.
+
+    Every device gets the same `deadline` (seconds) measured from the start
+    of the call, so the whole cycle takes at most that long. A device that
+    misses it reports None; its request keeps running in the background and
+    the device is skipped in later cycles until that request returns.
+    """
+    keys = list(device_keys) if device_keys is not None else list(DEVICES)
+    results = dict.fromkeys(keys)
+    futures = {}
+    with _inflight_lock:
+        for key in keys:
+            if listener_fresh(key):
+                results[key] = _hub.status(key)
+                continue
+            prev = _inflight.get(key)
+            if prev is not None and not prev.done():
+                continue
+            futures[key] = _inflight[key] = _poll_pool.submit(get_status, key)
+
+    end = time.monotonic() + deadline
+    for key, fut in futures.items():
+        try:
+            results[key] = fut.result(timeout=max(0.0, end - time.monotonic()))
+        except FutureTimeout:
+            print(f"[tuya_local] get_status({key}) missed {deadline:.1f}s deadline")
+        except Exception as e:
+            print(f"[tuya_local] get_status({key}) error: {e}")
+    return results
+
+
+atexit.register(_poll_pool.shutdown, wait=False, cancel_futures=True)
+
+
+# ── Listen mode ────────────────────────────────────────────────────────────
+
+class PushState:
+    """Last known DPS of one plug, as pushed to the ListenerHub."""
+
+    def __init__(self):
+        self.dps            = {}
+        self.last_seen      = 0.0     # monotonic time of the last frame from the plug
+        self.last_heartbeat = 0.0
+        self.seed_after     = 0.0     # no snapshot request before this (after a failure)
+        self.updates        = 0
+
+    def fresh(self) -> bool:
+        return bool(self.dps) and time.monotonic() - self.last_seen < HEARTBEAT_TIMEOUT
+
+
+class ListenerHub(threading.Thread):
+    """
+    Receives pushed DPS updates for every plug on one thread.
+
+    Each pass: plugs without a snapshot or an open socket get a full
+    status() request on the poll pool (pushes only carry the DPS that
+    changed, and connecting may block), plugs due a
+    heartbeat get one (a non-blocking send), then a single select() waits
+    up to LISTEN_SLICE on all open session sockets and the readable ones
+    are drained. A session busy with a poll or command is skipped until
+    the next pass rather than waited for. Updates are merged into the
+    snapshot before being parsed and handed to on_update.
+    """
+
+    def __init__(self, on_update=None, device_keys=None):
+        super().__init__(name="tuya-listen", daemon=True)
+        self.on_update   = on_update
+        self.device_keys = tuple(device_keys) if device_keys is not None else None
+        self.devices     = {}      # device_key -> PushState
+        self._seeding    = {}      # device_key -> Future of the snapshot request
+        self._lock       = threading.Lock()
+        self._stop       = threading.Event()
+
+    def fresh(self, key: str) -> bool:
+        st = self.devices.get(key)
+        return st is not None and st.fresh()
+
+    def status(self, key: str) -> dict | None:
+        with self._lock:
+            st = self.devices.get(key)
+            return _parse_status(key, dict(st.dps)) if st and st.dps else None
+
+    def forget(self, key: str) -> None:
+        """Drop a plug's pushed state (removed from the registry or reconnected)."""
+        with self._lock:
+            self.devices.pop(key, None)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                watched = self._prepare()
+                if not watched:
+                    self._stop.wait(LISTEN_SLICE)
+                    continue
+                readable, _, _ = select.select(list(watched), [], [], LISTEN_SLICE)
+            except (OSError, ValueError):
+                # A socket was closed under us by a poll or command
+                self._stop.wait(0.05)
+                continue
+            for sock in readable:
+                self._receive(watched[sock])
+
+    def _prepare(self) -> dict:
+        """Seed / heartbeat as due; returns {socket: device_key} to select() on."""
+        keys = self.device_keys if self.device_keys is not None else tuple(DEVICES)
+        now = time.monotonic()
+        watched = {}
+        for key in keys:
+            if key not in DEVICES:
+                continue
+            with self._lock:
+                st = self.devices.setdefault(key, PushState())
+            sess = session(key)
+
+            if not st.dps or sess.socket() is None:
+                # Connecting can block for SOCKET_TIMEOUT, so it happens on the pool
+                if now >= max(st.seed_after, sess.breaker.retry_at):
+                    self._seed(key, st)
+                continue
+
+            if now - st.last_heartbeat >= HEARTBEAT_INTERVAL:
+                data = sess.call(lambda d: d.heartbeat(nowait=True), blocking=False)
+                if data is SESSION_BUSY:
+                    continue
+                st.last_heartbeat = now
+                if self._failed(key, st, data):
+                    continue
+
+            sock = sess.socket()
+            if sock is not None:
+                watched[sock] = key
+        return watched
+
+    def _seed(self, key: str, st: PushState) -> None:
+        fut = self._seeding.get(key)
+        if fut is not None and not fut.done():
+            return
+
+        def request():
+            data = session(key).call(lambda d: d.status())
+            if not self._failed(key, st, data):
+                st.last_heartbeat = time.monotonic()
+                self._apply(key, st, data)
+
+        self._seeding[key] = _poll_pool.submit(request)
+
+    def _receive(self, key: str) -> None:
+        with self._lock:
+            st = self.devices.get(key)
+        if st is None:
+            return
+        data = session(key).call(_receive_slice, blocking=False)
+        if data is SESSION_BUSY or self._failed(key, st, data):
+            return
+        if data:
+            self._apply(key, st, data)
+
+    def _failed(self, key: str, st: PushState, data) -> bool:
+        if not (isinstance(data, dict) and data.get("Error")):
+            return False
+        # Session is down (or backing off) — polling covers the gap
+        with self._lock:
+            st.dps = {}
+        st.seed_after = time.monotonic() + HEARTBEAT_INTERVAL
+        return True
+
+    def _apply(self, key: str, st: PushState, data: dict) -> None:
+        st.last_seen = time.monotonic()
+        dps = data.get("dps")
+        if not dps:
+            return      # heartbeat / ack
+        with self._lock:
+            st.dps.update(dps)
+            st.updates += 1
+            try:
+                status = _parse_status(key, dict(st.dps))
+            except Exception as e:
+                print(f"[tuya_local] listener({key}) bad DPS {dps}: {e}")
+                return
+        if self.on_update:
+            try:
+                self.on_update(key, status)
+            except Exception as e:
+                print(f"[tuya_local] listener({key}) callback error: {e}")
+
+
+def _receive_slice(d):
+    """Wait up to LISTEN_SLICE for a pushed frame; None if nothing arrived."""
+    d.set_socketTimeout(LISTEN_SLICE)
+    try:
+        return d.receive()
+    finally:
+        d.set_socketTimeout(SOCKET_TIMEOUT)
+
+
+_hub = None
+
+
+def start_listeners(on_update=None, device_keys=None):
+    """
+    Start the ListenerHub (no-op when TUYA_LISTEN=0). It follows DEVICES
+    unless limited to `device_keys`. on_update(device_key, status) is
+    called from the hub thread on every pushed DPS change.
+    """
+    global _hub
+    if not LISTEN_MODE:
+        return None
+    if _hub is None or not _hub.is_alive():
+        _hub = ListenerHub(on_update, device_keys)
+        _hub.start()
+    return _hub
+
+
+def listener_fresh(device_key: str) -> bool:
+    """True when the device's status can be served from pushed updates."""
+    return _hub is not None and _hub.fresh(device_key)
+
+
+def stop_listeners() -> None:
+    if _hub is not None:
+        _hub.stop()
+
+
+atexit.register(stop_listeners)
+
+
+# ── Registry reload ────────────────────────────────────────────────────────
+
+_registry_hooks = []
+_registry_mtime = device_registry.mtime()
+_registry_lock  = threading.Lock()
+
+_CONNECTION_FIELDS = ("id", "ip", "key", "version")
+
+
+def on_registry_change(callback) -> None:
+    """Register callback(added, removed, changed) — lists of device keys — for every reload."""
+    _registry_hooks.append(callback)
+
+
+def reload_devices(force: bool = False) -> bool:
+    """
+    Re-read the registry if its file changed (or `force`). A file that
+    fails to parse leaves the running registry untouched. Addresses learnt
+    from discovery are kept unless the file's own ip / version for that
+    plug was edited. Returns True when DEVICES was replaced.
+    """
+    global DEVICES, _registry_mtime
+    with _registry_lock:
+        mtime = device_registry.mtime()
+        if not force and mtime == _registry_mtime:
+            return False
+        _registry_mtime = mtime
+        try:
+            new = _with_discovered(device_registry.load())
+        except (OSError, ValueError) as e:
+            print(f"[tuya_local] registry not reloaded: {e}")
+            return False
+
+        old = DEVICES
+        added   = [k for k in new if k not in old]
+        removed = [k for k in old if k not in new]
+        changed = [k for k in new if k in old and new[k] != old[k]]
+        DEVICES = new
+
+    # Removed plugs, and plugs whose connection changed, start from scratch
+    _reset(removed + [k for k in changed
+                      if any(old[k][f] != new[k][f] for f in _CONNECTION_FIELDS)])
+    print(f"[tuya_local] registry reloaded: {len(new)} devices "
+          f"(+{len(added)} -{len(removed)} ~{len(changed)})")
+    _notify_registry(added, removed, changed)
+    return True
+
+
+def registry_loop(interval: float = device_registry.RELOAD_INTERVAL) -> None:
+    """Background thread target: pick up registry edits every `interval` seconds."""
+    while True:
+        time.sleep(interval)
+        reload_devices()
+
+
+def _reset(keys: list) -> None:
+    for key in keys:
+        with _sessions_lock:
+            s = _sessions.pop(key, None)
+        if s is not None:
+            s.close()
+        if _hub is not None:
+            _hub.forget(key)
+
+
+def _notify_registry(added: list, removed: list, changed: list) -> None:
+    for hook in list(_registry_hooks):
+        try:
+            hook(added, removed, changed)
+        except Exception as e:
+            print(f"[tuya_local] registry hook error: {e}")
+
+
+# ── Discovery ──────────────────────────────────────────────────────────────
+# Addresses learnt from tuya_discovery beacons override the registry file:
+# device_key -> {"file": (ip, version) as in the file, "ip": ..., "version": ...}
+
+_discovered = {}
+_id_index   = (None, {})     # (DEVICES it was built from, {device id: device_key})
+
+
+def apply_beacon(dev_id: str, info: dict) -> None:
+    """
+    tuya_discovery on_beacon hook: when a registered plug announces an
+    address (or protocol version) other than the one in DEVICES, follow
+    it and reconnect. Called for every beacon; unchanged ones cost a dict
+    lookup.
+    """
+    global DEVICES, _id_index
+    devices = DEVICES
+    if _id_index[0] is not devices:
+        _id_index = (devices, {cfg["id"]: k for k, cfg in devices.items()})
+    key = _id_index[1].get(dev_id)
+    if key is None:
+        return
+    cfg = devices[key]
+    version = info["version"] if info["version"] in device_registry.VERSIONS else cfg["version"]
+    if (cfg["ip"], cfg["version"]) == (info["ip"], version):
+        return
+
+    with _registry_lock:
+        cfg = DEVICES.get(key)
+        if cfg is None or (cfg["ip"], cfg["version"]) == (info["ip"], version):
+            return
+        prev = _discovered.get(key)
+        _discovered[key] = {
+            "file":    prev["file"] if prev else (cfg["ip"], cfg["version"]),
+            "ip":      info["ip"],
+            "version": version,
+        }
+        DEVICES = {**DEVICES, key: {**cfg, "ip": info["ip"], "version": version}}
+
+    print(f"[tuya_local] {key}: discovered at {info['ip']} v{version} "
+          f"(was {cfg['ip']} v{cfg['version']})")
+    _reset([key])
+    _notify_registry([], [], [key])
+
+
+def _with_discovered(devices: dict) -> dict:
+    """Re-apply discovered addresses to a freshly loaded registry (caller holds _registry_lock)."""
+    for key, cfg in devices.items():
+        found = _discovered.get(key)
+        if found and found["file"] != (cfg["ip"], cfg["version"]):
+            del _discovered[key]        # the file was edited for this plug: it wins
+            found = None
+        if found is None and not cfg["ip"]:
+            # No address in the file: use a beacon heard before the plug was added
+            beacon = tuya_discovery.cache.lookup(cfg["id"])
+            if beacon:
+                found = _discovered[key] = {
+                    "file": (cfg["ip"], cfg["version"]), "ip": beacon["ip"],
+                    "version": beacon["version"] if beacon["version"] in device_registry.VERSIONS
+                               else cfg["version"],
+                }
+        if found:
+            devices[key] = {**cfg, "ip": found["ip"], "version": found["version"]}
+    return devices
+
+
+def device_ids() -> list:
+    """Tuya device ids of every registered plug."""
+    return [cfg["id"] for cfg in DEVICES.values()]
+
+
 def set_switch(device_key: str, state: bool) -> bool:
     """Turn device on (True) or off (False). Returns True on success."""
+    dp = dps_id(device_key, "switch")
+    if dp is None:
+        return False
     try:
-        d = _get_device(device_key)
-        result = d.turn_on() if state else d.turn_off()
+        result = session(device_key).call(
+            lambda d: d.turn_on(switch=dp) if state else d.turn_off(switch=dp),
+            respect_backoff=False)
         if isinstance(result, dict) and result.get("Error"):
             print(f"[tuya_local] set_switch error: {result}")
             return False
@@ -105,9 +739,12 @@ def set_switch(device_key: str, state: bool) -> bool:
 
 def set_child_lock(device_key: str, locked: bool) -> bool:
     """Enable or disable child lock."""
+    dp = dps_id(device_key, "child_lock")
+    if dp is None:
+        return False
     try:
-        d = _get_device(device_key)
-        result = d.set_value("40", locked)
+        result = session(device_key).call(
+            lambda d: d.set_value(dp, locked), respect_backoff=False)
         if isinstance(result, dict) and result.get("Error"):
             return False
         return True
@@ -118,9 +755,12 @@ def set_child_lock(device_key: str, locked: bool) -> bool:
 
 def set_countdown(device_key: str, seconds: int) -> bool:
     """Set countdown timer in seconds (0 = cancel)."""
+    dp = dps_id(device_key, "countdown")
+    if dp is None:
+        return False
     try:
-        d = _get_device(device_key)
-        result = d.set_value("9", seconds)
+        result = session(device_key).call(
+            lambda d: d.set_value(dp, seconds), respect_backoff=False)
         if isinstance(result, dict) and result.get("Error"):
             return False
         return True
@@ -133,9 +773,12 @@ def set_led_mode(device_key: str, mode: str) -> bool:
     """Set LED indicator mode: 'relay' | 'pos' | 'none'"""
     if mode not in {"relay", "pos", "none"}:
         return False
+    dp = dps_id(device_key, "led_mode")
+    if dp is None:
+        return False
     try:
-        d = _get_device(device_key)
-        result = d.set_value("39", mode)
+        result = session(device_key).call(
+            lambda d: d.set_value(dp, mode), respect_backoff=False)
         if isinstance(result, dict) and result.get("Error"):
             return False
         return True
@@ -1,31 +1,33 @@
 """
 tuya_plug.py  (rewritten)
 =========================
-NiceGUI dashboard for two smart plugs via tinytuya local LAN.
-- Smart Plug  (192.168.1.2)  : full control
-- Server Plug (192.168.1.15) : full control + double-confirm OFF
+NiceGUI dashboard for the smart plugs in the device registry
+(device_registry.py) via tinytuya local LAN.
+- every plug      : full control
+- is_server plugs : full control + double-confirm OFF
 
 Storage : MariaDB (homelab db)
 Metrics : Prometheus on port 2000
-Polling : every 10s via background thread
+Polling : adaptive per plug (pipeline.AdaptivePoller), base 10s
 """
 
-import os
 import threading
-import time
-from collections import deque
-from datetime import datetime
+from collections import defaultdict, deque
 
 from dotenv import load_dotenv
 from nicegui import ui
 from prometheus_client import Counter, Gauge, start_http_server
 
 import db
+import pipeline
+import schema
+import sinks
+import tuya_discovery
 import tuya_local
 
 load_dotenv()
 
-POLL_INTERVAL  = 10     # seconds
+POLL_INTERVAL  = 10     # seconds, AdaptivePoller base interval
 HISTORY_MAXLEN = 120    # chart data points
 
 # ── Prometheus ─────────────────────────────────────────────────────────────
@@ -35,69 +37,80 @@ g_current = Gauge("tuya_plug_current_ma",      "Current (mA)",["device"])
 g_energy  = Gauge("tuya_plug_energy_kwh",      "Energy (kWh)",["device"])
 g_switch  = Gauge("tuya_plug_switch_state",    "Switch",      ["device"])
 c_cmds    = Counter("tuya_commands_total",     "Commands",    ["device", "action"])
+c_breaker = Counter("tuya_breaker_transitions_total", "Circuit breaker transitions",
+                    ["device", "from_state", "to_state"])
+g_breaker = Gauge("tuya_breaker_open",         "Circuit open (1) / half-open (0.5) / closed (0)", ["device"])
 
 # ── Shared state ───────────────────────────────────────────────────────────
-state: dict = {
-    "plug":   {"status": None, "ok": False, "history": deque(maxlen=HISTORY_MAXLEN)},
-    "server": {"status": None, "ok": False, "history": deque(maxlen=HISTORY_MAXLEN)},
-}
+# One entry per registry device, created on first use
+state: dict = defaultdict(
+    lambda: {"status": None, "ok": False, "history": deque(maxlen=HISTORY_MAXLEN)})
 state_lock       = threading.Lock()
-last_poll_wh: dict = {"plug": None, "server": None}  # track prev wh for delta
 
 # ── Polling thread ─────────────────────────────────────────────────────────
 
+def _apply_reading(dev_key: str, r):
+    """Pipeline on_state hook — only the shared UI state, under state_lock."""
+    with state_lock:
+        if r is None:
+            state[dev_key]["ok"] = False
+            return
+        state[dev_key]["status"] = r["status"]
+        state[dev_key]["ok"]     = True
+        state[dev_key]["history"].append({
+            "t": r["polled_at"].strftime("%H:%M:%S"),
+            "w": r["status"]["watts"],
+        })
+
+
+plug_poller   = pipeline.AdaptivePoller(base=POLL_INTERVAL)   # follows the device registry
+plug_pipeline = pipeline.Pipeline(plug_poller, on_state=_apply_reading)
+
+
 def polling_loop():
-    global last_poll_wh
-    last_poll_time = {"plug": None, "server": None}
+    plug_pipeline.run(pipeline.SCHEDULER_TICK)
 
-    while True:
-        for dev_key in ("plug", "server"):
-            status = tuya_local.get_status(dev_key)
-            now    = time.time()
 
-            with state_lock:
-                if status:
-                    state[dev_key]["status"] = status
-                    state[dev_key]["ok"]     = True
-                    state[dev_key]["history"].append({
-                        "t": datetime.now().strftime("%H:%M:%S"),
-                        "w": status["watts"],
-                    })
-
-                    # Prometheus
-                    n = status["device_name"]
-                    g_power.labels(n).set(status["watts"])
-                    g_voltage.labels(n).set(status["voltage"])
-                    g_current.labels(n).set(status["current_ma"])
-                    g_energy.labels(n).set(status["add_ele_kwh"])
-                    g_switch.labels(n).set(1 if status["switch"] else 0)
-
-                    # Wh delta calculation
-                    wh_delta = 0.0
-                    if last_poll_time[dev_key]:
-                        elapsed_h = (now - last_poll_time[dev_key]) / 3600
-                        wh_delta  = status["watts"] * elapsed_h
-
-                    last_poll_time[dev_key] = now
-
-                    # Store to MariaDB
-                    try:
-                        db.insert_energy(
-                            device_id=tuya_local.DEVICES[dev_key]["id"],
-                            device_name=status["device_name"],
-                            watts=status["watts"],
-                            wh_delta=wh_delta,
-                            voltage=status["voltage"],
-                            current_ma=status["current_ma"],
-                        )
-                        # Refresh daily aggregate every poll
-                        db.aggregate_daily(tuya_local.DEVICES[dev_key]["id"])
-                    except Exception as e:
-                        print(f"[db] insert error ({dev_key}): {e}")
-                else:
-                    state[dev_key]["ok"] = False
+def _on_breaker_change(dev_key: str, old: str, new: str):
+    c_breaker.labels(dev_key, old, new).inc()
+    g_breaker.labels(dev_key).set({"open": 1, "half_open": 0.5}.get(new, 0))
+
+
+def metrics_sink(r: dict):
+    """Prometheus gauges for one reading."""
+    s = r["status"]
+    n = s["device_name"]
+    g_power.labels(n).set(s["watts"])
+    g_voltage.labels(n).set(s["voltage"])
+    g_current.labels(n).set(s["current_ma"])
+    g_energy.labels(n).set(s["add_ele_kwh"])
+    g_switch.labels(n).set(1 if s["switch"] else 0)
+
+
+def _on_push(dev_key: str, status: dict):
+    """Listener callback — pushed DPS changes update the live view immediately."""
+    with state_lock:
+        state[dev_key]["status"] = status
+        state[dev_key]["ok"]     = True
+    g_power.labels(status["device_name"]).set(status["watts"])
+    g_switch.labels(status["device_name"]).set(1 if status["switch"] else 0)
+
 
-        time.sleep(POLL_INTERVAL)
+def _on_registry_change(added: list, removed: list, changed: list):
+    """Drop state and metric series of plugs removed from the registry."""
+    with state_lock:
+        gone = [state.pop(dk, None) for dk in removed]
+    for dk, entry in zip(removed, gone):
+        name = entry and entry["status"] and entry["status"]["device_name"]
+        for g in (g_power, g_voltage, g_current, g_energy, g_switch) if name else ():
+            try:
+                g.remove(name)
+            except KeyError:
+                pass
+        try:
+            g_breaker.remove(dk)
+        except KeyError:
+            pass
 
 # ── CSS ────────────────────────────────────────────────────────────────────
 CUSTOM_CSS = """
@@ -477,15 +490,27 @@ def dashboard():
             ui.button(icon="contrast", on_click=_toggle_dark).classes("mode-btn").props("flat dense")
 
     with ui.element("div").classes("wrap"):
-        with ui.element("div").classes("dev-grid"):
-            plug_refs   = build_device_panel("plug")
-            server_refs = build_device_panel("server")
+        dev_grid = ui.element("div").classes("dev-grid")
 
         with ui.element("div").classes("prom-bar"):
-            ui.html(f"📊 Prometheus → <span>http://&lt;host&gt;:2000/metrics</span> · Polling every <span>{POLL_INTERVAL}s</span>")
+            poll_bar = ui.html(_poll_bar_html())
+
+    panel_refs: dict = {}
+    built_from = {"devices": None}
+
+    def build_panels():
+        """One panel per registry device; rebuilt when the registry changes."""
+        built_from["devices"] = tuya_local.DEVICES
+        dev_grid.clear()
+        panel_refs.clear()
+        with dev_grid:
+            for dk in built_from["devices"]:
+                panel_refs[dk] = build_device_panel(dk)
+
+    build_panels()
 
     # ── Live update timer ──────────────────────────────────────────────────
-    def update_panel(refs: dict):
+    def update_panel(refs: dict, today: dict | None):
         dk = refs["dev_key"]
         with state_lock:
             s  = state[dk]["status"]
@@ -510,32 +535,66 @@ def dashboard():
         refs["ref_total_kwh"].set_text(f"{s['add_ele_kwh']:.3f}")
 
         # Today's energy from DB
-        try:
-            today = db.get_today_summary(refs["dev_id"])
+        if today:
             refs["ref_today_kwh"].set_text(f"{today['total_kwh']:.4f}")
             refs["ref_today_rm"].set_text(f"RM {today['cost_rm']:.4f}")
-        except Exception:
-            pass
 
         # Chart
         refs["chart"].options = chart_options(dk)
         refs["chart"].update()
 
     def _refresh():
-        update_panel(plug_refs)
-        update_panel(server_refs)
-
+        if tuya_local.DEVICES != built_from["devices"]:
+            build_panels()
+        # One query for every panel's today summary
+        try:
+            today = db.get_today_summary_many([refs["dev_id"] for refs in panel_refs.values()])
+        except Exception:
+            today = {}
+        for refs in panel_refs.values():
+            update_panel(refs, today.get(refs["dev_id"]))
+        poll_bar.set_content(_poll_bar_html())
+
+    def _watch():
+        # Every panel of this page is on screen: keep them on the fast
+        # interval while the page is open (the timer dies with the client)
+        for dk in panel_refs:
+            plug_poller.watch(dk)
+
+    _watch()
     ui.timer(2.0, _refresh)
+    ui.timer(pipeline.POLL_WATCH_TTL / 2, _watch)
+
+
+def _poll_bar_html() -> str:
+    intervals = plug_poller.intervals()
+    now = " · ".join(f"{cfg['name']} <span>{intervals[dk]:.0f}s</span>"
+                     for dk, cfg in tuya_local.DEVICES.items() if dk in intervals)
+    return (f"📊 Prometheus → <span>http://&lt;host&gt;:2000/metrics</span> · "
+            f"Adaptive polling, base <span>{POLL_INTERVAL}s</span>" + (f" · now {now}" if now else ""))
 
 
 # ── Entry point ─────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
+    try:
+        schema.migrate(verbose=True)
+    except Exception as e:
+        print(f"[schema] migration error: {e}")
+
     start_http_server(2000)
     print("Prometheus metrics → http://localhost:2000/metrics")
 
+    tuya_local.on_breaker_change(_on_breaker_change)
+    sinks.register("metrics", metrics_sink)
+    sinks.register("db",      sinks.db_sink)
+    tuya_local.on_registry_change(_on_registry_change)
+    tuya_local.start_listeners(on_update=_on_push)
+    tuya_discovery.start(on_beacon=tuya_local.apply_beacon)
+    threading.Thread(target=tuya_local.registry_loop, daemon=True).start()
     threading.Thread(target=polling_loop, daemon=True).start()
-    print(f"Polling both plugs every {POLL_INTERVAL}s...")
+    threading.Thread(target=db.reconcile_loop, args=(tuya_local.device_ids,), daemon=True).start()
+    print(f"Polling {len(tuya_local.DEVICES)} plugs adaptively (base {POLL_INTERVAL}s)...")
 
     ui.run(title="Smart Plug Monitor", host="0.0.0.0", port=3003,
            favicon="⚡", dark=True, reload=False)
\ No newline at end of file